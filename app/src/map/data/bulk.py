@@ -0,0 +1,133 @@
+import os
+import tempfile
+import time
+
+from app.src.map.data.srid import geometry_from_wkb
+
+
+def bulk_insert(conn, table, columns, rows, geometry_columns=('Coordinates',), chunk_size=5000, load_data=False,
+                progress=None, commit=True):
+    """
+    Insert many rows into a table, sending the geometries as WKB.
+
+    The rows are written either as multi-row INSERT statements of chunk_size rows each, or with
+    LOAD DATA LOCAL INFILE from a temporary tab separated file holding the WKB as hex. All rows are
+    committed in one transaction and the throughput is reported once they are in. A failed insert is rolled back.
+
+    Args:
+        conn: Database connection object, load_data needs it opened with allow_local_infile.
+        table (str): Name of the table to insert into.
+        columns (list): Column names in the order of the row values.
+        rows (iterable): Tuples of column values, the geometry column values are the WKB bytes.
+        geometry_columns (tuple): Names of the geometry columns.
+        chunk_size (int): Number of rows sent per INSERT statement.
+        load_data (bool): Load the rows with LOAD DATA LOCAL INFILE instead of INSERT statements.
+        progress (callable): Called with the number of rows sent so far after every chunk_size rows, an exception
+                             it raises rolls the insert back.
+        commit (bool): Commit the rows, otherwise they are left in the open transaction for the caller to commit.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        if load_data:
+            count = _load_data(cursor, table, columns, rows, geometry_columns, chunk_size, progress)
+        else:
+            count = _insert_chunks(cursor, table, columns, rows, geometry_columns, chunk_size, progress)
+        if commit:
+            conn.commit()
+
+        elapsed = time.perf_counter() - started
+        print(f"{count} GeoPolygons inserted into {table} successfully in {elapsed:.2f}s "
+              f"({count / elapsed if elapsed > 0 else count:.0f} rows/s)!")
+        return count
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cursor.close()
+
+
+def _insert_chunks(cursor, table, columns, rows, geometry_columns, chunk_size, progress):
+    row_placeholder = '({})'.format(', '.join(
+        geometry_from_wkb() if column in geometry_columns else '%s' for column in columns))
+    insert_query = 'INSERT INTO {} ({}) VALUES '.format(table, ', '.join(columns))
+
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.extend(row)
+        count += 1
+        if count % chunk_size == 0:
+            cursor.execute(insert_query + ', '.join([row_placeholder] * chunk_size), chunk)
+            chunk = []
+            if progress is not None:
+                progress(count)
+
+    if chunk:
+        cursor.execute(insert_query + ', '.join([row_placeholder] * (len(chunk) // len(columns))), chunk)
+    if progress is not None:
+        progress(count)
+    return count
+
+
+def _load_data(cursor, table, columns, rows, geometry_columns, chunk_size, progress):
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    try:
+        count = 0
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as file:
+            for row in rows:
+                file.write('\t'.join(
+                    value.hex() if column in geometry_columns and value is not None else _tsv_value(value)
+                    for column, value in zip(columns, row)))
+                file.write('\n')
+                count += 1
+                if progress is not None and count % chunk_size == 0:
+                    progress(count)
+
+        # The geometries go through user variables so they can be decoded from hex on the way in
+        variables = {column: f'@geometry_{position}' for position, column in enumerate(geometry_columns)}
+        targets = [variables.get(column, column) for column in columns]
+        load_query = """
+        LOAD DATA LOCAL INFILE '{}' INTO TABLE {}
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+        LINES TERMINATED BY '\\n'
+        ({})
+        SET {}
+        """.format(path.replace('\\', '\\\\').replace("'", "\\'"), table, ', '.join(targets),
+                   ', '.join(f'{column} = {geometry_from_wkb(f"UNHEX({variable})")}'
+                             for column, variable in variables.items()))
+        cursor.execute(load_query)
+        if progress is not None:
+            progress(count)
+        return count
+
+    finally:
+        os.remove(path)
+
+
+def _tsv_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def column_values(frame, key):
+    """
+    Get a DataFrame column as plain Python values, with missing values as None.
+
+    Args:
+        frame (DataFrame): The frame holding the column.
+        key (str): Name of the column.
+
+    Returns:
+        list: The column values.
+    """
+    series = frame[key]
+    return series.astype(object).where(series.notna(), None).tolist()
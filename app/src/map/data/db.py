@@ -1,18 +1,192 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 
 import mysql.connector
 
 
+def connection_settings():
+    """
+    Read the database connection settings from the environment.
+
+    Returns:
+        dict: Keyword arguments for mysql.connector.connect.
+    """
+    return {
+        'host': os.getenv("DB_HOST"),
+        'user': os.getenv("DB_USER"),
+        'password': os.getenv("DB_PASSWORD"),
+        'database': os.getenv("DB_NAME"),
+        # Needed to bulk load polygons with LOAD DATA LOCAL INFILE
+        'allow_local_infile': os.getenv("DB_ALLOW_LOCAL_INFILE", "false").lower() == "true",
+    }
+
+
 def init_conn():
-    host = os.getenv("DB_HOST")
-    user = os.getenv("DB_USER")
-    password = os.getenv("DB_PASSWORD")
-    db_name = os.getenv("DB_NAME")
-    conn = mysql.connector.connect(
-        host=host,
-        user=user,
-        password=password,
-        database=db_name
-    )
+    conn = mysql.connector.connect(**connection_settings())
 
     return conn
+
+
+def init_pool():
+    """
+    Create a connection pool configured from the environment.
+
+    DB_POOL_SIZE (default 5) is the maximum number of connections, DB_POOL_TIMEOUT (default 30) the seconds a
+    request waits for a free connection and DB_POOL_HEALTH_CHECK (default true) whether a connection is pinged,
+    and reconnected if needed, every time it is borrowed.
+
+    Returns:
+        ConnectionPool: The connection pool.
+    """
+    return ConnectionPool(
+        size=int(os.getenv("DB_POOL_SIZE", "5")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        health_check=os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() == "true",
+    )
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, size=5, timeout=30, health_check=True, connect=init_conn):
+        """
+        Initialize a thread-safe pool of database connections.
+
+        Connections are opened lazily up to size and handed out one per borrower, a borrower waits up to
+        timeout seconds when all of them are in use.
+
+        Args:
+            size (int): Maximum number of open connections.
+            timeout (float): Seconds to wait for a free connection before raising PoolTimeoutError.
+            health_check (bool): Ping a connection when it is borrowed and reconnect it if it dropped.
+            connect (callable): Opens a new connection.
+        """
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._connect = connect
+        # Idle connections are reused last in first out, the condition is notified whenever a connection or a
+        # slot to open one is freed
+        self._idle = []
+        self._lock = threading.Condition()
+        self._opened = 0
+        self._in_use = 0
+        self._borrows = 0
+        self._saturated = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block.
+
+        Any transaction left open is rolled back when the connection is returned, so the next borrower starts
+        from a fresh snapshot.
+
+        Yields:
+            The database connection.
+        """
+        conn = self._borrow()
+        try:
+            yield conn
+        finally:
+            self._return(conn)
+
+    def _borrow(self):
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        conn = None
+        with self._lock:
+            if not self._idle and self._opened >= self.size:
+                self._saturated += 1
+            while not self._idle and self._opened >= self.size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(f"No database connection was free within {self.timeout}s")
+                self._lock.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                self._opened += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+
+        if self.health_check and not conn.is_connected():
+            try:
+                conn.reconnect(attempts=1)
+            except Exception:
+                # The dead connection gives its slot back, so the next borrow opens a new one instead of waiting
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                self._release_slot()
+                raise
+            with self._lock:
+                self._reconnects += 1
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._borrows += 1
+            self._in_use += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+        return conn
+
+    def _return(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception as e:
+            # A broken connection is dropped, the pool opens a new one when it is needed
+            print(f"Discarding database connection: {e}")
+            with self._lock:
+                self._in_use -= 1
+            self._release_slot()
+            return
+        with self._lock:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._lock.notify()
+
+    def _release_slot(self):
+        # Wakes a waiting borrower so it opens a connection in the freed slot instead of timing out
+        with self._lock:
+            self._opened -= 1
+            self._lock.notify()
+
+    def stats(self):
+        """
+        Get the pool usage counters.
+
+        Returns:
+            dict: Size, open and in use connections, borrows, borrows that had to wait for a connection
+                  (saturated), timeouts, reconnects and the total, average and maximum wait in seconds.
+        """
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'in_use': self._in_use,
+                'borrows': self._borrows,
+                'saturated': self._saturated,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+                'wait_time': self._wait_time,
+                'average_wait_time': self._wait_time / self._borrows if self._borrows else 0.0,
+                'max_wait_time': self._max_wait_time,
+            }
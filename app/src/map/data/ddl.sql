@@ -1,37 +1,106 @@
 USE map_db;
 
+-- Tables referencing State are dropped before it
 DROP TABLE IF EXISTS Polygon_Referenced_By_State;
-
+DROP TABLE IF EXISTS Polygon_Referenced_By_Country;
+DROP TABLE IF EXISTS Grid;
+DROP TABLE IF EXISTS Feature_Hash;
+DROP TABLE IF EXISTS Schema_Version;
 DROP TABLE IF EXISTS State;
 
 CREATE TABLE State
 (
     Id   BIGINT AUTO_INCREMENT PRIMARY KEY,
     Code VARCHAR(10)  NOT NULL,
-    Name VARCHAR(100) NOT NULL
+    Name VARCHAR(100) NOT NULL,
+    INDEX (Code)
 );
 
 CREATE TABLE Polygon_Referenced_By_State
 (
-    Id           BIGINT AUTO_INCREMENT PRIMARY KEY,
-    ObjectId     BIGINT       NULL,
-    State_Id     BIGINT       NULL,
-    CapCity      VARCHAR(50)  NULL,
-    Source       VARCHAR(255) NULL,
-    Shape_Area   FLOAT        NULL,
-    Shape_Length FLOAT        NULL,
-    Geo_Zone     VARCHAR(50)  NULL,
-    Coordinates  GEOMETRY     NOT NULL,
-    Metadata     LONGTEXT     NULL,
+    Id             BIGINT AUTO_INCREMENT PRIMARY KEY,
+    ObjectId       BIGINT       NULL,
+    State_Id       BIGINT       NULL,
+    CapCity        VARCHAR(50)  NULL,
+    Source         VARCHAR(255) NULL,
+    Shape_Area     FLOAT        NULL,
+    Shape_Length   FLOAT        NULL,
+    Geo_Zone       VARCHAR(50)  NULL,
+    Coordinates    GEOMETRY     NOT NULL SRID 4326,
+    Metadata       LONGTEXT     NULL,
+    Grid_Col       INT          NULL,
+    Grid_Row       INT          NULL,
+    Resolution     INT          NOT NULL DEFAULT 0,
+    Cell_Id        BIGINT       NULL,
+    Parent_Cell_Id BIGINT       NULL,
+    Cell_Key       BIGINT       NULL,
+    Grid_Id        BIGINT       NULL,
+    Simplified_1   GEOMETRY     NULL SRID 4326,
+    Simplified_2   GEOMETRY     NULL SRID 4326,
+    Simplified_3   GEOMETRY     NULL SRID 4326,
+    SPATIAL INDEX (Coordinates),
+    INDEX (Resolution, Grid_Col, Grid_Row),
+    INDEX (Resolution, Cell_Key),
+    INDEX (Cell_Id),
+    INDEX (Parent_Cell_Id),
+    INDEX (Grid_Id),
+    INDEX (State_Id),
     CONSTRAINT FOREIGN KEY (State_Id) REFERENCES State (Id)
 );
 
-DROP TABLE IF EXISTS Polygon_Referenced_By_Country;
-
 CREATE TABLE Polygon_Referenced_By_Country
 (
-    Id           BIGINT AUTO_INCREMENT PRIMARY KEY,
-    Shape_Area   FLOAT        NULL,
-    Shape_Length FLOAT        NULL,
-    Coordinates  GEOMETRY     NOT NULL
+    Id             BIGINT AUTO_INCREMENT PRIMARY KEY,
+    Shape_Area     FLOAT        NULL,
+    Shape_Length   FLOAT        NULL,
+    Coordinates    GEOMETRY     NOT NULL SRID 4326,
+    Grid_Col       INT          NULL,
+    Grid_Row       INT          NULL,
+    Resolution     INT          NOT NULL DEFAULT 0,
+    Cell_Id        BIGINT       NULL,
+    Parent_Cell_Id BIGINT       NULL,
+    Cell_Key       BIGINT       NULL,
+    Grid_Id        BIGINT       NULL,
+    Simplified_1   GEOMETRY     NULL SRID 4326,
+    Simplified_2   GEOMETRY     NULL SRID 4326,
+    Simplified_3   GEOMETRY     NULL SRID 4326,
+    SPATIAL INDEX (Coordinates),
+    INDEX (Resolution, Grid_Col, Grid_Row),
+    INDEX (Resolution, Cell_Key),
+    INDEX (Cell_Id),
+    INDEX (Parent_Cell_Id),
+    INDEX (Grid_Id)
+);
+
+CREATE TABLE Grid
+(
+    Id          BIGINT AUTO_INCREMENT PRIMARY KEY,
+    Reference   VARCHAR(10) NOT NULL,
+    Origin_X    DOUBLE      NOT NULL,
+    Origin_Y    DOUBLE      NOT NULL,
+    Cell_Width  DOUBLE      NOT NULL,
+    Cell_Height DOUBLE      NOT NULL,
+    Resolutions INT         NOT NULL DEFAULT 1,
+    Created_At  DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE Feature_Hash
+(
+    Reference   VARCHAR(10)  NOT NULL,
+    Feature_Key VARCHAR(255) NOT NULL,
+    Hash        CHAR(64)     NOT NULL,
+    Min_X       DOUBLE       NOT NULL,
+    Min_Y       DOUBLE       NOT NULL,
+    Max_X       DOUBLE       NOT NULL,
+    Max_Y       DOUBLE       NOT NULL,
+    PRIMARY KEY (Reference, Feature_Key)
+);
+
+-- Migrations of app/src/map/data/migrations.py applied to the database, they find nothing to change on this
+-- schema and are only recorded
+CREATE TABLE Schema_Version
+(
+    Version     INT PRIMARY KEY,
+    Description VARCHAR(255) NOT NULL,
+    Applied_At  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
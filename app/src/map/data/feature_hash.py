@@ -0,0 +1,147 @@
+class FeatureHash:
+
+    def __init__(self, reference=None, key=None, digest=None, min_x=None, min_y=None, max_x=None, max_y=None):
+        """
+        Initialize a FeatureHash object, the fingerprint of a source GeoJSON feature as of the last extraction.
+
+        Args:
+            reference (str): STATE or COUNTRY.
+            key (str): Key identifying the feature between extractions.
+            digest (str): SHA-256 of the feature's geometry and properties.
+            min_x (float): West edge of the feature.
+            min_y (float): South edge of the feature.
+            max_x (float): East edge of the feature.
+            max_y (float): North edge of the feature.
+        """
+        self.reference = reference
+        self.key = key
+        self.digest = digest
+        self.min_x = min_x
+        self.min_y = min_y
+        self.max_x = max_x
+        self.max_y = max_y
+
+    @property
+    def bounds(self):
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+    @classmethod
+    def from_db_row(cls, row):
+        """
+        Create a FeatureHash object from a database row.
+
+        Args:
+            row (dict): Database row containing feature hash data.
+
+        Returns:
+            FeatureHash: Initialized FeatureHash object.
+        """
+        return cls(
+            reference=row['Reference'],
+            key=row['Feature_Key'],
+            digest=row['Hash'],
+            min_x=row['Min_X'],
+            min_y=row['Min_Y'],
+            max_x=row['Max_X'],
+            max_y=row['Max_Y'],
+        )
+
+    @staticmethod
+    def find_feature_hashes(conn, reference):
+        """
+        Find the feature hashes stored by the last extraction of a reference.
+
+        Args:
+            conn: Database connection object.
+            reference (str): STATE or COUNTRY.
+
+        Returns:
+            dict: FeatureHash objects by feature key.
+        """
+        cursor = conn.cursor(dictionary=True)
+        try:
+            query = """
+            SELECT *
+            FROM Feature_Hash AS fh
+            WHERE fh.Reference = %s
+            """
+
+            cursor.execute(query, (reference,))
+            return {row['Feature_Key']: FeatureHash.from_db_row(row) for row in cursor.fetchall()}
+
+        except Exception as e:
+            print(f"Error finding feature hashes: {e}")
+            return {}
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_extent(conn, reference):
+        """
+        Find the extent of the features of the last extraction of a reference, the grid covers no more than it.
+
+        Args:
+            conn: Database connection object.
+            reference (str): STATE or COUNTRY.
+
+        Returns:
+            tuple: (min_x, min_y, max_x, max_y) of the features, or None when no feature hash is stored.
+        """
+        cursor = conn.cursor()
+        try:
+            query = """
+            SELECT MIN(fh.Min_X), MIN(fh.Min_Y), MAX(fh.Max_X), MAX(fh.Max_Y)
+            FROM Feature_Hash AS fh
+            WHERE fh.Reference = %s
+            """
+
+            cursor.execute(query, (reference,))
+            row = cursor.fetchone()
+            if row is None or row[0] is None:
+                return None
+            return tuple(row)
+
+        except Exception as e:
+            print(f"Error finding feature extent: {e}")
+            return None
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def replace_feature_hashes(conn, reference, feature_hashes, commit=True):
+        """
+        Replace the feature hashes stored for a reference.
+
+        Args:
+            conn: Database connection object.
+            reference (str): STATE or COUNTRY.
+            feature_hashes (iterable of FeatureHash): The hashes of the features just extracted.
+            commit (bool): Commit the hashes, otherwise they are left in the open transaction of the extraction
+                           so they are only stored with the polygons they describe.
+
+        Raises:
+            Exception: The error the hashes failed to save with, once it is rolled back.
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM Feature_Hash WHERE Reference = %s", (reference,))
+            insert_query = """
+            INSERT INTO Feature_Hash (Reference, Feature_Key, Hash, Min_X, Min_Y, Max_X, Max_Y)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.executemany(insert_query, [(reference, fh.key, fh.digest, *fh.bounds) for fh in feature_hashes])
+            if commit:
+                conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            print(f"Error saving feature hashes: {e}")
+            raise
+
+        finally:
+            cursor.close()
+
+    def __repr__(self):
+        return f"<FeatureHash(Reference={self.reference}, Key={self.key}, Hash={self.digest})>"
@@ -0,0 +1,177 @@
+import shapely
+from shapely.geometry import Polygon
+
+# Rows fetched at a time when polygons are streamed from the database, see GeoPolygon.iter_query
+STREAM_BATCH_SIZE = 1000
+
+
+class GeoPolygon:
+    """
+    Compact base of the polygon models.
+
+    The geometry is held as the WKB read from the database, or as the shapely geometry it was created with,
+    and the coordinate list is only materialized when it is accessed. The models declare __slots__ so a
+    polygon carries no per-instance __dict__.
+    """
+    __slots__ = ('_wkb', '_geometry', '_coordinates')
+
+    def __init__(self, coordinates=None, geometry=None, wkb=None):
+        """
+        Initialize the geometry of a GeoPolygon object, any one of the arguments is enough.
+
+        Args:
+            coordinates (list of tuples): List of (longitude, latitude) coordinates defining the polygon.
+            geometry (Polygon): Shapely geometry of the polygon.
+            wkb (bytes): WKB encoding of the polygon.
+        """
+        self._coordinates = coordinates
+        self._geometry = geometry
+        self._wkb = wkb
+
+    @property
+    def geometry(self):
+        """
+        Polygon: Shapely geometry of the polygon, decoded from the WKB or built from the coordinates on first use.
+        """
+        if self._geometry is None:
+            if self._wkb is not None:
+                self._geometry = shapely.from_wkb(self._wkb)
+            elif self._coordinates is not None:
+                self._geometry = Polygon(self._coordinates)
+        return self._geometry
+
+    @property
+    def wkb(self):
+        """
+        bytes: WKB encoding of the polygon.
+        """
+        if self._wkb is None and self.geometry is not None:
+            self._wkb = shapely.to_wkb(self.geometry)
+        return self._wkb
+
+    @property
+    def coordinates(self):
+        """
+        list of tuples: (longitude, latitude) coordinates of the polygon's exterior, only materialized when accessed.
+        """
+        if self._coordinates is None and self.geometry is not None:
+            self._coordinates = list(self.geometry.exterior.coords)
+        return self._coordinates
+
+    @staticmethod
+    def containing_row(rows, longitude, latitude):
+        """
+        Find the first row whose polygon contains a point, with straight edges in longitude and latitude.
+
+        In SRID 4326 MySQL joins the vertices with geodesics, which bow away from the straight edges the grid was
+        cut with, so ST_Contains can put a point near a cell edge outside its own cell. The candidates are checked
+        here instead, the same way as the in-memory index does.
+
+        Args:
+            rows (list of dict): Candidate rows, with the geometry as Exact_WKB or else as Geometry_WKB.
+            longitude (float): Longitude of the point.
+            latitude (float): Latitude of the point.
+
+        Returns:
+            dict: The first row containing the point, None when none does or a point is on a boundary.
+        """
+        if not rows:
+            return None
+        geometries = shapely.from_wkb([bytes(row.get('Exact_WKB') or row['Geometry_WKB']) for row in rows])
+        for row, contained in zip(rows, shapely.contains_xy(geometries, longitude, latitude)):
+            if contained:
+                return row
+        return None
+
+    @staticmethod
+    def page_clauses(after_id=None, limit=None):
+        """
+        Get the clauses ending a query to read one page of its rows by keyset on the polygon ID.
+
+        Args:
+            after_id (int): Only read the polygons with a greater ID.
+            limit (int): Most polygons read.
+
+        Returns:
+            tuple: The SQL closing the WHERE clause, empty when no page is asked for, and its parameters.
+        """
+        if after_id is None and limit is None:
+            return '', ()
+        clauses, params = '', ()
+        if after_id is not None:
+            clauses, params = 'AND gp.Id > %s', (after_id,)
+        clauses += ' ORDER BY gp.Id'
+        if limit is not None:
+            clauses, params = clauses + ' LIMIT %s', (*params, limit)
+        return clauses, params
+
+    @staticmethod
+    def intersecting(polygons, min_x, min_y, max_x, max_y):
+        """
+        Keep the polygons intersecting a bounding box, with straight edges in longitude and latitude.
+
+        MBRIntersects in the database only compares bounding rectangles, the polygons it reads are checked here
+        against the box the same way as the in-memory index does, so either path finds the same polygons.
+
+        Args:
+            polygons (list): Polygon objects of a model.
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+
+        Returns:
+            list: The polygons intersecting the box, in their order.
+        """
+        if not polygons:
+            return []
+        matches = shapely.intersects(GeoPolygon.decode_geometries(polygons), shapely.box(min_x, min_y, max_x, max_y))
+        return [polygon for polygon, match in zip(polygons, matches) if match]
+
+    @classmethod
+    def iter_query(cls, conn, query, params=(), batch_size=STREAM_BATCH_SIZE):
+        """
+        Read the polygons of a query through an unbuffered cursor, batch_size rows at a time.
+
+        The rows are streamed from the server instead of being buffered whole, so only one batch of rows and of
+        polygons is held in memory. The connection cannot run another query until the generator is exhausted or
+        closed, the rows left unread are then discarded.
+
+        Args:
+            conn: Database connection object.
+            query (str): The query, selecting the columns of the model's select_columns.
+            params (tuple): The parameters of the query.
+            batch_size (int): Number of rows fetched at a time.
+
+        Yields:
+            The polygon objects of the model, in the order of the query.
+        """
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from cls.from_db_rows(rows)
+
+        finally:
+            if conn.unread_result:
+                conn.consume_results()
+            cursor.close()
+
+    @staticmethod
+    def decode_geometries(polygons):
+        """
+        Get the shapely geometries of many polygons, decoding the pending WKB of all of them in one call.
+
+        Args:
+            polygons (list of GeoPolygon): The polygons.
+
+        Returns:
+            list: The geometry of each polygon.
+        """
+        pending = [polygon for polygon in polygons if polygon._geometry is None and polygon._wkb is not None]
+        for polygon, geometry in zip(pending, shapely.from_wkb([polygon._wkb for polygon in pending])):
+            polygon._geometry = geometry
+        return [polygon.geometry for polygon in polygons]
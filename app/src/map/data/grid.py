@@ -0,0 +1,368 @@
+import math
+
+import numpy as np
+
+# Bits of a cell ID holding the offset column and the offset row, the resolution takes the bits above them.
+# The IDs stay below 2 ** 53 so they survive JSON parsers reading numbers as doubles.
+CELL_ID_BITS = 22
+CELL_ID_OFFSET = 1 << (CELL_ID_BITS - 1)
+
+# Most key ranges a bounding box lookup is split into, past it the ranges over-cover and the exact check filters
+CELL_KEY_MAX_RANGES = 32
+
+
+class Grid:
+
+    def __init__(self, gid=None, reference=None, origin_x=None, origin_y=None, cell_width=None, cell_height=None,
+                 resolutions=1, created_at=None):
+        """
+        Initialize a Grid object, the parameters of the lattice a set of polygons was cut from.
+
+        A cell's integer position is derived from these parameters, a point (longitude, latitude) lies in the cell
+        (floor((longitude - origin_x) / cell_width), floor((latitude - origin_y) / cell_height)).
+
+        The grid is a pyramid of resolutions sharing the origin, the cells of resolution r are 2 ** r times the size
+        of the base cells, so cell (col, row) of resolution r is split into the cells (2 * col + i, 2 * row + j) of
+        resolution r - 1.
+
+        Args:
+            gid (int): Grid ID, a new extraction gets a higher ID so it doubles as the grid version.
+            reference (str): STATE or COUNTRY.
+            origin_x (float): Longitude of the lower left corner of cell (0, 0).
+            origin_y (float): Latitude of the lower left corner of cell (0, 0).
+            cell_width (float): Width of each cell in degrees.
+            cell_height (float): Height of each cell in degrees.
+            resolutions (int): Number of resolutions of the pyramid, resolution 0 has the base cell size.
+            created_at (datetime): Time the grid was extracted.
+        """
+        self.gid = gid
+        self.reference = reference
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.resolutions = resolutions
+        self.created_at = created_at
+
+    @classmethod
+    def from_db_row(cls, row):
+        """
+        Create a Grid object from a database row.
+
+        Args:
+            row (dict): Database row containing grid data.
+
+        Returns:
+            Grid: Initialized Grid object.
+        """
+        return cls(
+            gid=row['Id'],
+            reference=row['Reference'],
+            origin_x=row['Origin_X'],
+            origin_y=row['Origin_Y'],
+            cell_width=row['Cell_Width'],
+            cell_height=row['Cell_Height'],
+            resolutions=row['Resolutions'],
+            created_at=row['Created_At'],
+        )
+
+    def cell_size(self, resolution=0):
+        """
+        Get the size of the cells of a resolution.
+
+        Args:
+            resolution (int): Resolution of the pyramid.
+
+        Returns:
+            tuple: The width and height of a cell in degrees.
+        """
+        return self.cell_width * 2 ** resolution, self.cell_height * 2 ** resolution
+
+    def cell_of(self, longitude, latitude, resolution=0):
+        """
+        Get the integer (col, row) position of the cell containing a point.
+
+        Args:
+            longitude (float or ndarray): Longitude of the point(s).
+            latitude (float or ndarray): Latitude of the point(s).
+            resolution (int): Resolution of the pyramid.
+
+        Returns:
+            tuple: The column and row of the cell(s).
+        """
+        cell_width, cell_height = self.cell_size(resolution)
+        col = (longitude - self.origin_x) // cell_width
+        row = (latitude - self.origin_y) // cell_height
+        if hasattr(col, 'astype'):
+            return col.astype('int64'), row.astype('int64')
+        return int(col), int(row)
+
+    def cell_range(self, min_x, min_y, max_x, max_y, resolution=0):
+        """
+        Get the range of cells covering a bounding box.
+
+        Args:
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+            resolution (int): Resolution of the pyramid.
+
+        Returns:
+            tuple: (min_col, min_row, max_col, max_row), both ends included.
+        """
+        min_col, min_row = self.cell_of(min_x, min_y, resolution)
+        max_col, max_row = self.cell_of(max_x, max_y, resolution)
+        return min_col, min_row, max_col, max_row
+
+    def has_cell_size(self, cell_width, cell_height, resolutions=1):
+        """
+        Check whether the grid was cut into cells of a size, so a new extraction can stay aligned with it.
+
+        Args:
+            cell_width (float): Width of a cell in degrees.
+            cell_height (float): Height of a cell in degrees.
+            resolutions (int): Number of resolutions of the pyramid.
+
+        Returns:
+            bool: Whether the cell sizes and the resolutions match.
+        """
+        return (math.isclose(self.cell_width, cell_width) and math.isclose(self.cell_height, cell_height)
+                and self.resolutions == resolutions)
+
+    @staticmethod
+    def cell_id(resolution, col, row):
+        """
+        Get the ID of a cell, the same for a cell position in every extraction with the same origin.
+
+        The resolution, the column and the row are packed into one integer, the column and the row are offset so
+        negative positions (cells west or south of the origin) stay positive.
+
+        Args:
+            resolution (int or ndarray): Resolution of the cell(s).
+            col (int or ndarray): Column of the cell(s).
+            row (int or ndarray): Row of the cell(s).
+
+        Returns:
+            int or ndarray: The cell ID(s).
+        """
+        if hasattr(col, 'astype'):
+            resolution = np.asarray(resolution, dtype='int64')
+            col, row = col.astype('int64'), row.astype('int64')
+        return ((resolution << (2 * CELL_ID_BITS)) | ((col + CELL_ID_OFFSET) << CELL_ID_BITS)
+                | (row + CELL_ID_OFFSET))
+
+    @staticmethod
+    def parent_cell_id(resolution, col, row):
+        """
+        Get the ID of the cell of the next coarser resolution a cell was split from.
+
+        Args:
+            resolution (int or ndarray): Resolution of the cell(s).
+            col (int or ndarray): Column of the cell(s).
+            row (int or ndarray): Row of the cell(s).
+
+        Returns:
+            int or ndarray: The parent cell ID(s).
+        """
+        return Grid.cell_id(resolution + 1, col >> 1, row >> 1)
+
+    @staticmethod
+    def cell_position(cell_id):
+        """
+        Get the position of a cell from its ID, see cell_id.
+
+        Args:
+            cell_id (int): The cell ID.
+
+        Returns:
+            tuple: The resolution, column and row of the cell.
+        """
+        mask = (1 << CELL_ID_BITS) - 1
+        return (cell_id >> (2 * CELL_ID_BITS), ((cell_id >> CELL_ID_BITS) & mask) - CELL_ID_OFFSET,
+                (cell_id & mask) - CELL_ID_OFFSET)
+
+    @staticmethod
+    def cell_key(col, row):
+        """
+        Get the Morton (Z-order) key of a cell, its offset column and row bits interleaved.
+
+        Cells close to each other get close keys and every aligned square block of cells is one contiguous range of
+        keys, so a B-tree index on the key answers area lookups with a few range scans.
+
+        Args:
+            col (int or ndarray): Column of the cell(s).
+            row (int or ndarray): Row of the cell(s).
+
+        Returns:
+            int or ndarray: The cell key(s), unique within a resolution.
+        """
+        return _spread_bits(col + CELL_ID_OFFSET) | (_spread_bits(row + CELL_ID_OFFSET) << 1)
+
+    def cell_key_ranges(self, min_x, min_y, max_x, max_y, resolution=0, max_ranges=CELL_KEY_MAX_RANGES):
+        """
+        Get the ranges of cell keys covering a bounding box.
+
+        Args:
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+            resolution (int): Resolution of the pyramid.
+            max_ranges (int): Most ranges returned, the ranges may cover cells outside the box to stay within it.
+
+        Returns:
+            list: Sorted (first_key, last_key) ranges, both ends included.
+        """
+        min_col, min_row, max_col, max_row = self.cell_range(min_x, min_y, max_x, max_y, resolution)
+        return morton_ranges(min_col, min_row, max_col, max_row, max_ranges)
+
+    def save_to_db(self, conn, commit=True):
+        """
+        Save the Grid object to the database and set its ID.
+
+        Args:
+            conn: Database connection object.
+            commit (bool): Commit the row, otherwise it is left in the open transaction for the caller to commit.
+
+        Raises:
+            Exception: The error the insert failed with, an extraction must not go on without its grid.
+        """
+        cursor = conn.cursor()
+        try:
+            insert_query = """
+            INSERT INTO Grid (Reference, Origin_X, Origin_Y, Cell_Width, Cell_Height, Resolutions)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """
+
+            cursor.execute(insert_query, (self.reference, self.origin_x, self.origin_y,
+                                          self.cell_width, self.cell_height, self.resolutions))
+            if commit:
+                conn.commit()
+            self.gid = cursor.lastrowid
+            print("Grid saved successfully!")
+
+        except Exception as e:
+            print(f"Error saving Grid: {e}")
+            raise
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_latest_grid(conn, reference):
+        """
+        Find the grid of the most recent extraction for a reference.
+
+        Args:
+            conn: Database connection object.
+            reference (str): STATE or COUNTRY.
+
+        Returns:
+            Grid: The latest Grid object, or None if nothing has been extracted.
+        """
+        cursor = conn.cursor(dictionary=True)
+        try:
+            query = """
+            SELECT *
+            FROM Grid AS g
+            WHERE g.Reference = %s
+            ORDER BY g.Id DESC
+            LIMIT 1
+            """
+
+            cursor.execute(query, (reference,))
+            row = cursor.fetchone()
+            if row:
+                return Grid.from_db_row(row)
+            else:
+                print(f"No grid has been extracted for ({reference})")
+                return None
+
+        except Exception as e:
+            print(f"Error finding grid: {e}")
+            return None
+
+        finally:
+            cursor.close()
+
+    def __repr__(self):
+        return (f"<Grid(Id={self.gid}, Reference={self.reference}, Origin=({self.origin_x}, {self.origin_y}), "
+                f"Cell=({self.cell_width}, {self.cell_height}), Resolutions={self.resolutions})>")
+
+
+def morton_ranges(min_col, min_row, max_col, max_row, max_ranges=CELL_KEY_MAX_RANGES):
+    """
+    Split a range of cells into ranges of cell keys.
+
+    The range is covered with aligned square blocks of cells from the largest down, a block inside the range is one
+    key range and a block straddling its edge is split in four, until the ranges would outgrow max_ranges and the
+    blocks still straddling the edge are taken whole.
+
+    Args:
+        min_col (int): First column.
+        min_row (int): First row.
+        max_col (int): Last column.
+        max_row (int): Last row.
+        max_ranges (int): Most ranges returned.
+
+    Returns:
+        list: Sorted (first_key, last_key) ranges, both ends included, adjacent ranges merged.
+    """
+    # Cells outside the range of the keys cannot have been stored
+    limit = (1 << CELL_ID_BITS) - 1
+    x0, y0 = max(min_col + CELL_ID_OFFSET, 0), max(min_row + CELL_ID_OFFSET, 0)
+    x1, y1 = min(max_col + CELL_ID_OFFSET, limit), min(max_row + CELL_ID_OFFSET, limit)
+    if x0 > x1 or y0 > y1:
+        return []
+
+    level = 0
+    while (x0 >> level) != (x1 >> level) or (y0 >> level) != (y1 >> level):
+        level += 1
+    blocks = [((x0 >> level) << level, (y0 >> level) << level)]
+
+    ranges = []
+    while blocks:
+        size = 1 << level
+        straddling = []
+        for x, y in blocks:
+            if x > x1 or y > y1 or x + size - 1 < x0 or y + size - 1 < y0:
+                continue
+            if level == 0 or (x >= x0 and y >= y0 and x + size - 1 <= x1 and y + size - 1 <= y1):
+                ranges.append(_block_range(x, y, level))
+            else:
+                straddling.append((x, y))
+
+        if not straddling:
+            break
+        if len(ranges) + 4 * len(straddling) > max_ranges:
+            ranges.extend(_block_range(x, y, level) for x, y in straddling)
+            break
+        level -= 1
+        half = 1 << level
+        blocks = [(x + dx, y + dy) for x, y in straddling for dy in (0, half) for dx in (0, half)]
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _block_range(x, y, level):
+    first = _spread_bits(x) | (_spread_bits(y) << 1)
+    return first, first + (1 << (2 * level)) - 1
+
+
+def _spread_bits(value):
+    # Moves bit i of a value below 2 ** 32 to bit 2 * i
+    if hasattr(value, 'astype'):
+        value = value.astype('uint64')
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        value = (value | (value << shift)) & mask
+    if hasattr(value, 'astype'):
+        value = value.astype('int64')
+    return value
@@ -0,0 +1,306 @@
+from app.src.map.data.grid import Grid
+from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
+from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
+from app.src.map.data.simplification import simplified_columns
+from app.src.map.data.srid import SRID, geometry_from_wkb
+
+POLYGON_TABLES = ['Polygon_Referenced_By_State', 'Polygon_Referenced_By_Country']
+
+# The reference of the grids the polygons of each table are extracted in
+POLYGON_TABLE_REFERENCES = {'Polygon_Referenced_By_State': 'STATE', 'Polygon_Referenced_By_Country': 'COUNTRY'}
+
+# Columns added to the polygon tables since the first schema, in table order
+POLYGON_COLUMNS = [
+    ('Grid_Col', 'INT NULL'),
+    ('Grid_Row', 'INT NULL'),
+    ('Resolution', 'INT NOT NULL DEFAULT 0'),
+    ('Cell_Id', 'BIGINT NULL'),
+    ('Parent_Cell_Id', 'BIGINT NULL'),
+    ('Cell_Key', 'BIGINT NULL'),
+] + [(column, 'GEOMETRY NULL') for column in simplified_columns()]
+
+# B-tree indexes of the polygon tables, by their columns
+POLYGON_INDEXES = [
+    ['Resolution', 'Grid_Col', 'Grid_Row'],
+    ['Resolution', 'Cell_Key'],
+    ['Cell_Id'],
+    ['Parent_Cell_Id'],
+]
+
+# Rows read and updated at once when the cell IDs and keys of existing polygons are filled in
+BACKFILL_BATCH_SIZE = 10000
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def column_srid(cursor, table, column):
+    # None when the column accepts geometries of any SRID
+    cursor.execute("""
+    SELECT SRS_ID FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def index_name(cursor, table, columns, spatial=False):
+    """
+    Find the index of a table starting with the given columns.
+
+    Args:
+        cursor: Database cursor.
+        table (str): Table name.
+        columns (list): Leading columns of the index, in order.
+        spatial (bool): Only look for a spatial index.
+
+    Returns:
+        str: Name of the index, or None when the table has none.
+    """
+    cursor.execute("""
+    SELECT INDEX_NAME, COLUMN_NAME, INDEX_TYPE FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    for name, column, index_type in cursor.fetchall():
+        if not spatial or index_type == 'SPATIAL':
+            indexes.setdefault(name, []).append(column)
+    for name, index_columns in indexes.items():
+        if index_columns[:len(columns)] == list(columns):
+            return name
+    return None
+
+
+def add_index(cursor, table, columns, spatial=False):
+    if index_name(cursor, table, columns, spatial) is None:
+        cursor.execute(f"ALTER TABLE {table} ADD {'SPATIAL ' if spatial else ''}INDEX ({', '.join(columns)})")
+
+
+def _add_grid_columns(conn, cursor):
+    # The tables and columns of the grid, incremental extraction and grid pyramid
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Grid
+    (
+        Id          BIGINT AUTO_INCREMENT PRIMARY KEY,
+        Reference   VARCHAR(10) NOT NULL,
+        Origin_X    DOUBLE      NOT NULL,
+        Origin_Y    DOUBLE      NOT NULL,
+        Cell_Width  DOUBLE      NOT NULL,
+        Cell_Height DOUBLE      NOT NULL,
+        Resolutions INT         NOT NULL DEFAULT 1,
+        Created_At  DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    if not column_exists(cursor, 'Grid', 'Resolutions'):
+        cursor.execute("ALTER TABLE Grid ADD COLUMN Resolutions INT NOT NULL DEFAULT 1 AFTER Cell_Height")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Feature_Hash
+    (
+        Reference   VARCHAR(10)  NOT NULL,
+        Feature_Key VARCHAR(255) NOT NULL,
+        Hash        CHAR(64)     NOT NULL,
+        Min_X       DOUBLE       NOT NULL,
+        Min_Y       DOUBLE       NOT NULL,
+        Max_X       DOUBLE       NOT NULL,
+        Max_Y       DOUBLE       NOT NULL,
+        PRIMARY KEY (Reference, Feature_Key)
+    )
+    """)
+
+    for table in POLYGON_TABLES:
+        previous = 'Metadata' if column_exists(cursor, table, 'Metadata') else 'Coordinates'
+        for column, definition in POLYGON_COLUMNS:
+            if not column_exists(cursor, table, column):
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition} AFTER {previous}")
+            previous = column
+        for columns in POLYGON_INDEXES:
+            add_index(cursor, table, columns)
+        _backfill_cell_keys(conn, cursor, table)
+
+
+def _backfill_cell_keys(conn, cursor, table):
+    # Polygons extracted before the cells had IDs and Morton keys, their column and row are enough to compute them
+    while True:
+        cursor.execute(f"""
+        SELECT Id, Resolution, Grid_Col, Grid_Row FROM {table}
+        WHERE (Cell_Id IS NULL OR Cell_Key IS NULL) AND Grid_Col IS NOT NULL AND Grid_Row IS NOT NULL
+        LIMIT {BACKFILL_BATCH_SIZE}
+        """)
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        cursor.executemany(f"UPDATE {table} SET Cell_Id = %s, Cell_Key = %s WHERE Id = %s", [
+            (Grid.cell_id(resolution, col, row), Grid.cell_key(col, row), pid)
+            for pid, resolution, col, row in rows
+        ])
+        conn.commit()
+
+
+def _use_geographic_srid(conn, cursor):
+    # The geometries are read again as WGS 84 longitude and latitude, the spatial index is rebuilt on the column
+    # once it is restricted to the SRID, the optimizer only uses a spatial index on a column with one SRID
+    for table in POLYGON_TABLES:
+        geometry_columns = [('Coordinates', 'NOT NULL')] + [(column, 'NULL') for column in simplified_columns()]
+        if all(column_srid(cursor, table, column) == SRID for column, _ in geometry_columns):
+            continue
+
+        spatial_index = index_name(cursor, table, ['Coordinates'], spatial=True)
+        if spatial_index is not None:
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {spatial_index}")
+        cursor.execute(f"ALTER TABLE {table} " + ', '.join(
+            f"MODIFY {column} GEOMETRY {nullable}" for column, nullable in geometry_columns))
+
+        # Geometries already moved are skipped, so a migration stopped halfway can be run again
+        for column, _ in geometry_columns:
+            cursor.execute(f"""
+            UPDATE {table} SET {column} = {geometry_from_wkb(f'ST_AsWKB({column})')}
+            WHERE ST_SRID({column}) <> {SRID}
+            """)
+            conn.commit()
+
+        cursor.execute(f"ALTER TABLE {table} " + ', '.join(
+            f"MODIFY {column} GEOMETRY {nullable} SRID {SRID}" for column, nullable in geometry_columns))
+        add_index(cursor, table, ['Coordinates'], spatial=True)
+
+
+def _add_state_indexes(conn, cursor):
+    # Polygons are found by the code of their state
+    add_index(cursor, 'State', ['Code'])
+    add_index(cursor, 'Polygon_Referenced_By_State', ['State_Id'])
+
+
+def _add_grid_versions(conn, cursor):
+    # Every polygon is tagged with the grid it was extracted in, the rows stored so far belong to the latest grid
+    for table, reference in POLYGON_TABLE_REFERENCES.items():
+        if not column_exists(cursor, table, 'Grid_Id'):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN Grid_Id BIGINT NULL AFTER Cell_Key")
+        add_index(cursor, table, ['Grid_Id'])
+        cursor.execute(f"""
+        UPDATE {table} SET Grid_Id = (SELECT MAX(g.Id) FROM Grid AS g WHERE g.Reference = %s)
+        WHERE Grid_Id IS NULL
+        """, (reference,))
+        conn.commit()
+
+
+# Applied in order, every migration only changes what is missing so it can be run again after a failure
+MIGRATIONS = [
+    (1, "Grid, feature hash and grid pyramid columns", _add_grid_columns),
+    (2, f"Geometries in SRID {SRID} with spatial indexes", _use_geographic_srid),
+    (3, "Indexes on the state code and the polygons' state", _add_state_indexes),
+    (4, "Grid version of every polygon", _add_grid_versions),
+]
+
+
+def schema_version(conn):
+    """
+    Get the version of the database schema.
+
+    Args:
+        conn: Database connection object.
+
+    Returns:
+        int: The last migration applied, 0 when none was.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Schema_Version
+        (
+            Version     INT PRIMARY KEY,
+            Description VARCHAR(255) NOT NULL,
+            Applied_At  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("SELECT COALESCE(MAX(Version), 0) FROM Schema_Version")
+        return cursor.fetchone()[0]
+
+    finally:
+        cursor.close()
+
+
+def migrate(conn, target=None):
+    """
+    Apply the migrations the database is missing.
+
+    MySQL commits every ALTER TABLE, so a migration is recorded in Schema_Version once all its steps are done.
+    A migration that failed halfway is applied again from the start on the next run.
+
+    Args:
+        conn: Database connection object.
+        target (int): Version to migrate up to, the latest by default.
+
+    Returns:
+        int: The version of the schema after the migration.
+    """
+    version = schema_version(conn)
+    cursor = conn.cursor()
+    try:
+        for number, description, apply in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            print(f"Applying migration {number}: {description}")
+            apply(conn, cursor)
+            cursor.execute("INSERT INTO Schema_Version (Version, Description) VALUES (%s, %s)",
+                           (number, description))
+            conn.commit()
+            version = number
+        return version
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error applying migration: {e}")
+        return version
+
+    finally:
+        cursor.close()
+
+
+def explain_queries(conn):
+    """
+    EXPLAIN the lookups of the polygon models and report the tables they would read without an index.
+
+    The queries are built by the models themselves, for a point and a box at the origin of the latest grid, so
+    the plans checked are the ones the server runs.
+
+    Args:
+        conn: Database connection object.
+
+    Returns:
+        list: One message per table read with a full table or index scan, empty when every plan uses an index.
+    """
+    queries = {}
+    for reference, model in (('STATE', PolygonReferencedByState), ('COUNTRY', PolygonReferencedByCountry)):
+        grid = Grid.find_latest_grid(conn, reference)
+        x, y = (grid.origin_x, grid.origin_y) if grid is not None else (0.0, 0.0)
+        name = reference.lower()
+        queries[f"{name} point"] = model.point_query(x, y)
+        queries[f"{name} bounding box"] = model.bbox_query(x, y, x + 1, y + 1)
+        queries[f"{name} bounding box page"] = model.bbox_query(x, y, x + 1, y + 1, after_id=0, limit=500)
+        if grid is not None:
+            queries[f"{name} point by cell key"] = model.point_query(x, y, grid=grid)
+            queries[f"{name} bounding box by cell key"] = model.bbox_query(x, y, x + 1, y + 1, grid=grid)
+    queries["polygons by state"] = PolygonReferencedByState.states_query(['FC'])
+
+    problems = []
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for name, (query, params) in queries.items():
+            if query is None:
+                continue
+            cursor.execute(f"EXPLAIN {query}", params)
+            for row in cursor.fetchall():
+                # Tables the optimizer found empty have no plan to check
+                if row['table'] is not None and row['type'] in ('ALL', 'index'):
+                    problems.append(f"{name}: {row['table']} is read with a full {row['type']} scan "
+                                    f"(possible keys: {row['possible_keys']})")
+        return problems
+
+    finally:
+        cursor.close()
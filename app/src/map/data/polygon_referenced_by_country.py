@@ -1,37 +1,77 @@
-from shapely import wkt
+import shapely
 
+from app.src.map.data.bulk import bulk_insert, column_values
+from app.src.map.data.geo_polygon import GeoPolygon, STREAM_BATCH_SIZE
+from app.src.map.data.grid import Grid
 from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
+from app.src.map.data.simplification import geometry_expression, simplified_columns, simplify_geometries
+from app.src.map.data.srid import geometry_as_wkb, geometry_from_text, geometry_from_wkb
 
 
-class PolygonReferencedByCountry:
+class PolygonReferencedByCountry(GeoPolygon):
+    COLUMNS = ['Shape_Area', 'Shape_Length', 'Coordinates', 'Grid_Col', 'Grid_Row', 'Resolution', 'Cell_Id',
+               'Parent_Cell_Id', 'Cell_Key', 'Grid_Id'] + simplified_columns()
+    GEOMETRY_COLUMNS = ['Coordinates'] + simplified_columns()
+    SELECT_COLUMNS = """gp.Id, gp.Shape_Area, gp.Shape_Length, gp.Grid_Col, gp.Grid_Row, gp.Resolution, gp.Cell_Id,
+            gp.Parent_Cell_Id, gp.Cell_Key, gp.Grid_Id"""
 
-    def __init__(self, pid=None, shape_area=None, shape_length=None, coordinates=None):
+    __slots__ = ('pid', 'shape_area', 'shape_length', 'grid_col', 'grid_row', 'resolution', 'cell_id',
+                 'parent_cell_id', 'cell_key', 'grid_id')
+
+    def __init__(self, pid=None, shape_area=None, shape_length=None, coordinates=None, grid_col=None, grid_row=None,
+                 geometry=None, wkb=None, resolution=0, cell_id=None, parent_cell_id=None, cell_key=None,
+                 grid_id=None):
+        super().__init__(coordinates=coordinates, geometry=geometry, wkb=wkb)
         self.pid = pid
         self.shape_area = shape_area
         self.shape_length = shape_length
-        self.coordinates = coordinates
+        self.grid_col = grid_col
+        self.grid_row = grid_row
+        self.resolution = resolution
+        self.cell_id = cell_id
+        self.parent_cell_id = parent_cell_id
+        self.cell_key = cell_key
+        self.grid_id = grid_id
+
+    @staticmethod
+    def select_columns(level=0):
+        # The geometry of the simplification level is fetched as WKB so a whole result set is decoded at once
+        return (f"{PolygonReferencedByCountry.SELECT_COLUMNS}, "
+                f"{geometry_as_wkb(geometry_expression(level))} AS Geometry_WKB")
 
     @classmethod
     def from_db_row(cls, row):
-        polygon = wkt.loads(row['Geometry_ST'])
-        coordinates = list(polygon.exterior.coords)
         return cls(
             pid=row['Id'],
             shape_area=row['Shape_Area'],
             shape_length=row['Shape_Length'],
-            coordinates=coordinates
+            grid_col=row.get('Grid_Col'),
+            grid_row=row.get('Grid_Row'),
+            resolution=row.get('Resolution', 0),
+            cell_id=row.get('Cell_Id'),
+            parent_cell_id=row.get('Parent_Cell_Id'),
+            cell_key=row.get('Cell_Key'),
+            grid_id=row.get('Grid_Id'),
+            wkb=bytes(row['Geometry_WKB']),
         )
 
+    @classmethod
+    def from_db_rows(cls, rows):
+        return [cls.from_db_row(row) for row in rows]
+
     def save_to_db(self, conn):
         cursor = conn.cursor()
         try:
             insert_query = """
-                INSERT INTO Polygon_Referenced_By_Country (Shape_Area, Shape_Length, Coordinates)
-                VALUES (%s, %s, ST_GeomFromText(%s))
-            """
+                INSERT INTO Polygon_Referenced_By_Country (Shape_Area, Shape_Length, Coordinates, Grid_Col, Grid_Row,
+                                                           Resolution, Cell_Id, Parent_Cell_Id, Cell_Key, Grid_Id)
+                VALUES (%s, %s, {}, %s, %s, %s, %s, %s, %s, %s)
+            """.format(geometry_from_text())
 
             cursor.execute(insert_query, (self.shape_area, self.shape_length,
                                           PolygonReferencedByState.coordinates_to_wkt_polygon(self.coordinates),
+                                          self.grid_col, self.grid_row, self.resolution, self.cell_id,
+                                          self.parent_cell_id, self.cell_key, self.grid_id,
                                           ))
             conn.commit()
             print("GeoPolygon saved successfully!")
@@ -43,38 +83,65 @@ class PolygonReferencedByCountry:
             cursor.close()
 
     @staticmethod
-    def batch_insert_geopolygon(conn, polygons):
-        cursor = conn.cursor()
+    def batch_insert_columns(conn, columns, chunk_size=5000, load_data=False, progress=None, commit=True):
         try:
-            insert_query = """
-                INSERT INTO Polygon_Referenced_By_Country (Shape_Area, Shape_Length, Coordinates)
-                VALUES (%s, %s, ST_GeomFromText(%s))
-            """
-
-            data = [(gp.shape_area, gp.shape_length, PolygonReferencedByState.coordinates_to_wkt_polygon(gp.coordinates)) for gp in polygons]
+            geometries = columns['geometry'].to_numpy()
+            data = zip(column_values(columns, 'shape_area'), column_values(columns, 'shape_length'),
+                       shapely.to_wkb(geometries), column_values(columns, 'grid_col'),
+                       column_values(columns, 'grid_row'), column_values(columns, 'resolution'),
+                       column_values(columns, 'cell_id'), column_values(columns, 'parent_cell_id'),
+                       column_values(columns, 'cell_key'), column_values(columns, 'grid_id'),
+                       *(shapely.to_wkb(simplified) for simplified in simplify_geometries(geometries)))
 
-            cursor.executemany(insert_query, data)
-            conn.commit()
-            print(f"{cursor.rowcount} GeoPolygons inserted successfully!")
+            bulk_insert(conn, 'Polygon_Referenced_By_Country', PolygonReferencedByCountry.COLUMNS, data,
+                        geometry_columns=PolygonReferencedByCountry.GEOMETRY_COLUMNS, chunk_size=chunk_size,
+                        load_data=load_data, progress=progress, commit=commit)
 
         except Exception as e:
+            # The insert was rolled back, the caller must not go on as if the polygons were saved
             print(f"Error batch inserting GeoPolygons: {e}")
+            raise
+
+    @staticmethod
+    def delete_cell_ranges(conn, cell_ranges, grid_id, resolution=0):
+        cursor = conn.cursor()
+        try:
+            delete_query = """
+            DELETE FROM Polygon_Referenced_By_Country
+            WHERE Grid_Id = %s AND Resolution = %s AND Grid_Col BETWEEN %s AND %s AND Grid_Row BETWEEN %s AND %s
+            """
+            for min_col, min_row, max_col, max_row in cell_ranges:
+                cursor.execute(delete_query, (grid_id, resolution, min_col, max_col, min_row, max_row))
 
         finally:
             cursor.close()
 
     @staticmethod
-    def find_polygon_by_point(conn, longitude, latitude):
-        cursor = conn.cursor(dictionary=True)
+    def replace_grid_version(conn, grid_id, kept_grid_id=None):
+        cursor = conn.cursor()
         try:
-            query = """
-                SELECT *, ST_AsText(Coordinates) AS Geometry_ST
-                FROM Polygon_Referenced_By_Country
-                WHERE ST_Contains(Coordinates, POINT(%s, %s))
-            """
+            if kept_grid_id is not None:
+                cursor.execute("UPDATE Polygon_Referenced_By_Country SET Grid_Id = %s WHERE Grid_Id = %s",
+                               (grid_id, kept_grid_id))
+            cursor.execute("DELETE FROM Polygon_Referenced_By_Country WHERE Grid_Id IS NULL OR Grid_Id <> %s",
+                           (grid_id,))
 
-            cursor.execute(query, (longitude, latitude))
-            row = cursor.fetchone()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_polygon_by_point(conn, longitude, latitude, index=None, level=0, resolution=0, grid=None):
+        if index is not None:
+            polygon = index.find(longitude, latitude)
+            if polygon is None:
+                print(f"No polygon contains point ({longitude}, {latitude})")
+            return polygon
+
+        cursor = conn.cursor(dictionary=True)
+        try:
+            query, params = PolygonReferencedByCountry.point_query(longitude, latitude, level, resolution, grid)
+            cursor.execute(query, params)
+            row = GeoPolygon.containing_row(cursor.fetchall(), longitude, latitude)
             if row:
                 return PolygonReferencedByCountry.from_db_row(row)
             else:
@@ -89,17 +156,98 @@ class PolygonReferencedByCountry:
             cursor.close()
 
     @staticmethod
-    def get_all_polygons(conn):
+    def point_query(longitude, latitude, level=0, resolution=0, grid=None):
+        # Same query as PolygonReferencedByState.point_query: MBRContains reads the candidates from the spatial index,
+        # GeoPolygon.containing_row checks them with flat edges
+        key_filter, key_params = '', ()
+        if grid is not None:
+            key_filter = 'AND gp.Cell_Key = %s'
+            key_params = (Grid.cell_key(*grid.cell_of(longitude, latitude, resolution)),)
+
+        exact = f", {geometry_as_wkb('gp.Coordinates')} AS Exact_WKB" if level else ''
+        query = """
+            SELECT {}{}
+            FROM Polygon_Referenced_By_Country gp
+            WHERE gp.Resolution = %s {}
+              AND MBRContains(gp.Coordinates, {})
+        """.format(PolygonReferencedByCountry.select_columns(level), exact, key_filter, geometry_from_wkb())
+
+        return query, (resolution, *key_params, shapely.Point(longitude, latitude).wkb)
+
+    @staticmethod
+    def bbox_query(min_x, min_y, max_x, max_y, level=0, resolution=0, grid=None, after_id=None, limit=None):
+        key_filter, key_params = '', ()
+        if grid is not None:
+            key_ranges = grid.cell_key_ranges(min_x, min_y, max_x, max_y, resolution)
+            if not key_ranges:
+                return None, None
+            key_filter = 'AND ({})'.format(' OR '.join(['gp.Cell_Key BETWEEN %s AND %s'] * len(key_ranges)))
+            key_params = tuple(key for key_range in key_ranges for key in key_range)
+
+        page_filter, page_params = GeoPolygon.page_clauses(after_id, limit)
+        query = """
+            SELECT {} FROM Polygon_Referenced_By_Country gp
+            WHERE gp.Resolution = %s {}
+              AND MBRIntersects(gp.Coordinates, {}) {}
+        """.format(PolygonReferencedByCountry.select_columns(level), key_filter, geometry_from_wkb(), page_filter)
+
+        return query, (resolution, *key_params, shapely.box(min_x, min_y, max_x, max_y).wkb, *page_params)
+
+    @staticmethod
+    def find_polygons_in_bbox(conn, min_x, min_y, max_x, max_y, level=0, resolution=0, grid=None, after_id=None,
+                              limit=None):
+        # Checked exactly and filled up to the limit like PolygonReferencedByState.find_polygons_in_bbox
+        cursor = conn.cursor(dictionary=True)
+        try:
+            polygons = []
+            while True:
+                query, params = PolygonReferencedByCountry.bbox_query(min_x, min_y, max_x, max_y, level, resolution,
+                                                                      grid, after_id, limit)
+                if query is None:
+                    return []
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                polygons += GeoPolygon.intersecting(PolygonReferencedByCountry.from_db_rows(rows),
+                                                    min_x, min_y, max_x, max_y)
+                if limit is None or len(rows) < limit or len(polygons) >= limit:
+                    return polygons[:limit]
+                after_id = rows[-1]['Id']
+
+        except Exception as e:
+            print(f"Error finding polygons in bounding box: {e}")
+            return []
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_child_polygons(conn, cell_id, level=0):
         cursor = conn.cursor(dictionary=True)
         try:
             query = """
-                SELECT *, ST_AsText(Coordinates) AS Geometry_ST FROM Polygon_Referenced_By_Country
-            """
+                SELECT {} FROM Polygon_Referenced_By_Country gp
+                WHERE gp.Parent_Cell_Id = %s
+                ORDER BY gp.Id
+            """.format(PolygonReferencedByCountry.select_columns(level))
 
-            # Execute the query with the tuple of states
-            cursor.execute(query)
+            cursor.execute(query, (cell_id,))
             rows = cursor.fetchall()
-            polygons = [PolygonReferencedByCountry.from_db_row(row) for row in rows]
+            return PolygonReferencedByCountry.from_db_rows(rows)
+
+        except Exception as e:
+            print(f"Error finding child polygons: {e}")
+            return []
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def get_all_polygons(conn, level=0, resolution=0):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(PolygonReferencedByCountry.all_query(level), (resolution,))
+            rows = cursor.fetchall()
+            polygons = PolygonReferencedByCountry.from_db_rows(rows)
             return polygons
 
         except Exception as e:
@@ -109,5 +257,18 @@ class PolygonReferencedByCountry:
         finally:
             cursor.close()
 
+    @staticmethod
+    def iter_all_polygons(conn, level=0, resolution=0, batch_size=STREAM_BATCH_SIZE):
+        # Streamed through an unbuffered cursor, see GeoPolygon.iter_query
+        yield from PolygonReferencedByCountry.iter_query(conn, PolygonReferencedByCountry.all_query(level),
+                                                         (resolution,), batch_size)
+
+    @staticmethod
+    def all_query(level=0):
+        return """
+            SELECT {} FROM Polygon_Referenced_By_Country gp
+            WHERE gp.Resolution = %s
+        """.format(PolygonReferencedByCountry.select_columns(level))
+
     def __repr__(self):
         return f"<PolygonReferencedByCountry(Id={self.pid}, Coordinates={self.coordinates})>"
@@ -1,14 +1,33 @@
 import json
+import shapely
 from shapely.geometry import Polygon
-import shapely.wkt as wkt
 
+from app.src.map.data.bulk import bulk_insert, column_values
+from app.src.map.data.geo_polygon import GeoPolygon, STREAM_BATCH_SIZE
+from app.src.map.data.grid import Grid
+from app.src.map.data.simplification import geometry_expression, simplified_columns, simplify_geometries
+from app.src.map.data.srid import geometry_as_wkb, geometry_from_text, geometry_from_wkb
 from app.src.map.data.state import State
 
 
-class PolygonReferencedByState:
+class PolygonReferencedByState(GeoPolygon):
+    COLUMNS = ['ObjectId', 'CapCity', 'Source', 'State_Id', 'Shape_Area', 'Shape_Length', 'Geo_Zone',
+               'Coordinates', 'Metadata', 'Grid_Col', 'Grid_Row', 'Resolution', 'Cell_Id',
+               'Parent_Cell_Id', 'Cell_Key', 'Grid_Id'] + simplified_columns()
+    GEOMETRY_COLUMNS = ['Coordinates'] + simplified_columns()
+    # Columns read back besides the geometry, see select_columns
+    SELECT_COLUMNS = """gp.Id, gp.ObjectId, gp.State_Id, gp.CapCity, gp.Source, gp.Shape_Area, gp.Shape_Length,
+            gp.Geo_Zone, gp.Metadata, gp.Grid_Col, gp.Grid_Row, gp.Resolution, gp.Cell_Id, gp.Parent_Cell_Id,
+            gp.Cell_Key, gp.Grid_Id"""
+
+    __slots__ = ('id', 'object_id', 'state', 'cap_city', 'source', 'shape_area', 'shape_length', 'geo_zone',
+                 'grid_col', 'grid_row', 'resolution', 'cell_id', 'parent_cell_id', 'cell_key', 'grid_id',
+                 '_metadata', '_metadata_json')
 
     def __init__(self, pid=None, object_id=None, cap_city=None, state=None, source=None,
-                 shape_area=None, shape_length=None, geo_zone=None, coordinates=None, metadata=None):
+                 shape_area=None, shape_length=None, geo_zone=None, coordinates=None, metadata=None,
+                 grid_col=None, grid_row=None, geometry=None, wkb=None, metadata_json=None, resolution=0,
+                 cell_id=None, parent_cell_id=None, cell_key=None, grid_id=None):
         """
         Initialize a GeoPolygon object.
 
@@ -23,7 +42,18 @@ class PolygonReferencedByState:
             geo_zone (str): Geographical zone.
             coordinates (list of tuples): List of (longitude, latitude) coordinates defining the polygon.
             metadata (dict): Additional metadata associated with the polygon.
+            grid_col (int): Column of the grid cell the polygon was clipped from.
+            grid_row (int): Row of the grid cell the polygon was clipped from.
+            geometry (Polygon): Shapely geometry of the polygon, used instead of the coordinates when given.
+            wkb (bytes): WKB encoding of the polygon as read from the database.
+            metadata_json (str): The metadata as stored, only parsed when the metadata is accessed.
+            resolution (int): Resolution of the grid pyramid the cell belongs to, 0 for the base cells.
+            cell_id (int): ID of the cell, see Grid.cell_id.
+            parent_cell_id (int): ID of the cell of the next coarser resolution, None at the coarsest.
+            cell_key (int): Morton key of the cell within its resolution, see Grid.cell_key.
+            grid_id (int): ID of the Grid version the polygon was extracted in.
         """
+        super().__init__(coordinates=coordinates, geometry=geometry, wkb=wkb)
         self.id = pid
         self.object_id = object_id
         self.state = state
@@ -32,23 +62,60 @@ class PolygonReferencedByState:
         self.shape_area = shape_area
         self.shape_length = shape_length
         self.geo_zone = geo_zone
-        self.coordinates = coordinates
-        self.metadata = metadata
+        self._metadata = metadata
+        self._metadata_json = metadata_json
+        self.grid_col = grid_col
+        self.grid_row = grid_row
+        self.resolution = resolution
+        self.cell_id = cell_id
+        self.parent_cell_id = parent_cell_id
+        self.cell_key = cell_key
+        self.grid_id = grid_id
+
+    @property
+    def metadata(self):
+        """
+        dict: Additional metadata associated with the polygon, parsed on first use.
+        """
+        if self._metadata is None and self._metadata_json is not None:
+            self._metadata = json.loads(self._metadata_json)
+        return self._metadata
+
+    @property
+    def metadata_json(self):
+        """
+        str: The metadata encoded as JSON for storage.
+        """
+        if self._metadata_json is None:
+            self._metadata_json = json.dumps(self._metadata)
+        return self._metadata_json
+
+    @staticmethod
+    def select_columns(level=0):
+        """
+        Get the columns read back, the geometry is fetched as WKB so a whole result set is decoded at once.
+
+        Args:
+            level (int): Simplification level of the geometry, 0 for the full resolution.
+
+        Returns:
+            str: The select list.
+        """
+        return f"{PolygonReferencedByState.SELECT_COLUMNS}, {geometry_as_wkb(geometry_expression(level))} AS Geometry_WKB"
 
     @classmethod
     def from_db_row(cls, row):
         """
         Create a GeoPolygon object from a database row.
 
+        The geometry is kept as the WKB and the metadata as the JSON that were read, neither is decoded here.
+
         Args:
             row (dict): Database row containing polygon data.
 
         Returns:
             PolygonReferencedByState: Initialized GeoPolygon object.
         """
-        metadata = json.loads(row['Metadata'])
-        polygon = wkt.loads(row['Geometry_ST'])
-        coordinates = list(polygon.exterior.coords)
         state_id = row['State_Id']
 
         states = State.get_states_by_id()
@@ -65,10 +132,30 @@ class PolygonReferencedByState:
             shape_area=row['Shape_Area'],
             shape_length=row['Shape_Length'],
             geo_zone=row['Geo_Zone'],
-            coordinates=coordinates,
-            metadata=metadata,
+            grid_col=row.get('Grid_Col'),
+            grid_row=row.get('Grid_Row'),
+            resolution=row.get('Resolution', 0),
+            cell_id=row.get('Cell_Id'),
+            parent_cell_id=row.get('Parent_Cell_Id'),
+            cell_key=row.get('Cell_Key'),
+            grid_id=row.get('Grid_Id'),
+            wkb=bytes(row['Geometry_WKB']),
+            metadata_json=row['Metadata'],
         )
 
+    @classmethod
+    def from_db_rows(cls, rows):
+        """
+        Create GeoPolygon objects from database rows.
+
+        Args:
+            rows (list of dict): Database rows containing polygon data.
+
+        Returns:
+            list: List of initialized GeoPolygon objects.
+        """
+        return [cls.from_db_row(row) for row in rows]
+
     def save_to_db(self, conn):
         """
         Save the GeoPolygon object to the database.
@@ -80,9 +167,10 @@ class PolygonReferencedByState:
         try:
             insert_query = """
             INSERT INTO Polygon_Referenced_By_State (ObjectId, CapCity, Source, State_Id,
-                                     Shape_Area, Shape_Length, Geo_Zone, Coordinates, Metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, ST_GeomFromText(%s), %s)
-            """
+                                     Shape_Area, Shape_Length, Geo_Zone, Coordinates, Metadata, Grid_Col, Grid_Row,
+                                     Resolution, Cell_Id, Parent_Cell_Id, Cell_Key, Grid_Id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, {}, %s, %s, %s, %s, %s, %s, %s, %s)
+            """.format(geometry_from_text())
 
             metadata_str = json.dumps(self.metadata)
             sid = ''
@@ -92,7 +180,8 @@ class PolygonReferencedByState:
                 self.object_id, self.cap_city,
                 self.source, sid, self.shape_area, self.shape_length, self.geo_zone,
                 PolygonReferencedByState.coordinates_to_wkt_polygon(self.coordinates),
-                metadata_str
+                metadata_str, self.grid_col, self.grid_row, self.resolution, self.cell_id, self.parent_cell_id,
+                self.cell_key, self.grid_id
             ))
             conn.commit()
             print("GeoPolygon saved successfully!")
@@ -119,40 +208,91 @@ class PolygonReferencedByState:
         return wkt_polygon
 
     @staticmethod
-    def batch_insert_geopolygon(conn, polygons):
+    def batch_insert_columns(conn, columns, chunk_size=5000, load_data=False, progress=None, commit=True):
+        """
+        Batch insert polygons extracted as columns into the database, without building GeoPolygon objects.
+
+        Args:
+            conn: Database connection object.
+            columns (DataFrame): Polygon columns, see utils.polygon.extract_polygon_columns.
+            chunk_size (int): Number of rows sent per INSERT statement.
+            load_data (bool): Load the rows with LOAD DATA LOCAL INFILE instead of INSERT statements.
+            progress (callable): Called with the number of rows sent so far, see data.bulk.bulk_insert.
+            commit (bool): Commit the rows, otherwise they are left in the open transaction for the caller.
+
+        Raises:
+            Exception: The error the insert failed with, or the one progress raised, once it is rolled back.
+        """
+        try:
+            geometries = columns['geometry'].to_numpy()
+            data = zip(column_values(columns, 'object_id'), column_values(columns, 'cap_city'),
+                       column_values(columns, 'source'), column_values(columns, 'state_id'),
+                       column_values(columns, 'shape_area'), column_values(columns, 'shape_length'),
+                       column_values(columns, 'geo_zone'), shapely.to_wkb(geometries),
+                       column_values(columns, 'metadata'), column_values(columns, 'grid_col'),
+                       column_values(columns, 'grid_row'), column_values(columns, 'resolution'),
+                       column_values(columns, 'cell_id'), column_values(columns, 'parent_cell_id'),
+                       column_values(columns, 'cell_key'), column_values(columns, 'grid_id'),
+                       *(shapely.to_wkb(simplified) for simplified in simplify_geometries(geometries)))
+
+            bulk_insert(conn, 'Polygon_Referenced_By_State', PolygonReferencedByState.COLUMNS, data,
+                        geometry_columns=PolygonReferencedByState.GEOMETRY_COLUMNS, chunk_size=chunk_size,
+                        load_data=load_data, progress=progress, commit=commit)
+
+        except Exception as e:
+            # The insert was rolled back, the caller must not go on as if the polygons were saved
+            print(f"Error batch inserting GeoPolygons: {e}")
+            raise
+
+    @staticmethod
+    def delete_cell_ranges(conn, cell_ranges, grid_id, resolution=0):
         """
-        Batch insert a list of GeoPolygon objects into the database.
+        Delete the polygons of some ranges of grid cells, left uncommitted so the next bulk insert replaces them
+        in the same transaction.
 
         Args:
             conn: Database connection object.
-            polygons (list of PolygonReferencedByState): List of GeoPolygon objects to insert.
+            cell_ranges (list): (min_col, min_row, max_col, max_row) ranges, both ends included.
+            grid_id (int): ID of the Grid version whose polygons are deleted, the cells of other grids are kept.
+            resolution (int): Resolution of the grid pyramid the ranges are counted in.
         """
         cursor = conn.cursor()
         try:
-            insert_query = """
-            INSERT INTO Polygon_Referenced_By_State (ObjectId, CapCity, Source, State_Id,
-                                     Shape_Area, Shape_Length, Geo_Zone, Coordinates, Metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, ST_GeomFromText(%s), %s)
+            delete_query = """
+            DELETE FROM Polygon_Referenced_By_State
+            WHERE Grid_Id = %s AND Resolution = %s AND Grid_Col BETWEEN %s AND %s AND Grid_Row BETWEEN %s AND %s
             """
+            for min_col, min_row, max_col, max_row in cell_ranges:
+                cursor.execute(delete_query, (grid_id, resolution, min_col, max_col, min_row, max_row))
 
-            data = [(gp.object_id, gp.cap_city,
-                     gp.source, gp.state.sid if gp.state is not None else None, gp.shape_area, gp.shape_length,
-                     gp.geo_zone, PolygonReferencedByState.coordinates_to_wkt_polygon(gp.coordinates),
-                     json.dumps(gp.metadata))
-                    for gp in polygons]
+        finally:
+            cursor.close()
 
-            cursor.executemany(insert_query, data)
-            conn.commit()
-            print(f"{cursor.rowcount} GeoPolygons inserted successfully!")
+    @staticmethod
+    def replace_grid_version(conn, grid_id, kept_grid_id=None):
+        """
+        Make the polygons of a grid version the only ones stored, left uncommitted so they are replaced in the
+        transaction of the extraction.
 
-        except Exception as e:
-            print(f"Error batch inserting GeoPolygons: {e}")
+        Args:
+            conn: Database connection object.
+            grid_id (int): ID of the Grid version just extracted.
+            kept_grid_id (int): ID of the previous Grid version whose remaining polygons are moved to grid_id, as
+                                an incremental extraction only inserts the cells that changed.
+        """
+        cursor = conn.cursor()
+        try:
+            if kept_grid_id is not None:
+                cursor.execute("UPDATE Polygon_Referenced_By_State SET Grid_Id = %s WHERE Grid_Id = %s",
+                               (grid_id, kept_grid_id))
+            cursor.execute("DELETE FROM Polygon_Referenced_By_State WHERE Grid_Id IS NULL OR Grid_Id <> %s",
+                           (grid_id,))
 
         finally:
             cursor.close()
 
     @staticmethod
-    def find_polygon_by_point(conn, longitude, latitude):
+    def find_polygon_by_point(conn, longitude, latitude, index=None, level=0, resolution=0, grid=None):
         """
         Find a polygon containing a given point (longitude, latitude).
 
@@ -160,20 +300,27 @@ class PolygonReferencedByState:
             conn: Database connection object.
             longitude (float): Longitude of the point.
             latitude (float): Latitude of the point.
+            index (PolygonIndex): Optional in-memory index to answer the lookup from, the database is queried
+                                  when it is not given.
+            level (int): Simplification level of the geometry read from the database, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid to find the cell in, the index holds resolution 0.
+            grid (Grid): The grid of the stored polygons, when given the cell of the point is computed and read
+                         through the index on its key, and only its pieces are checked for the point.
 
         Returns:
             PolygonReferencedByState: GeoPolygon object containing the point, or None if not found.
         """
+        if index is not None:
+            polygon = index.find(longitude, latitude)
+            if polygon is None:
+                print(f"No polygon contains point ({longitude}, {latitude})")
+            return polygon
+
         cursor = conn.cursor(dictionary=True)
         try:
-            query = """
-            SELECT *, ST_AsText(Coordinates) AS Geometry_ST
-            FROM Polygon_Referenced_By_State
-            WHERE ST_Contains(Coordinates, POINT(%s, %s))
-            """
-
-            cursor.execute(query, (longitude, latitude))
-            row = cursor.fetchone()
+            query, params = PolygonReferencedByState.point_query(longitude, latitude, level, resolution, grid)
+            cursor.execute(query, params)
+            row = GeoPolygon.containing_row(cursor.fetchall(), longitude, latitude)
             if row:
                 return PolygonReferencedByState.from_db_row(row)
             else:
@@ -188,29 +335,181 @@ class PolygonReferencedByState:
             cursor.close()
 
     @staticmethod
-    def find_polygons_by_state(conn, states):
+    def point_query(longitude, latitude, level=0, resolution=0, grid=None):
+        """
+        Build the query of find_polygon_by_point, also used to check its plan with EXPLAIN.
+
+        The point is sent as WKB in SRID 4326. MBRContains lets the optimizer read the candidates from the spatial
+        index, they are checked against the exact geometry by GeoPolygon.containing_row rather than ST_Contains,
+        whose geodesic edges differ from the flat cells. The full geometry is read as Exact_WKB for the check
+        when a simplified one is served.
+
+        Args:
+            longitude (float): Longitude of the point.
+            latitude (float): Latitude of the point.
+            level (int): Simplification level of the geometry, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+            grid (Grid): Optional grid of the stored polygons to filter on the key of the point's cell.
+
+        Returns:
+            tuple: The query and its parameters.
+        """
+        key_filter, key_params = '', ()
+        if grid is not None:
+            key_filter = 'AND gp.Cell_Key = %s'
+            key_params = (Grid.cell_key(*grid.cell_of(longitude, latitude, resolution)),)
+
+        exact = f", {geometry_as_wkb('gp.Coordinates')} AS Exact_WKB" if level else ''
+        query = """
+        SELECT {}{}
+        FROM Polygon_Referenced_By_State gp
+        WHERE gp.Resolution = %s {}
+          AND MBRContains(gp.Coordinates, {})
+        """.format(PolygonReferencedByState.select_columns(level), exact, key_filter, geometry_from_wkb())
+
+        return query, (resolution, *key_params, shapely.Point(longitude, latitude).wkb)
+
+    @staticmethod
+    def bbox_query(min_x, min_y, max_x, max_y, level=0, resolution=0, grid=None, after_id=None, limit=None):
+        """
+        Build the query of find_polygons_in_bbox, also used to check its plan with EXPLAIN.
+
+        The box is sent as a WKB polygon in SRID 4326, ST_MakeEnvelope only builds Cartesian envelopes. A page
+        is read by keyset on the primary key, so skipping the previous pages costs nothing unlike an OFFSET.
+
+        Args:
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+            grid (Grid): Optional grid of the stored polygons to filter on the keys of the cells under the box.
+            after_id (int): Only read the polygons with a greater ID, the last ID of the previous page.
+            limit (int): Most polygons read, in ID order, every polygon when not given.
+
+        Returns:
+            tuple: The query and its parameters, both None when the box covers no cell of the grid.
+        """
+        key_filter, key_params = '', ()
+        if grid is not None:
+            key_ranges = grid.cell_key_ranges(min_x, min_y, max_x, max_y, resolution)
+            if not key_ranges:
+                return None, None
+            key_filter = 'AND ({})'.format(' OR '.join(['gp.Cell_Key BETWEEN %s AND %s'] * len(key_ranges)))
+            key_params = tuple(key for key_range in key_ranges for key in key_range)
+
+        page_filter, page_params = GeoPolygon.page_clauses(after_id, limit)
+        query = """
+        SELECT {} FROM Polygon_Referenced_By_State gp
+        WHERE gp.Resolution = %s {}
+          AND MBRIntersects(gp.Coordinates, {}) {}
+        """.format(PolygonReferencedByState.select_columns(level), key_filter, geometry_from_wkb(), page_filter)
+
+        return query, (resolution, *key_params, shapely.box(min_x, min_y, max_x, max_y).wkb, *page_params)
+
+    @staticmethod
+    def find_polygons_in_bbox(conn, min_x, min_y, max_x, max_y, level=0, resolution=0, grid=None, after_id=None,
+                              limit=None):
+        """
+        Find the polygons intersecting a bounding box, answered from the spatial index, or from the index on the
+        cell keys when the grid is given.
+
+        The rows whose bounding rectangle intersects the box are read and checked exactly, see
+        GeoPolygon.intersecting. A page short of the limit after the check is filled from the next rows, so only
+        the last page is short.
+
+        Args:
+            conn: Database connection object.
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+            grid (Grid): The grid of the stored polygons, when given the box is turned into ranges of cell keys
+                         scanned through the B-tree index, and only their pieces are checked against the box.
+            after_id (int): Only find the polygons with a greater ID, to read the box page by page.
+            limit (int): Most polygons returned, in ID order, every polygon when not given.
+
+        Returns:
+            list: List of GeoPolygon objects intersecting the box.
+        """
+        cursor = conn.cursor(dictionary=True)
+        try:
+            polygons = []
+            while True:
+                query, params = PolygonReferencedByState.bbox_query(min_x, min_y, max_x, max_y, level, resolution,
+                                                                    grid, after_id, limit)
+                if query is None:
+                    return []
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                polygons += GeoPolygon.intersecting(PolygonReferencedByState.from_db_rows(rows),
+                                                    min_x, min_y, max_x, max_y)
+                if limit is None or len(rows) < limit or len(polygons) >= limit:
+                    return polygons[:limit]
+                after_id = rows[-1]['Id']
+
+        except Exception as e:
+            print(f"Error finding polygons in bounding box: {e}")
+            return []
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_child_polygons(conn, cell_id, level=0):
+        """
+        Find the polygons of the cells a cell was split into at the next finer resolution.
+
+        Args:
+            conn: Database connection object.
+            cell_id (int): ID of the parent cell, see Grid.cell_id.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+
+        Returns:
+            list: List of GeoPolygon objects of the child cells.
+        """
+        cursor = conn.cursor(dictionary=True)
+        try:
+            query = """
+            SELECT {} FROM Polygon_Referenced_By_State gp
+            WHERE gp.Parent_Cell_Id = %s
+            ORDER BY gp.Id
+            """.format(PolygonReferencedByState.select_columns(level))
+
+            cursor.execute(query, (cell_id,))
+            rows = cursor.fetchall()
+            return PolygonReferencedByState.from_db_rows(rows)
+
+        except Exception as e:
+            print(f"Error finding child polygons: {e}")
+            return []
+
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def find_polygons_by_state(conn, states, level=0, resolution=0):
         """
         Find polygons belonging to a specific state.
 
         Args:
             conn: Database connection object.
             states (list): List of states.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
 
         Returns:
             list: List of GeoPolygon objects belonging to the specified state.
         """
         cursor = conn.cursor(dictionary=True)
         try:
-            query = """
-            SELECT gp.*, ST_AsText(Coordinates) AS Geometry_ST FROM Polygon_Referenced_By_State gp
-            LEFT JOIN State AS s ON gp.State_Id = s.Id
-            WHERE s.Code IN ({})
-            """.format(', '.join(['%s'] * len(states)))
-
-            # Execute the query with the tuple of states
-            cursor.execute(query, states)
+            query, params = PolygonReferencedByState.states_query(states, level, resolution)
+            cursor.execute(query, params)
             rows = cursor.fetchall()
-            polygons = [PolygonReferencedByState.from_db_row(row) for row in rows]
+            polygons = PolygonReferencedByState.from_db_rows(rows)
             return polygons
 
         except Exception as e:
@@ -221,26 +520,65 @@ class PolygonReferencedByState:
             cursor.close()
 
     @staticmethod
-    def get_all_polygons(conn):
+    def iter_polygons_by_state(conn, states, level=0, resolution=0, batch_size=STREAM_BATCH_SIZE):
+        """
+        Stream the polygons belonging to specific states, see find_polygons_by_state and GeoPolygon.iter_query.
+
+        Args:
+            conn: Database connection object, busy until the generator is exhausted or closed.
+            states (list): List of state codes.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+            batch_size (int): Number of rows fetched at a time.
+
+        Yields:
+            PolygonReferencedByState: The polygons of the states.
+        """
+        query, params = PolygonReferencedByState.states_query(states, level, resolution)
+        yield from PolygonReferencedByState.iter_query(conn, query, params, batch_size)
+
+    @staticmethod
+    def states_query(states, level=0, resolution=0):
+        """
+        Build the query of find_polygons_by_state, also used to check its plan with EXPLAIN.
+
+        The states are joined on their code so the optimizer starts from the index on State.Code and reads the
+        polygons through the index on State_Id.
+
+        Args:
+            states (list): List of state codes.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+
+        Returns:
+            tuple: The query and its parameters.
+        """
+        query = """
+        SELECT {} FROM Polygon_Referenced_By_State gp
+        JOIN State AS s ON gp.State_Id = s.Id
+        WHERE s.Code IN ({}) AND gp.Resolution = %s
+        """.format(PolygonReferencedByState.select_columns(level), ', '.join(['%s'] * len(states)))
+
+        return query, (*states, resolution)
+
+    @staticmethod
+    def get_all_polygons(conn, level=0, resolution=0):
         """
-        Get all polygons.
+        Get all polygons of a resolution.
 
         Args:
             conn: Database connection object.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
 
         Returns:
             list: List of all GeoPolygon objects.
         """
         cursor = conn.cursor(dictionary=True)
         try:
-            query = """
-            SELECT *, ST_AsText(Coordinates) AS Geometry_ST FROM Polygon_Referenced_By_State
-            """
-
-            # Execute the query with the tuple of states
-            cursor.execute(query)
+            cursor.execute(PolygonReferencedByState.all_query(level), (resolution,))
             rows = cursor.fetchall()
-            polygons = [PolygonReferencedByState.from_db_row(row) for row in rows]
+            polygons = PolygonReferencedByState.from_db_rows(rows)
             return polygons
 
         except Exception as e:
@@ -250,6 +588,31 @@ class PolygonReferencedByState:
         finally:
             cursor.close()
 
+    @staticmethod
+    def iter_all_polygons(conn, level=0, resolution=0, batch_size=STREAM_BATCH_SIZE):
+        """
+        Stream all polygons of a resolution, see get_all_polygons and GeoPolygon.iter_query.
+
+        Args:
+            conn: Database connection object, busy until the generator is exhausted or closed.
+            level (int): Simplification level of the geometries, 0 for the full resolution.
+            resolution (int): Resolution of the grid pyramid.
+            batch_size (int): Number of rows fetched at a time.
+
+        Yields:
+            PolygonReferencedByState: The polygons.
+        """
+        yield from PolygonReferencedByState.iter_query(conn, PolygonReferencedByState.all_query(level),
+                                                       (resolution,), batch_size)
+
+    @staticmethod
+    def all_query(level=0):
+        # Every polygon of the resolution given as the only parameter
+        return """
+        SELECT {} FROM Polygon_Referenced_By_State gp
+        WHERE gp.Resolution = %s
+        """.format(PolygonReferencedByState.select_columns(level))
+
     def __repr__(self):
         """
         Return a string representation of the GeoPolygon object.
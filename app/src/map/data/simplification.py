@@ -0,0 +1,105 @@
+import numpy as np
+import shapely
+
+# Tolerance in degrees of each stored simplification level, level 0 is the full resolution geometry
+TOLERANCES = (0.0, 0.0005, 0.002, 0.01)
+
+
+def geometry_column(level=0):
+    """
+    Get the name of the column holding the geometry of a simplification level.
+
+    Args:
+        level (int): The simplification level.
+
+    Returns:
+        str: Coordinates for level 0, Simplified_<level> otherwise.
+    """
+    return 'Coordinates' if level == 0 else f'Simplified_{level}'
+
+
+def simplified_columns():
+    """
+    Get the names of the columns holding the simplified geometries, from the finest to the coarsest level.
+
+    Returns:
+        list: The column names.
+    """
+    return [geometry_column(level) for level in range(1, len(TOLERANCES))]
+
+
+def geometry_expression(level=0, alias='gp'):
+    """
+    Get the SQL expression reading the geometry of a simplification level.
+
+    Rows inserted without simplified geometries fall back to the full resolution geometry.
+
+    Args:
+        level (int): The simplification level.
+        alias (str): Alias of the polygon table in the query.
+
+    Returns:
+        str: The SQL expression.
+    """
+    if level == 0:
+        return f'{alias}.Coordinates'
+    return f'COALESCE({alias}.{geometry_column(level)}, {alias}.Coordinates)'
+
+
+def simplify_geometries(geometries):
+    """
+    Simplify geometries at every stored level, as one coverage so neighbouring pieces keep sharing their edges.
+
+    The pieces of a grid tile the map, simplified one by one their shared edges would move apart and leave
+    overlaps and gaps along the cell and state borders. shapely.coverage_simplify (shapely 2.1 and GEOS 3.12)
+    simplifies every shared edge once with Visvalingam-Whyatt, its tolerance is roughly the square root of the
+    area of the triangles removed. Pieces that do not form a valid coverage, whose simplified geometry comes out
+    invalid, and older shapely versions fall back to simplifying each geometry on its own.
+
+    Args:
+        geometries (array-like): The full resolution geometries.
+
+    Returns:
+        list: An array of simplified geometries per level, from level 1 up.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    return [_simplify_coverage(geometries, tolerance) for tolerance in TOLERANCES[1:]]
+
+
+def _simplify_coverage(geometries, tolerance):
+    if not hasattr(shapely, 'coverage_simplify') or len(geometries) == 0:
+        return shapely.simplify(geometries, tolerance, preserve_topology=True)
+    simplified = shapely.coverage_simplify(geometries, tolerance)
+    invalid = ~shapely.is_valid(simplified)
+    simplified[invalid] = shapely.simplify(geometries[invalid], tolerance, preserve_topology=True)
+    return simplified
+
+
+def level_for_tolerance(tolerance):
+    """
+    Get the coarsest stored level whose tolerance does not exceed a tolerance.
+
+    Args:
+        tolerance (float): The largest acceptable simplification tolerance in degrees.
+
+    Returns:
+        int: The simplification level.
+    """
+    if tolerance < 0:
+        raise ValueError("tolerance must not be negative")
+    return max(level for level, level_tolerance in enumerate(TOLERANCES) if level_tolerance <= tolerance)
+
+
+def level_for_zoom(zoom):
+    """
+    Get the simplification level for a web map zoom level, simplifying by up to the size of a pixel.
+
+    Args:
+        zoom (int): The zoom level, a 256 pixel tile covers 360 / 2^zoom degrees of longitude.
+
+    Returns:
+        int: The simplification level.
+    """
+    if zoom < 0:
+        raise ValueError("zoom must not be negative")
+    return level_for_tolerance(360 / (256 * 2 ** zoom))
@@ -0,0 +1,45 @@
+# Spatial reference of the stored geometries, WGS 84 longitude and latitude
+SRID = 4326
+
+# MySQL reads and writes coordinates of SRID 4326 latitude first unless told otherwise, the code works in longitude
+# and latitude order like GeoJSON and shapely do
+AXIS_ORDER = "'axis-order=long-lat'"
+
+
+def geometry_from_wkb(value='%s'):
+    """
+    Get the SQL expression reading a geometry sent as WKB in longitude and latitude order.
+
+    Args:
+        value (str): SQL expression of the WKB, a query parameter by default.
+
+    Returns:
+        str: The SQL expression.
+    """
+    return f"ST_GeomFromWKB({value}, {SRID}, {AXIS_ORDER})"
+
+
+def geometry_from_text(value='%s'):
+    """
+    Get the SQL expression reading a geometry sent as WKT in longitude and latitude order.
+
+    Args:
+        value (str): SQL expression of the WKT, a query parameter by default.
+
+    Returns:
+        str: The SQL expression.
+    """
+    return f"ST_GeomFromText({value}, {SRID}, {AXIS_ORDER})"
+
+
+def geometry_as_wkb(expression):
+    """
+    Get the SQL expression writing a stored geometry as WKB in longitude and latitude order.
+
+    Args:
+        expression (str): SQL expression of the geometry.
+
+    Returns:
+        str: The SQL expression.
+    """
+    return f"ST_AsWKB({expression}, {AXIS_ORDER})"
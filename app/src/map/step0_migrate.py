@@ -0,0 +1,18 @@
+import sys
+
+from dotenv import load_dotenv
+
+from app.src.map.data.db import init_conn
+from app.src.map.data.migrations import explain_queries, migrate
+
+load_dotenv()
+
+if __name__ == "__main__":
+    conn = init_conn()
+    print(f"Schema version {migrate(conn)}")
+
+    # A lookup reading a whole table means an index is missing or no longer used
+    problems = explain_queries(conn)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+from itertools import chain
+
+from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
+from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
+from app.src.map.data.simplification import TOLERANCES
+from app.src.map.data.state import State
+from app.src.map.utils.export import export_geo_dataframe, ExportType
+
+# Name of the artifact holding every polygon of a reference, the other artifacts are named after a state code
+ALL = "ALL"
+MANIFEST = "manifest.json"
+
+
+def write_artifacts(conn, directory, reference, grid_version, keep_versions=2):
+    """
+    Render the exports of every state and of the whole country once and write them as content-addressed files.
+
+    The files are written to {directory}/{reference}/{grid_version}/ as {name}.{digest}.{extension}, where the
+    digest is taken from the content, next to a manifest.json listing the file and digest of every artifact.
+    Every state and the whole country are also written at every simplification level for overview maps, the
+    server looks them up by artifact_name.
+    Only the newest keep_versions grid versions are kept.
+
+    Every file is streamed from its own query into the file, so no selection is held in memory, except for the
+    HTML map which is built from the whole selection.
+
+    Args:
+        conn: Database connection object.
+        directory (str): Root directory of the artifacts.
+        reference (str): STATE or COUNTRY.
+        grid_version (int): Version of the grid the polygons were extracted into.
+        keep_versions (int): Number of grid versions to keep, so URLs of the previous version stay valid for a while.
+
+    Returns:
+        dict: The manifest.
+    """
+    referenced_by_country = reference == "COUNTRY"
+    version_directory = os.path.join(directory, reference, str(grid_version))
+    os.makedirs(version_directory, exist_ok=True)
+
+    model = PolygonReferencedByCountry if referenced_by_country else PolygonReferencedByState
+    states = [] if referenced_by_country else State.states or State.get_all_states(conn)
+    selections = {}
+    for level in range(len(TOLERANCES)):
+        selections[artifact_name(ALL, level)] = lambda level=level: model.iter_all_polygons(conn, level=level)
+        for state in states:
+            selections[artifact_name(state.code.upper(), level)] = (
+                lambda code=state.code, level=level: PolygonReferencedByState.iter_polygons_by_state(
+                    conn, [code], level=level))
+
+    artifacts = {}
+    for name, select in selections.items():
+        for export_type in ExportType:
+            polygons = select()
+            first = next(polygons, None)
+            if first is None:
+                break
+            chunks = export_geo_dataframe(chain([first], polygons), export_type=export_type,
+                                          referenced_by_country=referenced_by_country, stream=True)
+            file_name, digest = _write_content_addressed(version_directory, name, export_type.value, chunks)
+            artifacts.setdefault(name, {})[export_type.value] = {'file': file_name, 'etag': digest}
+
+    manifest = {'reference': reference, 'version': grid_version, 'artifacts': artifacts}
+    _write_atomically(os.path.join(version_directory, MANIFEST), json.dumps(manifest).encode('utf-8'))
+    print(f"{sum(len(files) for files in artifacts.values())} artifacts written to {version_directory}")
+
+    versions = sorted(int(version) for version in os.listdir(os.path.join(directory, reference)) if version.isdigit())
+    for version in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(directory, reference, str(version)), ignore_errors=True)
+    return manifest
+
+
+def artifact_name(name, level=0):
+    """
+    Get the name of an artifact at a simplification level.
+
+    Args:
+        name (str): A state code, or ALL for every polygon of the reference.
+        level (int): The simplification level.
+
+    Returns:
+        str: The name, suffixed with @<level> above level 0.
+    """
+    return name if level == 0 else f"{name}@{level}"
+
+
+def read_manifest(directory, reference, grid_version):
+    """
+    Read the manifest of the artifacts of a grid version.
+
+    Args:
+        directory (str): Root directory of the artifacts.
+        reference (str): STATE or COUNTRY.
+        grid_version (int): Version of the grid.
+
+    Returns:
+        dict: The manifest, or None if no artifacts were written for the grid version.
+    """
+    path = os.path.join(directory, reference, str(grid_version), MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_content_addressed(directory, name, extension, chunks):
+    # The file is named after the digest of its content, known once all of it has been written
+    temporary_path = os.path.join(directory, f".{name}.{extension}.tmp")
+    digest = hashlib.sha256()
+    with open(temporary_path, 'wb') as file:
+        for chunk in ([chunks] if isinstance(chunks, (str, bytes)) else chunks):
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            digest.update(chunk)
+            file.write(chunk)
+    etag = digest.hexdigest()[:20]
+    file_name = f"{name}.{etag}.{extension}"
+    os.replace(temporary_path, os.path.join(directory, file_name))
+    return file_name, etag
+
+
+def _write_atomically(path, content):
+    directory, name = os.path.split(path)
+    temporary_path = os.path.join(directory, f".{name}.tmp")
+    with open(temporary_path, 'wb') as file:
+        file.write(content)
+    os.replace(temporary_path, path)
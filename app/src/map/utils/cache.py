@@ -0,0 +1,173 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class ExportCache:
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None):
+        """
+        Initialize a cache of rendered exports.
+
+        Entries live in memory up to max_bytes and the least recently used are evicted first. With a directory
+        every entry is also written to disk, so evicted entries and entries rendered by other processes are
+        read back from there instead of being rendered again.
+
+        Args:
+            max_bytes (int): Maximum total size of the entries held in memory.
+            directory (str): Optional directory of the on-disk tier.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(reference, selection, export_type, grid_version, level=0, resolution=0):
+        """
+        Build a cache key.
+
+        Args:
+            reference (str): STATE or COUNTRY.
+            selection (str or list): A cell id, or the state codes which are normalized to a sorted set.
+            export_type (ExportType): The export format.
+            grid_version (int): Version of the grid the export was rendered from.
+            level (int): Simplification level of the geometries.
+            resolution (int): Resolution of the grid pyramid.
+
+        Returns:
+            tuple: The cache key.
+        """
+        if isinstance(selection, (list, tuple, set)):
+            selection = ','.join(sorted({code.strip().upper() for code in selection}))
+        return reference, str(selection), export_type.value, grid_version, level, resolution
+
+    @staticmethod
+    def tile_key(reference, z, x, y, grid_version, level=0, resolution=0):
+        """
+        Build the cache key of a vector tile.
+
+        Args:
+            reference (str): STATE or COUNTRY.
+            z (int): Zoom level.
+            x (int): Column of the tile.
+            y (int): Row of the tile.
+            grid_version (int): Version of the grid the tile was rendered from.
+            level (int): Simplification level of the geometries.
+            resolution (int): Resolution of the grid pyramid.
+
+        Returns:
+            tuple: The cache key.
+        """
+        return reference, f"{z}/{x}/{y}", 'mvt', grid_version, level, resolution
+
+    def get(self, key):
+        """
+        Get a cached export.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            bytes: The export, or None if it is not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as file:
+                value = file.read()
+            with self._lock:
+                self._disk_hits += 1
+            self._remember(key, value)
+            return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Cache an export.
+
+        Args:
+            key (tuple): The cache key.
+            value (bytes): The export.
+        """
+        path = self._path(key)
+        if path is not None:
+            # Written under a temporary name first so a concurrent reader never sees a partial file
+            directory, name = os.path.split(path)
+            temporary_path = os.path.join(directory, f".{name}.{threading.get_ident()}.tmp")
+            with open(temporary_path, 'wb') as file:
+                file.write(value)
+            os.replace(temporary_path, path)
+        self._remember(key, value)
+
+    def invalidate(self, reference, grid_version=None):
+        """
+        Drop the exports of a reference rendered from any grid version other than grid_version.
+
+        Args:
+            reference (str): STATE or COUNTRY.
+            grid_version (int): The version to keep, every version is dropped when None.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == reference and key[3] != grid_version]:
+                self._bytes -= len(self._entries.pop(key))
+
+        if self.directory is not None:
+            keep = f"{reference}-{grid_version}-"
+            for name in os.listdir(self.directory):
+                if name.startswith(f"{reference}-") and not name.startswith(keep):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: Entries and bytes held in memory, memory hits, disk hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+    def _remember(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+
+    def _path(self, key):
+        if self.directory is None:
+            return None
+        reference, selection, export_type, grid_version, level, resolution = key
+        digest = hashlib.sha256(f"{selection}|{export_type}|{level}|{resolution}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{reference}-{grid_version}-{digest}.{export_type}")
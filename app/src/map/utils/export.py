@@ -1,16 +1,28 @@
+import json
+from itertools import islice
+
 import folium
+import shapely
+import zipfile
 from lxml import etree
-from pykml.factory import KML_ElementMaker
+from lxml.builder import ElementMaker
 from enum import Enum, auto
 import pandas as pd
 
+from app.src.map.data.geo_polygon import GeoPolygon
 from app.src.map.utils.geo_df import build_geo_dataframe_from_polygons
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class ExportType(Enum):
     HTML = "html"
     KML = "kml"
     GEO_JSON = "geo_json"
+    KMZ = "kmz"
 
     @classmethod
     def value_of(cls, value):
@@ -22,22 +34,132 @@ class ExportType(Enum):
 
 def export_to_geojson(polygons, **opts):
     """
-    Export the given GeoDataFrame to a GeoJSON file.
+    Export the given polygons as a GeoJSON FeatureCollection, written feature by feature.
 
     Args:
-        geo_df (GeoDataFrame): The GeoDataFrame to export.
-        file_path (str): The file path to save the GeoJSON.
-        :param polygons:
+        polygons (iterable): The polygons to export, a list or a generator reading them from a cursor.
+        file_path (str): The file path to save the GeoJSON, it is returned as a string when not given.
+        stream (bool): Return a generator of the GeoJSON pieces instead of a string.
+        referenced_by_country (bool): Export the polygons as referenced by country or state.
     """
     referenced_by_country = opts.get('referenced_by_country')
     file_path = opts.get('file_path')
-    geo_df = build_geo_dataframe_from_polygons(polygons,
-                                               False if referenced_by_country is None else referenced_by_country)
+    chunks = iter_geojson(polygons, False if referenced_by_country is None else referenced_by_country)
+    if opts.get('stream'):
+        return chunks
     if file_path is None:
-        return geo_df.to_json()
+        return ''.join(chunks)
+
+    with open(file_path, 'w') as file:
+        file.writelines(chunks)
+
+
+def iter_geojson(polygons, referenced_by_country=False, batch_size=1000):
+    """
+    Generate a GeoJSON FeatureCollection of polygons piece by piece.
+
+    The polygons are consumed batch_size at a time, the geometries of a batch are encoded by shapely in one call
+    and the properties with orjson when it is installed, so only one batch is held in memory at a time.
+
+    Args:
+        polygons (iterable): The polygons to export.
+        referenced_by_country (bool): Export the polygons as referenced by country or state.
+        batch_size (int): Number of features encoded at a time.
+
+    Yields:
+        str: The next piece of the GeoJSON document.
+    """
+    feature_properties = country_feature_properties if referenced_by_country else state_feature_properties
+    polygons = iter(polygons)
+
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    while True:
+        batch = list(islice(polygons, batch_size))
+        if not batch:
+            break
+        geometries = shapely.to_geojson(GeoPolygon.decode_geometries(batch))
+        features = []
+        for polygon, geometry in zip(batch, geometries):
+            feature_id, properties = feature_properties(polygon)
+            features.append(f'{{"id": {dumps(str(feature_id))}, "type": "Feature", '
+                            f'"properties": {dumps(properties)}, "geometry": {geometry}}}')
+        yield separator + ', '.join(features)
+        separator = ', '
+    yield ']}'
+
+
+def state_feature_properties(polygon):
+    """
+    Get the ID and properties of the GeoJSON feature of a polygon referenced by state, as build_geo_dataframe_from_polygons
+    lays them out.
+    """
+    state = polygon.state
+    return polygon.object_id, {
+        'state_code': state.code if state is not None else '',
+        'state': state.name if state is not None else '',
+        'cap_city': polygon.cap_city,
+        'source': polygon.source,
+        'shape_area': polygon.shape_area,
+        'shape_length': polygon.shape_length,
+        'geo_zone': polygon.geo_zone,
+        **cell_properties(polygon),
+    }
+
+
+def country_feature_properties(polygon):
+    """
+    Get the ID and properties of the GeoJSON feature of a polygon referenced by country.
+    """
+    return polygon.pid, {
+        'shape_area': polygon.shape_area,
+        'shape_length': polygon.shape_length,
+        **cell_properties(polygon),
+    }
 
-    geo_df.to_file(file_path, driver="GeoJSON")
 
+def cell_properties(polygon):
+    """
+    Get the position of the cell of a polygon in the grid pyramid, its parent links it to the coarser resolution.
+    """
+    return {
+        'resolution': polygon.resolution,
+        'cell_id': polygon.cell_id,
+        'parent_cell_id': polygon.parent_cell_id,
+    }
+
+
+def dumps(value):
+    """
+    Encode a value as JSON, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+
+KML_NAMESPACE = "http://www.opengis.net/kml/2.2"
+
+# Placemarks are written inside the kml element whose default namespace is KML, building them without a namespace
+# keeps the writer from declaring the namespaces again on every placemark
+KML_PlacemarkMaker = ElementMaker()
+
+# Shared by every placemark through its styleUrl
+KML_STYLE_ID = "cell"
+
+
+def create_kml_style():
+    """
+    Create the KML style shared by the placemarks.
+
+    Returns:
+        KML Element: The style element.
+    """
+    return KML_PlacemarkMaker.Style(
+        KML_PlacemarkMaker.LineStyle(KML_PlacemarkMaker.color("ff0000ff")),
+        KML_PlacemarkMaker.PolyStyle(KML_PlacemarkMaker.fill("0")),
+        id=KML_STYLE_ID
+    )
 
 
 def create_kml_placemark(polygon):
@@ -53,64 +175,147 @@ def create_kml_placemark(polygon):
     coords = list(polygon.coordinates)
     coord_str = " ".join(f"{coord[0]},{coord[1]}" for coord in coords)
 
-    return KML_ElementMaker.Placemark(
-        KML_ElementMaker.Style(
-            KML_ElementMaker.LineStyle(KML_ElementMaker.color("ff0000ff")),
-            KML_ElementMaker.PolyStyle(KML_ElementMaker.fill(0))
-        ),
-        KML_ElementMaker.ExtendedData(
-            KML_ElementMaker.SchemaData(
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['index']}", name="id"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['left']}", name="left"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['top']}", name="top"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['right']}", name="right"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['bottom']}", name="bottom"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['row_index']}", name="row_index"),
-                KML_ElementMaker.SimpleData(f"{polygon.metadata['col_index']}", name="col_index"),
+    children = [KML_PlacemarkMaker.styleUrl(f"#{KML_STYLE_ID}")]
+    # Polygons referenced by country carry no metadata
+    metadata = getattr(polygon, 'metadata', None)
+    if metadata is not None:
+        children.append(KML_PlacemarkMaker.ExtendedData(
+            KML_PlacemarkMaker.SchemaData(
+                KML_PlacemarkMaker.SimpleData(f"{metadata['index']}", name="id"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['left']}", name="left"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['top']}", name="top"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['right']}", name="right"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['bottom']}", name="bottom"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['row_index']}", name="row_index"),
+                KML_PlacemarkMaker.SimpleData(f"{metadata['col_index']}", name="col_index"),
                 schemaUrl="#clipped"
             )
-        ),
-        KML_ElementMaker.MultiGeometry(
-            KML_ElementMaker.Polygon(
-                KML_ElementMaker.outerBoundaryIs(
-                    KML_ElementMaker.LinearRing(
-                        KML_ElementMaker.coordinates(coord_str)
-                    )
+        ))
+    children.append(KML_PlacemarkMaker.MultiGeometry(
+        KML_PlacemarkMaker.Polygon(
+            KML_PlacemarkMaker.outerBoundaryIs(
+                KML_PlacemarkMaker.LinearRing(
+                    KML_PlacemarkMaker.coordinates(coord_str)
                 )
             )
         )
-    )
+    ))
+
+    return KML_PlacemarkMaker.Placemark(*children)
+
+
+class ChunkWriter:
+    """
+    File-like object collecting what is written to it until it is drained, so a writer can feed a generator.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_kml(polygons, batch_size=1000):
+    """
+    Generate a KML document of polygons piece by piece with lxml's incremental writer.
+
+    Args:
+        polygons (iterable): The polygons to export, a list or a generator reading them from a cursor.
+        batch_size (int): Number of placemarks written between two pieces.
+
+    Yields:
+        bytes: The next piece of the KML document.
+    """
+    output = ChunkWriter()
+    with etree.xmlfile(output, encoding='utf-8') as xml_file:
+        xml_file.write_declaration()
+        with xml_file.element(f"{{{KML_NAMESPACE}}}kml", nsmap={None: KML_NAMESPACE}):
+            with xml_file.element(f"{{{KML_NAMESPACE}}}Document"):
+                xml_file.write(create_kml_style())
+                for count, polygon in enumerate(polygons, start=1):
+                    xml_file.write(create_kml_placemark(polygon))
+                    if count % batch_size == 0:
+                        xml_file.flush()
+                        yield output.drain()
+    yield output.drain()
+
+
+def iter_kmz(polygons, batch_size=1000):
+    """
+    Generate a KMZ archive of polygons piece by piece, the KML document is compressed as it is written.
+
+    Args:
+        polygons (iterable): The polygons to export.
+        batch_size (int): Number of placemarks written between two pieces.
+
+    Yields:
+        bytes: The next piece of the KMZ archive.
+    """
+    output = ChunkWriter()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('doc.kml', 'w') as document:
+            for chunk in iter_kml(polygons, batch_size):
+                document.write(chunk)
+                yield output.drain()
+    yield output.drain()
 
 
 def export_to_kml(polygons, **opts):
     """
-    Export the given GeoDataFrame to a KML file.
+    Export the given polygons to a KML file.
 
     Args:
-        polygons (list): The list of polygons to export.
+        polygons (iterable): The polygons to export.
+        file_path (str): The file path to save the KML, it is returned as a string when not given.
+        stream (bool): Return a generator of the KML pieces instead of a string.
     """
-    file_path = opts.get('file_path')
-    place_marks = []
+    chunks = iter_kml(polygons)
+    if opts.get('stream') or opts.get('file_path') is not None:
+        return write_chunks(chunks, **opts)
+    return b''.join(chunks).decode('utf-8')
 
-    for polygon in polygons:
-        place_mark = create_kml_placemark(polygon)
-        place_marks.append(place_mark)
 
-    kml_document = KML_ElementMaker.kml(KML_ElementMaker.Document(*place_marks))
+def export_to_kmz(polygons, **opts):
+    """
+    Export the given polygons to a KMZ file, a zip archive holding the KML document.
+
+    Args:
+        polygons (iterable): The polygons to export.
+        file_path (str): The file path to save the KMZ, it is returned as bytes when not given.
+        stream (bool): Return a generator of the KMZ pieces instead of bytes.
+    """
+    return write_chunks(iter_kmz(polygons), **opts)
 
-    kml_str = etree.tostring(kml_document, pretty_print=True).decode('utf-8')
 
+def write_chunks(chunks, **opts):
+    """
+    Write the pieces of an export to opts['file_path'], or return them as a generator (opts['stream']) or as bytes.
+    """
+    file_path = opts.get('file_path')
+    if opts.get('stream'):
+        return chunks
     if file_path is None:
-        return kml_str
+        return b''.join(chunks)
 
-    with open(file_path, 'w') as file:
-        file.write(kml_str)
+    with open(file_path, 'wb') as file:
+        file.writelines(chunks)
 
 
 def export_to_html(polygons, **opts):
     referenced_by_country = opts.get('referenced_by_country')
     file_path = opts.get('file_path')
-    geo_df = build_geo_dataframe_from_polygons(polygons,
+    # The map is built from the whole frame, so polygons streamed from a cursor are read in full here
+    geo_df = build_geo_dataframe_from_polygons(list(polygons),
                                                False if referenced_by_country is None else referenced_by_country)
     style1 = {'fillColor': '#333366', 'color': '#134B70', 'fillOpacity': 0.2, 'weight': 1}
 
@@ -155,6 +360,14 @@ exports = {
     ExportType.HTML: export_to_html,
     ExportType.KML: export_to_kml,
     ExportType.GEO_JSON: export_to_geojson,
+    ExportType.KMZ: export_to_kmz,
+}
+
+mimetypes = {
+    ExportType.HTML: 'text/html',
+    ExportType.KML: 'application/vnd.google-earth.kml+xml',
+    ExportType.GEO_JSON: 'application/geo+json',
+    ExportType.KMZ: 'application/vnd.google-earth.kmz',
 }
 
 
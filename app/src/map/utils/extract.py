@@ -1,10 +1,16 @@
 import os
 
+from app.src.map.data.feature_hash import FeatureHash
+from app.src.map.data.grid import Grid
 from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
 from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
-from app.src.map.utils.grid import create_grid, clip_grid
-from app.src.map.utils.polygon import extract_polygons
-from app.src.map.utils.reader import read_geojson
+from app.src.map.utils.artifacts import write_artifacts
+from app.src.map.utils.grid import clip_pyramid, create_grid, create_grid_cells, refine_cell_ranges
+from app.src.map.utils.incremental import changed_cell_ranges, hash_features
+from app.src.map.utils.jobs import job_stage
+from app.src.map.utils.polygon import extract_polygon_columns
+from app.src.map.utils.reader import dissolve_map, read_geojson
+from app.src.map.utils.units import KM_PER_DEGREE_LATITUDE, KM_PER_DEGREE_LONGITUDE
 
 
 def extract_states(geo_df, states):
@@ -21,37 +27,174 @@ def extract_states(geo_df, states):
     return geo_df[geo_df['state'].isin(states)]
 
 
-def extract_and_save_geojson_file_as_polygons(conn, referenced_by_country=False, grid_width=33, grid_height=33):
+def extract_and_save_geojson_file_as_polygons(conn, referenced_by_country=False, grid_width=33, grid_height=33,
+                                               workers=1, chunk_size=5000, load_data=False,
+                                               artifacts_dir=None, job=None, incremental=False, resolutions=1):
     """
    Extracts polygons from a GeoJSON file, creates a grid, clips the grid with the input map,
    and saves the polygons to the database.
 
+   With several resolutions a pyramid of grids is saved, the cells doubling in size at every resolution. Only
+   the coarsest grid is clipped against the map, the finer ones are cut from its clipped cells.
+
+   Every resolution, the Grid row and the feature hashes are saved in one transaction, every polygon row carries
+   the ID of its Grid and the rows of the previous versions are dropped in it. A failed or cancelled extraction
+   leaves the previous grid version, its rows and its hashes as they were.
+
    Args:
        conn (Connection Engine): Database connection engine.
        referenced_by_country (bool): Save geojson as referenced by country or state.
+       grid_width (float): Width of a cell of resolution 0 in kilometres.
+       grid_height (float): Height of a cell of resolution 0 in kilometres.
+       workers (int): Number of processes to clip the grid with.
+       chunk_size (int): Number of rows sent per INSERT statement.
+       load_data (bool): Load the rows with LOAD DATA LOCAL INFILE instead of INSERT statements.
+       artifacts_dir (str): Optional directory to write the exports of every state and of the whole country to,
+                            see utils.artifacts.write_artifacts.
+       job (Job): Optional background job the progress of every stage is reported to, cancelling it stops the
+                  extraction at the next stage or insert chunk with nothing saved.
+
+       incremental (bool): Only clip again the cells under the features added, changed or removed since the
+                           previous extraction and replace their rows, keeping the previous grid origin so the
+                           cells stay aligned. Everything is extracted when there is no previous extraction with
+                           the same cell size and resolutions.
+       resolutions (int): Number of resolutions of the pyramid, grid_width and grid_height are the cell size of
+                          resolution 0, e.g. 6 resolutions of 1km cells give 1, 2, 4, 8, 16 and 32km cells.
+
+   Returns:
+       Grid: The grid the polygons were extracted into, its ID is the new grid version.
+
+   Raises:
+       ValueError: When the cell size, resolutions or workers are not positive, see validate_extraction.
    """
     geojson_path = os.getenv("GEOJSON_INPUT_PATH")
 
     if not geojson_path:
         raise ValueError("Environment variable GEOJSON_INPUT_PATH not set")
+    validate_extraction(grid_width, grid_height, resolutions, workers)
 
     # Declare width and height of each square in the grid in degrees
     width, height = kilometres_to_degrees(grid_width, grid_height)
+    reference = "COUNTRY" if referenced_by_country else "STATE"
+
+    # Read the geojson file, the features are fingerprinted before the country is dissolved
+    with job_stage(job, "read") as stage:
+        source_gdf = read_geojson(geojson_path)
+        feature_hashes = hash_features(source_gdf, reference)
+        input_map_gdf = dissolve_map(source_gdf) if referenced_by_country else source_gdf
+        stage['items'] = len(source_gdf)
+
+    # The coarsest resolution, the one clipped against the map
+    top = resolutions - 1
+    scale = 2 ** top
+
+    previous_grid = find_previous_grid(conn, reference, width, height, resolutions) if incremental else None
+    if previous_grid is not None:
+        previous_hashes = FeatureHash.find_feature_hashes(conn, reference)
+        with job_stage(job, "diff") as stage:
+            # Whole cells of the coarsest resolution are cut again, so every resolution below them is complete
+            cell_ranges = changed_cell_ranges(previous_hashes, feature_hashes, previous_grid, top)
+            stage['items'] = len(cell_ranges)
+        if not cell_ranges:
+            print(f"No feature changed since grid {previous_grid.gid} was extracted")
+            return previous_grid
+        origin = (previous_grid.origin_x, previous_grid.origin_y)
+    else:
+        min_x, min_y, _, _ = input_map_gdf.total_bounds
+        origin = (float(min_x), float(min_y))
+
+    with job_stage(job, "grid") as stage:
+        if previous_grid is not None:
+            grid = create_grid_cells(cell_ranges, height * scale, width * scale, origin, crs=input_map_gdf.crs)
+            # Only the regions reaching the cells being clipped again are needed
+            min_x, min_y, max_x, max_y = grid.total_bounds
+            input_map_gdf = input_map_gdf.cx[min_x:max_x, min_y:max_y]
+        else:
+            grid = create_grid(input_map_gdf, height * scale, width * scale, origin=origin)
+        stage['items'] = len(grid)
+
+    # Clipped map, one resolution at a time from the coarsest so only two of them are held at once
+    model = PolygonReferencedByCountry if referenced_by_country else PolygonReferencedByState
+    pyramid = clip_pyramid(grid, input_map_gdf, height, width, origin, resolutions, workers=workers)
+    try:
+        # Persist the lattice parameters so a point can be mapped to its cell arithmetically, its ID tags the rows
+        grid = Grid(reference=reference, origin_x=origin[0], origin_y=origin[1], cell_width=width,
+                    cell_height=height, resolutions=resolutions)
+        grid.save_to_db(conn, commit=False)
+
+        for resolution in range(top, -1, -1):
+            with job_stage(job, "clip") as stage:
+                _, clipped_map_gdf = next(pyramid)
+                stage['items'] = len(clipped_map_gdf)
+
+            with job_stage(job, "extract") as stage:
+                columns = extract_polygon_columns(clipped_map_gdf, referenced_by_country, resolution, resolutions,
+                                                  grid_id=grid.gid)
+                stage['items'] = len(columns)
+
+            with job_stage(job, "insert"):
+                if previous_grid is not None:
+                    model.delete_cell_ranges(conn, refine_cell_ranges(cell_ranges, top - resolution),
+                                             previous_grid.gid, resolution)
+                model.batch_insert_columns(conn, columns, chunk_size=chunk_size, load_data=load_data,
+                                           progress=job.processed if job is not None else None, commit=False)
+
+        # The unchanged cells of the previous version join the new one, the rows of any other version are dropped
+        model.replace_grid_version(conn, grid.gid, previous_grid.gid if previous_grid is not None else None)
+        FeatureHash.replace_feature_hashes(conn, reference, feature_hashes, commit=False)
+        conn.commit()
+
+    except Exception:
+        # Nothing of the pyramid is kept, the previous rows deleted for the changed cells are back in place
+        conn.rollback()
+        raise
+
+    if artifacts_dir is not None and grid.gid is not None:
+        with job_stage(job, "artifacts"):
+            write_artifacts(conn, artifacts_dir, reference, grid.gid)
+    return grid
+
+
+def validate_extraction(grid_width, grid_height, resolutions, workers):
+    """
+    Check the parameters of an extraction before anything is read or saved.
 
-    # Read the geojson file
-    input_map_gdf = read_geojson(geojson_path, referenced_by_country)
-    grid = create_grid(input_map_gdf, height, width)
+    Args:
+        grid_width (float): Width of a cell in kilometres.
+        grid_height (float): Height of a cell in kilometres.
+        resolutions (int): Number of resolutions of the pyramid.
+        workers (int): Number of processes to clip the grid with.
 
-    # Clipped map
-    clipped_map_gdf = clip_grid(grid, input_map_gdf)
+    Raises:
+        ValueError: When a cell size is not a positive number, or resolutions or workers not a positive integer.
+    """
+    for name, value in (('width', grid_width), ('height', grid_height)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+            raise ValueError(f"Invalid {name}: {value}, expected a positive number of kilometres")
+    for name, value in (('resolutions', resolutions), ('workers', workers)):
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"Invalid {name}: {value}, expected a positive integer")
 
-    polygons = extract_polygons(clipped_map_gdf, height, width, referenced_by_country)
 
-    if referenced_by_country:
-        insert = PolygonReferencedByCountry.batch_insert_geopolygon
-    else:
-        insert = PolygonReferencedByState.batch_insert_geopolygon
-    insert(conn, polygons)
+def find_previous_grid(conn, reference, width, height, resolutions=1):
+    """
+    Find the grid of the previous extraction a new extraction can be aligned with.
+
+    Args:
+        conn: Database connection object.
+        reference (str): STATE or COUNTRY.
+        width (float): Width of a cell in degrees.
+        height (float): Height of a cell in degrees.
+        resolutions (int): Number of resolutions of the pyramid.
+
+    Returns:
+        Grid: The previous grid, or None when there is none with the same cell size and resolutions.
+    """
+    previous_grid = Grid.find_latest_grid(conn, reference)
+    if previous_grid is not None and not previous_grid.has_cell_size(width, height, resolutions):
+        print(f"The cell size changed since grid {previous_grid.gid} was extracted, extracting everything")
+        return None
+    return previous_grid
 
 
 def kilometres_to_degrees(grid_width, grid_height):
@@ -68,12 +211,12 @@ def kilometres_to_degrees(grid_width, grid_height):
     # but for latitude we use an approximate acceptable value which is 1 deg = 110.574km
     # however since the focus case is in nigeria, we can get the upper bounds and lower bounds of nigeria and
     # compute the average to get a better approximation of each width for a grid.
-    height = grid_height / 110.574
+    height = grid_height / KM_PER_DEGREE_LATITUDE
 
     # The value of longitude varies largely due to the distance between each line varies from the poles to the equator.
     # for longitude, deg = cos(latitude) * length of degrees at the equator (111.32km)
     # But for more accurate readings we can calculate this to get an average value of 109.85612km/deg
     # This can be done using the Circumference of the circle at the middle of nigeria divided by 360 deg.
     # From calculation this C(Nigeria) = 39,548.204929km
-    width = grid_width / 109.85612
+    width = grid_width / KM_PER_DEGREE_LONGITUDE
     return width, height
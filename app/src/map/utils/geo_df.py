@@ -1,5 +1,7 @@
 import geopandas as gpd
-from shapely import Polygon
+import pandas as pd
+
+from app.src.map.data.geo_polygon import GeoPolygon
 
 
 def build_geo_dataframe_from_polygons(polygons, referenced_by_country=False):
@@ -16,7 +18,7 @@ def build_geo_dataframe_from_polygons(polygons, referenced_by_country=False):
                          - shape_area
                          - shape_length
                          - geo_zone
-                         - coordinates (list of tuples representing the polygon's vertices)
+                         - geometry (shapely Polygon of the polygon's vertices)
         referenced_by_country (bool): This determines to build the frame as a country or state.
 
     Returns:
@@ -41,7 +43,7 @@ def build_geo_dataframe_from_polygons_by_state(polygons):
                          - shape_area
                          - shape_length
                          - geo_zone
-                         - coordinates (list of tuples representing the polygon's vertices)
+                         - geometry (shapely Polygon of the polygon's vertices)
 
     Returns:
         GeoDataFrame: A GeoDataFrame representing the input polygons.
@@ -55,7 +57,8 @@ def build_geo_dataframe_from_polygons_by_state(polygons):
         'shape_area': [polygon.shape_area for polygon in polygons],
         'shape_length': [polygon.shape_length for polygon in polygons],
         'geo_zone': [polygon.geo_zone for polygon in polygons],
-        'geometry': [Polygon(polygon.coordinates) for polygon in polygons]
+        **cell_columns(polygons),
+        'geometry': GeoPolygon.decode_geometries(polygons)
     }
 
     # Create a GeoDataFrame
@@ -71,7 +74,8 @@ def build_geo_dataframe_from_polygons_by_country(polygons):
     polygons_data = {
         'shape_area': [polygon.shape_area for polygon in polygons],
         'shape_length': [polygon.shape_length for polygon in polygons],
-        'geometry': [Polygon(polygon.coordinates) for polygon in polygons],
+        **cell_columns(polygons),
+        'geometry': GeoPolygon.decode_geometries(polygons),
         'object_id': [polygon.pid for polygon in polygons]
     }
 
@@ -82,3 +86,20 @@ def build_geo_dataframe_from_polygons_by_country(polygons):
     gdf.set_index('object_id', inplace=True)
 
     return gdf
+
+
+def cell_columns(polygons):
+    """
+    Build the columns holding the position of the polygons' cells in the grid pyramid.
+
+    Args:
+        polygons (list): List of polygon objects.
+
+    Returns:
+        dict: The resolution, cell ID and parent cell ID columns, a missing ID is kept as null.
+    """
+    return {
+        'resolution': [polygon.resolution for polygon in polygons],
+        'cell_id': pd.array([polygon.cell_id for polygon in polygons], dtype='Int64'),
+        'parent_cell_id': pd.array([polygon.parent_cell_id for polygon in polygons], dtype='Int64'),
+    }
@@ -1,44 +1,270 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
 import geopandas as gpd
-from shapely import box
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import Polygon, STRtree, box
 
 
-def clip_grid(grid_geo_df, map_geo_df):
+def clip_grid(grid_geo_df, map_geo_df, workers=1):
     """
     Clip the grid cells with the given map to keep only the intersecting areas.
 
+    The map regions are loaded into a spatial index so every cell falls in one of three groups:
+        - outside: intersects no region and is dropped without any geometric work.
+        - inside: covered by a region and kept as-is with that region's attributes.
+        - boundary: straddles a region's border and is intersected with that region.
+    Only the boundary cells go through a real intersection, so the cost follows the length of the borders
+    rather than the number of cells. The output matches gpd.overlay(..., how='intersection').
+
     Args:
         grid_geo_df (GeoDataFrame): The grid GeoDataFrame.
         map_geo_df (GeoDataFrame): The map GeoDataFrame to clip against.
+        workers (int): Number of processes to clip with, see clip_grid_in_parallel.
 
     Returns:
         GeoDataFrame: A GeoDataFrame with the clipped grid cells.
     """
-    geo_df = gpd.overlay(grid_geo_df, map_geo_df, how='intersection')
+    if workers is not None and workers > 1:
+        return clip_grid_in_parallel(grid_geo_df, map_geo_df, workers)
+
+    cells = np.asarray(grid_geo_df.geometry.array, dtype=object)
+    # A copy, the invalid regions are repaired in it rather than in the caller's frame
+    regions = np.array(map_geo_df.geometry.array, dtype=object, copy=True)
+    invalid = ~shapely.is_valid(regions)
+    regions[invalid] = shapely.make_valid(regions[invalid])
+    shapely.prepare(regions)
+
+    # Cells intersecting no region are left out of the pairs entirely
+    cell_positions, region_positions = STRtree(regions).query(cells, predicate='intersects')
+    order = np.lexsort((region_positions, cell_positions))
+    cell_positions, region_positions = cell_positions[order], region_positions[order]
+
+    # Cells covered by a region keep their own geometry, the rest are intersected with the region
+    geometries = cells[cell_positions]
+    boundary = ~shapely.covers(regions[region_positions], geometries)
+    geometries[boundary] = shapely.intersection(geometries[boundary], regions[region_positions[boundary]])
 
-    return geo_df
+    # Cells that only touch a region leave lines or points behind, only the polygonal parts are kept
+    geometries = extract_polygonal(geometries)
+    keep = ~shapely.is_empty(geometries)
+    cell_positions, region_positions, geometries = cell_positions[keep], region_positions[keep], geometries[keep]
 
+    grid_attributes = grid_geo_df.drop(columns=grid_geo_df.geometry.name).iloc[cell_positions]
+    map_attributes = map_geo_df.drop(columns=map_geo_df.geometry.name).iloc[region_positions]
+    shared = grid_attributes.columns.intersection(map_attributes.columns)
+    grid_attributes = grid_attributes.rename(columns={column: f"{column}_1" for column in shared})
+    map_attributes = map_attributes.rename(columns={column: f"{column}_2" for column in shared})
 
-def create_grid(geo_df, grid_height, grid_width):
+    attributes = pd.concat([grid_attributes.reset_index(drop=True), map_attributes.reset_index(drop=True)], axis=1)
+    return gpd.GeoDataFrame(attributes, geometry=geometries, crs=grid_geo_df.crs)
+
+
+def clip_grid_in_parallel(grid_geo_df, map_geo_df, workers):
+    """
+    Clip the grid cells with the given map across several processes.
+
+    The grid is split into bands of whole columns and each band is clipped against the regions overlapping it
+    in its own process. The bands are merged back in grid order, so the result is identical to clipping
+    serially and the cell order (and the IDs the cells get when saved) stays stable.
+
+    Args:
+        grid_geo_df (GeoDataFrame): The grid GeoDataFrame.
+        map_geo_df (GeoDataFrame): The map GeoDataFrame to clip against.
+        workers (int): Number of processes to clip with.
+
+    Returns:
+        GeoDataFrame: A GeoDataFrame with the clipped grid cells.
+    """
+    # A few bands per worker so a band full of borders does not hold up the others
+    columns = np.unique(grid_geo_df['grid_col'])
+    bands = [band for band in np.array_split(columns, workers * 4) if len(band) > 0]
+    # An empty or single column grid has nothing to split, and pd.concat cannot merge an empty list of bands
+    if len(bands) < 2:
+        return clip_grid(grid_geo_df, map_geo_df)
+
+    band_frames = []
+    for band in bands:
+        band_geo_df = grid_geo_df[grid_geo_df['grid_col'].between(band[0], band[-1])]
+        min_x, min_y, max_x, max_y = band_geo_df.total_bounds
+        band_frames.append((band_geo_df, map_geo_df.cx[min_x:max_x, min_y:max_y]))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        clipped_frames = list(executor.map(clip_grid, *zip(*band_frames)))
+
+    return pd.concat(clipped_frames, ignore_index=True)
+
+
+def extract_polygonal(geometries):
+    """
+    Reduce intersection results to their polygonal parts.
+
+    Args:
+        geometries (ndarray): Array of geometries.
+
+    Returns:
+        ndarray: The geometries with lines and points removed, an empty polygon where nothing is left.
+    """
+    geometries = geometries.copy()
+    type_ids = shapely.get_type_id(geometries)
+    polygonal = (type_ids == shapely.GeometryType.POLYGON) | (type_ids == shapely.GeometryType.MULTIPOLYGON)
+
+    for position in np.flatnonzero(type_ids == shapely.GeometryType.GEOMETRYCOLLECTION):
+        parts = shapely.get_parts(shapely.get_parts(geometries[position]))
+        parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+        if len(parts) == 1:
+            geometries[position] = parts[0]
+        elif len(parts) > 1:
+            geometries[position] = shapely.multipolygons(parts)
+        polygonal[position] = len(parts) > 0
+
+    geometries[~polygonal] = Polygon()
+    return geometries
+
+
+def create_grid(geo_df, grid_height, grid_width, origin=None):
     """
     Create a rectangular grid over the bounding box of a GeoDataFrame.
 
+    Each cell carries its integer position in the lattice as the grid_col and grid_row columns, the cell
+    (col, row) spans origin_x + col * grid_width to origin_x + (col + 1) * grid_width horizontally and
+    likewise vertically.
+
     Args:
         geo_df (GeoDataFrame): The input GeoDataFrame.
         grid_height (float): The height of each grid cell.
         grid_width (float): The width of each grid cell.
+        origin (tuple): The (x, y) corner of cell (0, 0), defaults to the lower left corner of the bounding box.
 
     Returns:
         GeoDataFrame: A GeoDataFrame containing the grid cells as geometries.
     """
     min_x, min_y, max_x, max_y = geo_df.total_bounds
-    grid_cells = []
+    origin_x, origin_y = (min_x, min_y) if origin is None else origin
+
+    # Positions are counted in whole cells so the edges never drift away from the lattice
+    cols = np.arange(math.floor((min_x - origin_x) / grid_width), math.ceil((max_x - origin_x) / grid_width))
+    rows = np.arange(math.floor((min_y - origin_y) / grid_height), math.ceil((max_y - origin_y) / grid_height))
+
+    # Column major order, every row of a column before moving to the next column
+    grid_cols = np.repeat(cols, len(rows))
+    grid_rows = np.tile(rows, len(cols))
+    grid_cells = box(origin_x + grid_cols * grid_width, origin_y + grid_rows * grid_height,
+                     origin_x + (grid_cols + 1) * grid_width, origin_y + (grid_rows + 1) * grid_height)
+
+    return gpd.GeoDataFrame({'grid_col': grid_cols, 'grid_row': grid_rows, 'geometry': grid_cells}, crs=geo_df.crs)
+
 
-    x = min_x
-    while x < max_x:
-        y = min_y
-        while y < max_y:
-            grid_cells.append(box(x, y, x + grid_width, y + grid_height))
-            y += grid_height
-        x += grid_width
+def create_grid_cells(cell_ranges, grid_height, grid_width, origin, crs=None):
+    """
+    Create the cells of a grid within some ranges of cells, every cell once even where the ranges overlap.
+
+    Args:
+        cell_ranges (list): (min_col, min_row, max_col, max_row) ranges, both ends included.
+        grid_height (float): The height of each grid cell.
+        grid_width (float): The width of each grid cell.
+        origin (tuple): The (x, y) corner of cell (0, 0).
+        crs: CRS of the grid.
+
+    Returns:
+        GeoDataFrame: The grid cells in column major order, with the same columns as create_grid.
+    """
+    origin_x, origin_y = origin
+    positions = [np.stack(np.meshgrid(np.arange(min_col, max_col + 1), np.arange(min_row, max_row + 1),
+                                      indexing='ij'), axis=-1).reshape(-1, 2)
+                 for min_col, min_row, max_col, max_row in cell_ranges]
+    positions = np.unique(np.concatenate(positions), axis=0) if positions else np.empty((0, 2), dtype='int64')
+
+    grid_cols, grid_rows = positions[:, 0], positions[:, 1]
+    grid_cells = box(origin_x + grid_cols * grid_width, origin_y + grid_rows * grid_height,
+                     origin_x + (grid_cols + 1) * grid_width, origin_y + (grid_rows + 1) * grid_height)
+
+    return gpd.GeoDataFrame({'grid_col': grid_cols, 'grid_row': grid_rows, 'geometry': grid_cells}, crs=crs)
+
+
+def subdivide_grid(clipped_geo_df, grid_height, grid_width, origin):
+    """
+    Split every clipped cell into the four cells of the next finer resolution.
+
+    A child cell lies within its parent, so intersecting it with the clipped parent gives the same piece as
+    clipping it against the map, while only touching the few vertices of the parent's piece. Children covered by
+    their parent's piece are kept as-is, children outside of it are dropped.
+
+    Args:
+        clipped_geo_df (GeoDataFrame): The clipped cells of a resolution, see clip_grid.
+        grid_height (float): The height of each child cell.
+        grid_width (float): The width of each child cell.
+        origin (tuple): The (x, y) corner of cell (0, 0), shared by every resolution.
+
+    Returns:
+        GeoDataFrame: The clipped child cells with the attributes of their parent, in the order clip_grid would
+                      have returned them.
+    """
+    origin_x, origin_y = origin
+    parent_positions = np.repeat(np.arange(len(clipped_geo_df)), 4)
+    grid_cols = clipped_geo_df['grid_col'].to_numpy()[parent_positions] * 2 + np.tile([0, 0, 1, 1], len(clipped_geo_df))
+    grid_rows = clipped_geo_df['grid_row'].to_numpy()[parent_positions] * 2 + np.tile([0, 1, 0, 1], len(clipped_geo_df))
+    cells = box(origin_x + grid_cols * grid_width, origin_y + grid_rows * grid_height,
+                origin_x + (grid_cols + 1) * grid_width, origin_y + (grid_rows + 1) * grid_height)
 
-    return gpd.GeoDataFrame({'geometry': grid_cells}, crs=geo_df.crs)
+    pieces = np.asarray(clipped_geo_df.geometry.array, dtype=object)[parent_positions]
+    shapely.prepare(pieces)
+    inside = shapely.covers(pieces, cells)
+    geometries = cells.copy()
+    geometries[~inside] = shapely.intersection(cells[~inside], pieces[~inside])
+    geometries = extract_polygonal(geometries)
+    keep = ~shapely.is_empty(geometries)
+
+    # Cell by cell in column major order, the pieces of a cell in their parent's order
+    order = np.lexsort((grid_rows[keep], grid_cols[keep]))
+    positions = np.flatnonzero(keep)[order]
+    attributes = clipped_geo_df.drop(columns=[clipped_geo_df.geometry.name, 'grid_col', 'grid_row'])
+    attributes = attributes.iloc[parent_positions[positions]].reset_index(drop=True)
+    attributes.insert(0, 'grid_col', grid_cols[positions])
+    attributes.insert(1, 'grid_row', grid_rows[positions])
+    return gpd.GeoDataFrame(attributes, geometry=geometries[positions], crs=clipped_geo_df.crs)
+
+
+def clip_pyramid(grid_geo_df, map_geo_df, grid_height, grid_width, origin, resolutions, workers=1):
+    """
+    Clip a pyramid of grids with the map in one pass, coarsest resolution first.
+
+    Only the coarsest grid is clipped against the map, every finer resolution is cut from the clipped cells of the
+    resolution above it, see subdivide_grid.
+
+    Args:
+        grid_geo_df (GeoDataFrame): The grid of the coarsest resolution, see create_grid.
+        map_geo_df (GeoDataFrame): The map GeoDataFrame to clip against.
+        grid_height (float): The height of each cell of resolution 0.
+        grid_width (float): The width of each cell of resolution 0.
+        origin (tuple): The (x, y) corner of cell (0, 0), shared by every resolution.
+        resolutions (int): Number of resolutions, the cells of resolution r are 2 ** r times the base size.
+        workers (int): Number of processes to clip the coarsest grid with, see clip_grid.
+
+    Yields:
+        tuple: The resolution and its clipped cells, from resolutions - 1 down to 0.
+    """
+    clipped_geo_df = clip_grid(grid_geo_df, map_geo_df, workers=workers)
+    yield resolutions - 1, clipped_geo_df
+    for resolution in range(resolutions - 2, -1, -1):
+        scale = 2 ** resolution
+        clipped_geo_df = subdivide_grid(clipped_geo_df, grid_height * scale, grid_width * scale, origin)
+        yield resolution, clipped_geo_df
+
+
+def refine_cell_ranges(cell_ranges, levels):
+    """
+    Get the ranges of cells covering the same area some levels finer in the pyramid.
+
+    Args:
+        cell_ranges (list): (min_col, min_row, max_col, max_row) ranges, both ends included.
+        levels (int): Number of resolutions to go down by.
+
+    Returns:
+        list: The ranges in cells of the finer resolution.
+    """
+    scale = 2 ** levels
+    return [(min_col * scale, min_row * scale, (max_col + 1) * scale - 1, (max_row + 1) * scale - 1)
+            for min_col, min_row, max_col, max_row in cell_ranges]
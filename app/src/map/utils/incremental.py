@@ -0,0 +1,82 @@
+import hashlib
+import json
+
+import numpy as np
+import shapely
+
+from app.src.map.data.feature_hash import FeatureHash
+
+# Properties identifying a source feature between extractions, the first one present with unique values is used
+FEATURE_KEY_COLUMNS = ['statecode', 'objectid']
+
+
+def feature_keys(geo_df):
+    """
+    Get the key of every feature of a source map.
+
+    Args:
+        geo_df (GeoDataFrame): The map as read from the GeoJSON file.
+
+    Returns:
+        list: The key of each feature, its position in the file when no property identifies it.
+    """
+    for column in FEATURE_KEY_COLUMNS:
+        if column in geo_df.columns and geo_df[column].notna().all() and geo_df[column].is_unique:
+            return geo_df[column].astype(str).tolist()
+    return [str(position) for position in range(len(geo_df))]
+
+
+def hash_features(geo_df, reference):
+    """
+    Fingerprint every feature of a source map by its geometry and properties.
+
+    Args:
+        geo_df (GeoDataFrame): The map as read from the GeoJSON file.
+        reference (str): STATE or COUNTRY.
+
+    Returns:
+        list: One FeatureHash per feature.
+    """
+    geometries = np.asarray(geo_df.geometry.array, dtype=object)
+    # Normalized so the same shape hashes the same whatever the order its rings were written in
+    wkbs = shapely.to_wkb(shapely.normalize(geometries))
+    bounds = shapely.bounds(geometries).tolist()
+    properties = geo_df.drop(columns=geo_df.geometry.name).to_dict('records')
+
+    feature_hashes = []
+    for key, wkb, feature_bounds, feature_properties in zip(feature_keys(geo_df), wkbs, bounds, properties):
+        digest = hashlib.sha256(wkb)
+        digest.update(json.dumps(feature_properties, sort_keys=True, default=str).encode('utf-8'))
+        feature_hashes.append(FeatureHash(reference, key, digest.hexdigest(), *feature_bounds))
+    return feature_hashes
+
+
+def changed_cell_ranges(previous_hashes, feature_hashes, grid, resolution=0):
+    """
+    Get the ranges of cells that have to be clipped again, those under a feature that was added, changed or
+    removed since the previous extraction, covering both where the feature was and where it is now.
+
+    Args:
+        previous_hashes (dict): FeatureHash objects of the previous extraction by feature key.
+        feature_hashes (list): FeatureHash objects of the features now.
+        grid (Grid): The grid of the previous extraction, the cells stay aligned with it.
+        resolution (int): Resolution of the pyramid the ranges are counted in.
+
+    Returns:
+        list: (min_col, min_row, max_col, max_row) ranges, empty when nothing changed.
+    """
+    ranges = []
+    keys = set()
+    for feature_hash in feature_hashes:
+        keys.add(feature_hash.key)
+        previous = previous_hashes.get(feature_hash.key)
+        if previous is not None and previous.digest == feature_hash.digest:
+            continue
+        ranges.append(grid.cell_range(*feature_hash.bounds, resolution))
+        if previous is not None:
+            ranges.append(grid.cell_range(*previous.bounds, resolution))
+
+    for key, previous in previous_hashes.items():
+        if key not in keys:
+            ranges.append(grid.cell_range(*previous.bounds, resolution))
+    return ranges
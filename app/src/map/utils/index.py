@@ -0,0 +1,323 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from app.src.map.data.feature_hash import FeatureHash
+from app.src.map.data.geo_polygon import GeoPolygon
+from app.src.map.data.grid import Grid
+from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
+from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
+from app.src.map.utils.units import KM_PER_DEGREE_LATITUDE, KM_PER_DEGREE_LONGITUDE
+
+# A degree of latitude is longer than one of longitude, a radius in degrees covering a distance in kilometres
+# along the longitude covers it in every direction
+DEGREE_RATIO = KM_PER_DEGREE_LATITUDE / KM_PER_DEGREE_LONGITUDE
+
+# Valid longitudes and latitudes of SRID 4326, a box searched in the database never reaches past them
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+
+class PolygonIndex:
+
+    def __init__(self, polygons):
+        """
+        Initialize an in-memory spatial index over polygon objects.
+
+        The geometries are prepared and loaded into a shapely STRtree so point lookups can be answered
+        without a database round trip.
+
+        Args:
+            polygons (list): List of PolygonReferencedByState or PolygonReferencedByCountry objects.
+        """
+        self.polygons = [polygon for polygon in polygons if polygon is not None]
+        self.geometries = np.array(GeoPolygon.decode_geometries(self.polygons), dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+        # Column views used to answer bulk lookups without touching the polygon objects
+        self.ids = np.array([polygon_id(polygon) for polygon in self.polygons], dtype='int64')
+        self.state_codes = np.array([polygon.state.code if getattr(polygon, 'state', None) is not None else ''
+                                     for polygon in self.polygons], dtype=object)
+
+    def find(self, longitude, latitude):
+        """
+        Find the polygon containing a given point (longitude, latitude).
+
+        Points on a cell boundary are not matched, the same as the lookup through the database.
+
+        Args:
+            longitude (float): Longitude of the point.
+            latitude (float): Latitude of the point.
+
+        Returns:
+            The polygon object containing the point, or None if not found.
+        """
+        matches = self.tree.query(shapely.points(longitude, latitude), predicate='within')
+        if len(matches) == 0:
+            return None
+        # The lowest position is the row the database would have returned first
+        return self.polygons[matches.min()]
+
+    def find_many(self, longitudes, latitudes):
+        """
+        Find the polygons containing many points at once.
+
+        The points are matched against the tree in a single vectorized query instead of one lookup per point.
+
+        Args:
+            longitudes (ndarray): Longitudes of the points.
+            latitudes (ndarray): Latitudes of the points.
+
+        Returns:
+            ndarray: The position in self.polygons of the polygon containing each point, or -1 if not found.
+        """
+        points = shapely.points(np.asarray(longitudes, dtype='float64'), np.asarray(latitudes, dtype='float64'))
+        point_positions, polygon_positions = self.tree.query(points, predicate='within')
+
+        # Keep the lowest polygon position for each point, the same polygon find() returns
+        positions = np.full(len(points), len(self.polygons), dtype='int64')
+        np.minimum.at(positions, point_positions, polygon_positions)
+        positions[positions == len(self.polygons)] = -1
+        return positions
+
+    def find_in_bbox(self, min_x, min_y, max_x, max_y):
+        """
+        Find the polygons intersecting a bounding box.
+
+        Args:
+            min_x (float): West edge of the box.
+            min_y (float): South edge of the box.
+            max_x (float): East edge of the box.
+            max_y (float): North edge of the box.
+
+        Returns:
+            ndarray: The positions in self.polygons of the polygons intersecting the box, in ascending order.
+        """
+        return np.sort(self.tree.query(shapely.box(min_x, min_y, max_x, max_y), predicate='intersects'))
+
+    def find_nearest(self, longitude, latitude, k=1, max_distance=None):
+        """
+        Find the k polygons nearest to a point, to snap a point just outside the grid to the closest cells.
+
+        The nearest polygon is found with STRtree.query_nearest. For more than one, the search radius grows from
+        its distance until the tree holds k polygons within it, so only the polygons around the point are measured.
+
+        Args:
+            longitude (float): Longitude of the point.
+            latitude (float): Latitude of the point.
+            k (int): Number of polygons to find.
+            max_distance (float): Only find the polygons within this many kilometres, any distance when not given.
+
+        Returns:
+            tuple: The positions in self.polygons of the polygons and their distances in kilometres (see
+                   distances_km), nearest first, 0 for a polygon containing the point.
+
+        Raises:
+            ValueError: When max_distance is not positive, STRtree.query_nearest needs a positive distance.
+        """
+        check_max_distance(max_distance)
+        empty = np.empty(0, dtype='int64'), np.empty(0, dtype='float64')
+        if len(self.polygons) == 0 or k < 1:
+            return empty
+
+        point = shapely.points(longitude, latitude)
+        max_radius = None if max_distance is None else max_distance / KM_PER_DEGREE_LONGITUDE
+        nearest, nearest_distances = self.tree.query_nearest(point, max_distance=max_radius, return_distance=True,
+                                                             all_matches=False)
+        if len(nearest) == 0:
+            return empty
+
+        radius = nearest_distances[0]
+        candidates = self.tree.query(point, predicate='dwithin', distance=radius)
+        if len(candidates) < k:
+            # A polygon containing the point is at 0, the radius then grows from its size
+            min_x, min_y, max_x, max_y = shapely.bounds(self.geometries[nearest[0]])
+            step = max(radius, max_x - min_x, max_y - min_y)
+            while len(candidates) < k and len(candidates) < len(self.polygons):
+                if max_radius is not None and radius >= max_radius:
+                    break
+                radius = radius + step
+                step *= 2
+                if max_radius is not None:
+                    radius = min(radius, max_radius)
+                candidates = self.tree.query(point, predicate='dwithin', distance=radius)
+
+        # The k nearest in degrees are not always the k nearest in kilometres, the radius is widened so they are
+        radius *= DEGREE_RATIO
+        if max_radius is not None:
+            radius = min(radius, max_radius)
+        candidates = np.sort(self.tree.query(point, predicate='dwithin', distance=radius))
+
+        distances = distances_km(self.geometries[candidates], longitude, latitude)
+        order = np.argsort(distances, kind='stable')[:k]
+        if max_distance is not None:
+            order = order[distances[order] <= max_distance]
+        return candidates[order], distances[order]
+
+    def __len__(self):
+        return len(self.polygons)
+
+
+class GridIndex(PolygonIndex):
+
+    def __init__(self, polygons, grid, resolution=0):
+        """
+        Initialize an index that maps a point to its grid cell arithmetically.
+
+        A lookup is a floor() of the point against the grid origin and cell size, a dictionary probe on the
+        (col, row) key and an exact containment check on the few clipped pieces of that cell.
+
+        Args:
+            polygons (list): List of polygon objects carrying grid_col and grid_row.
+            grid (Grid): The parameters of the grid the polygons were cut from.
+            resolution (int): Resolution of the grid pyramid the polygons belong to.
+        """
+        super().__init__(polygons)
+        self.grid = grid
+        self.resolution = resolution
+        self.cells = {}
+        for position, polygon in enumerate(self.polygons):
+            self.cells.setdefault((polygon.grid_col, polygon.grid_row), []).append(position)
+
+    def find(self, longitude, latitude):
+        for position in self.cells.get(self.grid.cell_of(longitude, latitude, self.resolution), ()):
+            if shapely.contains_xy(self.geometries[position], longitude, latitude):
+                return self.polygons[position]
+        return None
+
+
+def polygon_id(polygon):
+    """
+    Get the database ID of a polygon object, or -1 if it has not been saved.
+
+    Args:
+        polygon: PolygonReferencedByState or PolygonReferencedByCountry object.
+
+    Returns:
+        int: The polygon ID.
+    """
+    pid = polygon.pid if isinstance(polygon, PolygonReferencedByCountry) else polygon.id
+    return -1 if pid is None else pid
+
+
+def distances_km(geometries, longitude, latitude):
+    """
+    Measure the distances from a point to geometries in kilometres.
+
+    The degrees are scaled with the lengths of a degree the grid cell size is computed with, see utils.units,
+    which is accurate enough for the few cells around a point.
+
+    Args:
+        geometries (ndarray): The shapely geometries.
+        longitude (float): Longitude of the point.
+        latitude (float): Latitude of the point.
+
+    Returns:
+        ndarray: The distance to each geometry, 0 for a geometry containing the point.
+    """
+    scale = np.array([KM_PER_DEGREE_LONGITUDE, KM_PER_DEGREE_LATITUDE])
+    scaled = shapely.transform(np.asarray(geometries, dtype=object), lambda coordinates: coordinates * scale)
+    return shapely.distance(scaled, shapely.points(longitude * scale[0], latitude * scale[1]))
+
+
+def find_nearest_polygons(conn, longitude, latitude, referenced_by_country=False, k=1, max_distance=None,
+                          resolution=0):
+    """
+    Find the k polygons nearest to a point straight from the database, when there is no in-memory index.
+
+    Boxes around the point, growing from the size of a cell, are read through the index on the cell keys and the
+    spatial index until k polygons lie within the circle the box holds, so only the cells around the point are
+    read, see PolygonIndex.find_nearest. The boxes are clipped to valid longitudes and latitudes and stop growing
+    once they cover the extent of the extracted features.
+
+    Args:
+        conn: Database connection object.
+        longitude (float): Longitude of the point.
+        latitude (float): Latitude of the point.
+        referenced_by_country (bool): Search the country referenced table instead of the state one.
+        k (int): Number of polygons to find.
+        max_distance (float): Only find the polygons within this many kilometres, any distance when not given.
+        resolution (int): Resolution of the grid pyramid.
+
+    Returns:
+        list: (polygon, distance in kilometres) pairs, nearest first.
+
+    Raises:
+        ValueError: When max_distance is not positive.
+    """
+    check_max_distance(max_distance)
+    model = PolygonReferencedByCountry if referenced_by_country else PolygonReferencedByState
+    reference = "COUNTRY" if referenced_by_country else "STATE"
+    grid = Grid.find_latest_grid(conn, reference)
+    if grid is None or k < 1:
+        return []
+
+    # No polygon lies outside the features the grid was cut from, the whole world before they were recorded
+    extent = FeatureHash.find_extent(conn, reference) or WORLD
+
+    radius = max(grid.cell_size(resolution))
+    max_radius = None if max_distance is None else max_distance / KM_PER_DEGREE_LONGITUDE
+    while True:
+        if max_radius is not None:
+            radius = min(radius, max_radius)
+        box = (max(longitude - radius, WORLD[0]), max(latitude - radius, WORLD[1]),
+               min(longitude + radius, WORLD[2]), min(latitude + radius, WORLD[3]))
+        polygons = model.find_polygons_in_bbox(conn, *box, resolution=resolution, grid=grid)
+        distances = distances_km(GeoPolygon.decode_geometries(polygons), longitude, latitude)
+        # A polygon outside the box is farther than the box's half width along the longitude
+        covered = radius * KM_PER_DEGREE_LONGITUDE
+        if (np.count_nonzero(distances <= covered) >= k or (max_radius is not None and radius >= max_radius)
+                or covers(box, extent)):
+            break
+        radius *= 2
+
+    ids = np.array([polygon_id(polygon) for polygon in polygons], dtype='int64')
+    order = np.lexsort((ids, distances))[:k]
+    return [(polygons[position], float(distances[position])) for position in order
+            if max_distance is None or distances[position] <= max_distance]
+
+
+def check_max_distance(max_distance):
+    # A point is never within 0 km of a polygon it is not inside, the nearest lookups need a positive distance
+    if max_distance is not None and not max_distance > 0:
+        raise ValueError(f"Invalid max_distance: {max_distance}, expected a positive number of kilometres")
+
+
+def covers(box, extent):
+    """
+    Check whether a box covers an extent.
+
+    Args:
+        box (tuple): (min_x, min_y, max_x, max_y) of the box.
+        extent (tuple): (min_x, min_y, max_x, max_y) of the extent.
+
+    Returns:
+        bool: True when no part of the extent lies outside the box.
+    """
+    return box[0] <= extent[0] and box[1] <= extent[1] and box[2] >= extent[2] and box[3] >= extent[3]
+
+
+def build_index(conn, referenced_by_country=False, resolution=0):
+    """
+    Build an index from every polygon of a resolution stored in the database.
+
+    A GridIndex is built when the grid parameters of the latest extraction are stored and every polygon carries
+    its cell position, otherwise the lookups go through the STRtree.
+
+    Args:
+        conn: Database connection object.
+        referenced_by_country (bool): Index the country referenced table instead of the state one.
+        resolution (int): Resolution of the grid pyramid to index.
+
+    Returns:
+        PolygonIndex: The populated index.
+    """
+    if referenced_by_country:
+        polygons = PolygonReferencedByCountry.get_all_polygons(conn, resolution=resolution)
+    else:
+        polygons = PolygonReferencedByState.get_all_polygons(conn, resolution=resolution)
+
+    grid = Grid.find_latest_grid(conn, "COUNTRY" if referenced_by_country else "STATE")
+    if grid is not None and all(polygon.grid_col is not None for polygon in polygons):
+        return GridIndex(polygons, grid, resolution)
+    return PolygonIndex(polygons)
@@ -0,0 +1,234 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from queue import Queue
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, reference, params):
+        """
+        Initialize a background job and its progress report.
+
+        Args:
+            reference (str): STATE or COUNTRY, jobs of the same reference run one at a time.
+            params (dict): Parameters the job was submitted with.
+        """
+        self.id = uuid.uuid4().hex
+        self.reference = reference
+        self.params = params
+        self.status = QUEUED
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = []
+        self._started = None
+        self._finished = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Run a stage of the job, timing it and checking for cancellation before it starts and after it ends.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        self.check_cancelled()
+        stage = {'name': name, 'items': 0, 'started': time.perf_counter(), 'elapsed': None}
+        with self._lock:
+            self.stages.append(stage)
+        try:
+            yield stage
+        finally:
+            with self._lock:
+                stage['elapsed'] = time.perf_counter() - stage['started']
+        self.check_cancelled()
+
+    def processed(self, items):
+        """
+        Report the number of items the current stage has processed so far, raising JobCancelled when the job was
+        cancelled so a long stage stops early.
+
+        Args:
+            items (int): Items processed by the current stage.
+        """
+        with self._lock:
+            if self.stages:
+                self.stages[-1]['items'] = items
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def cancel(self):
+        """
+        Ask the job to stop, a queued job never starts and a running job stops at its next check.
+
+        Returns:
+            bool: Whether the job was still queued or running.
+        """
+        with self._lock:
+            if self.status not in (QUEUED, RUNNING):
+                return False
+            self._cancelled.set()
+            if self.status == QUEUED:
+                self.status = CANCELLED
+                self.finished_at = _now()
+            return True
+
+    def run(self, target):
+        """
+        Run the job in the current thread.
+
+        Args:
+            target (callable): Called with the job, it reports its progress through stage and processed.
+        """
+        with self._lock:
+            if self.status != QUEUED:
+                return
+            self.status = RUNNING
+            self.started_at = _now()
+            self._started = time.perf_counter()
+        try:
+            target(self)
+            status, error = SUCCEEDED, None
+        except JobCancelled:
+            status, error = CANCELLED, None
+        except Exception as e:
+            traceback.print_exc()
+            status, error = FAILED, str(e)
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished_at = _now()
+            self._finished = time.perf_counter()
+
+    def to_dict(self):
+        """
+        Get the progress report of the job.
+
+        Returns:
+            dict: Status, current stage, items processed, elapsed seconds and items per second overall and per stage.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            stages = []
+            for stage in self.stages:
+                elapsed = stage['elapsed'] if stage['elapsed'] is not None else now - stage['started']
+                stages.append({
+                    'name': stage['name'],
+                    'items': stage['items'],
+                    'elapsed': elapsed,
+                    'throughput': stage['items'] / elapsed if elapsed > 0 else 0.0,
+                })
+            elapsed = None
+            if self._started is not None:
+                elapsed = (self._finished if self._finished is not None else now) - self._started
+            current = self.stages[-1]['name'] if self.stages and self.status == RUNNING else None
+            return {
+                'id': self.id,
+                'reference': self.reference,
+                'params': self.params,
+                'status': self.status,
+                'stage': current,
+                'items_processed': stages[-1]['items'] if stages else 0,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'elapsed': elapsed,
+                'stages': stages,
+            }
+
+
+class JobManager:
+
+    def __init__(self, target, keep=100):
+        """
+        Initialize a runner of background jobs, one worker thread per reference runs its jobs in submission order.
+
+        Args:
+            target (callable): Called with each job to do its work.
+            keep (int): Number of finished jobs kept for reporting.
+        """
+        self.target = target
+        self.keep = keep
+        self._jobs = OrderedDict()
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, reference, params):
+        """
+        Queue a job, it starts once the jobs submitted before it for the same reference are done.
+
+        Args:
+            reference (str): STATE or COUNTRY.
+            params (dict): Parameters of the job.
+
+        Returns:
+            Job: The queued job.
+        """
+        job = Job(reference, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+            queue = self._queues.get(reference)
+            if queue is None:
+                queue = self._queues[reference] = Queue()
+                threading.Thread(target=self._work, args=(queue,), name=f"jobs-{reference}", daemon=True).start()
+        queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _work(self, queue):
+        while True:
+            job = queue.get()
+            job.run(self.target)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in (QUEUED, RUNNING)]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self._jobs[job_id]
+
+
+def job_stage(job, name):
+    """
+    Get the stage context of a job, or a context doing nothing when the work does not run as a job.
+
+    Args:
+        job (Job): The job, or None.
+        name (str): Name of the stage.
+
+    Returns:
+        The context, it yields the stage record whose items can be set.
+    """
+    return job.stage(name) if job is not None else nullcontext({'name': name, 'items': 0})
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
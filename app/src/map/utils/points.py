@@ -0,0 +1,89 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def read_points(data, content_type):
+    """
+    Read a batch of (latitude, longitude) points from a request body.
+
+    Supported bodies:
+        - application/json: [[latitude, longitude], ...] or {"points": [[latitude, longitude], ...]}
+        - text/csv: one "latitude,longitude" pair per line, an optional header line is skipped
+        - application/x-npy: a NumPy .npy file holding an (n, 2) array
+        - application/octet-stream: raw little-endian float64 values, latitude and longitude interleaved
+
+    Args:
+        data (bytes): The raw request body.
+        content_type (str): The request content type.
+
+    Returns:
+        tuple: The latitudes and longitudes as float64 ndarrays.
+
+    Raises:
+        ValueError: When the body is not in a supported content type or does not hold (latitude, longitude) pairs.
+    """
+    content_type = (content_type or 'application/json').split(';')[0].strip().lower()
+
+    if content_type == 'application/json':
+        points = json.loads(data)
+        if isinstance(points, dict):
+            points = points.get('points', [])
+        points = point_pairs(np.asarray(points, dtype='float64'), 'JSON')
+    elif content_type == 'text/csv':
+        points = read_csv_points(data)
+    elif content_type == 'application/x-npy':
+        points = point_pairs(np.load(io.BytesIO(data), allow_pickle=False).astype('float64', copy=False), 'NumPy')
+    elif content_type == 'application/octet-stream':
+        if len(data) % 16 != 0:
+            raise ValueError("Binary points must be pairs of little-endian float64 values")
+        points = np.frombuffer(data, dtype='<f8')
+    else:
+        raise ValueError(f"{content_type} is not a supported points content type")
+
+    points = points.reshape(-1, 2) if points.size else np.empty((0, 2))
+    return points[:, 0], points[:, 1]
+
+
+def point_pairs(points, source):
+    """
+    Check that an array holds one (latitude, longitude) pair per row.
+
+    Args:
+        points (ndarray): The points read.
+        source (str): Format the points were read from, for the error message.
+
+    Returns:
+        ndarray: The points, an empty batch as an empty array.
+
+    Raises:
+        ValueError: When the array is not of shape (n, 2), it would otherwise be re-paired into wrong points.
+    """
+    if points.size == 0:
+        return np.empty((0, 2))
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError(f"{source} points must be an (n, 2) array of latitude and longitude, got {points.shape}")
+    return points
+
+
+def read_csv_points(data):
+    """
+    Read "latitude,longitude" lines into an (n, 2) array.
+
+    Args:
+        data (bytes): The CSV body.
+
+    Returns:
+        ndarray: The points.
+    """
+    first_line = data.split(b'\n', 1)[0]
+    try:
+        [float(value) for value in first_line.split(b',')]
+        header = None
+    except ValueError:
+        header = 0
+
+    frame = pd.read_csv(io.BytesIO(data), header=header, usecols=[0, 1], dtype='float64')
+    return frame.to_numpy()
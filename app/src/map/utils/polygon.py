@@ -1,136 +1,87 @@
-from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
-from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
-from app.src.map.data.state import State
-
-
-def create_state_polygon(geom, grid_height, grid_width, i, max_x, max_y, min_x, min_y, props):
-    """
-    Create a PolygonReferencedByState object from geometry and metadata.
-
-    Args:
-        geom (Geometry): The geometry of the polygon.
-        grid_height (float): The height of each grid cell.
-        grid_width (float): The width of each grid cell.
-        i (int): The index of the current geometry.
-        max_x (float): The maximum x-coordinate of the grid bounds.
-        max_y (float): The maximum y-coordinate of the grid bounds.
-        min_x (float): The minimum x-coordinate of the grid bounds.
-        min_y (float): The minimum y-coordinate of the grid bounds.
-        props (dict): The properties of the geometry.
-
-    Returns:
-        PolygonReferencedByState: The created GeoPolygon object.
-    """
-    # Calculate the row and column index for the current geometry
-    row_index = i // int((max_y - min_y) / grid_height)
-    col_index = i % int((max_x - min_x) / grid_width)
-
-    # Prepare metadata for the polygon
-    metadata = {
-        'left': geom.bounds[0],
-        'top': geom.bounds[3],
-        'right': geom.bounds[2],
-        'bottom': geom.bounds[1],
-        'index': i,
-        'row_index': row_index,
-        'col_index': col_index,
-    }
-
-    # Extract coordinates from the geometry
-    coords = list(geom.exterior.coords)
-
-    props_getter = lambda key: props[key] if key in props else ''
-
-    # Retrieve the state object by its code, this only applies for geojson with statecode as a prop parameter.
-    code = props_getter('statecode')
-    states = State.get_states_by_code()
-    state = None
-    if code in states:
-        state = states[code]
-    else:
-        print(f"Cannot find state with code: {code}")
-
-    # Create and return the PolygonReferencedByState object
-    return PolygonReferencedByState(
-        object_id=props_getter('objectid'),
-        state=state,
-        cap_city=props_getter('capcity'),
-        source=props_getter('source'),
-        shape_area=props_getter('shape_area'),
-        shape_length=props_getter('shape_len'),
-        geo_zone=props_getter('geozone'),
-        coordinates=coords,
-        metadata=metadata,
-    )
+import json
 
+import numpy as np
+import pandas as pd
+import shapely
 
-def create_country_polygon(geom, grid_height, grid_width, i, max_x, max_y, min_x, min_y, props):
-    """
-    Create a PolygonReferencedByCountry object from geometry and metadata.
+from app.src.map.data.grid import Grid
+from app.src.map.data.state import State
 
-    Args:
-        geom (Geometry): The geometry of the polygon.
-        grid_height (float): The height of each grid cell.
-        grid_width (float): The width of each grid cell.
-        i (int): The index of the current geometry.
-        max_x (float): The maximum x-coordinate of the grid bounds.
-        max_y (float): The maximum y-coordinate of the grid bounds.
-        min_x (float): The minimum x-coordinate of the grid bounds.
-        min_y (float): The minimum y-coordinate of the grid bounds.
-        props (dict): The properties of the geometry.
 
-    Returns:
-        PolygonReferencedByCountry: The created GeoPolygon object.
+def extract_polygon_columns(geo_df, referenced_by_country=False, resolution=0, resolutions=1, grid_id=None):
     """
-    # Extract coordinates from the geometry
-    coords = list(geom.exterior.coords)
-    props_getter = lambda key: props[key] if key in props else ''
+    Extract all polygons from a GeoDataFrame as insert-ready columns.
 
-    # Create and return the PolygonReferencedByCountry object
-    return PolygonReferencedByCountry(
-        shape_area=props_getter('shape_area'),
-        shape_length=props_getter('shape_len'),
-        coordinates=coords
-    )
-
-
-def extract_polygons(geo_df, grid_height, grid_width, referenced_by_country=False):
-    """
-    Extract all polygons from a GeoDataFrame.
+    MultiPolygons are exploded into their polygons, the bounds of every polygon are computed in one call and
+    the state codes are joined to their states in one lookup, so no Python work is done per row.
 
     Args:
-        geo_df (GeoDataFrame): The GeoDataFrame to extract from.
-        grid_height (float): The height of each grid cell.
-        grid_width (float): The width of each grid cell.
+        geo_df (GeoDataFrame): The clipped grid GeoDataFrame to extract from.
         referenced_by_country (bool): Flag to determine whether to reference by state or country.
+        resolution (int): Resolution of the pyramid the grid was cut at.
+        resolutions (int): Number of resolutions of the pyramid, the coarsest cells have no parent.
+        grid_id (int): ID of the Grid version the polygons are extracted in.
 
     Returns:
-        list: A list of GeoPolygon objects.
+        DataFrame: One row per polygon with the columns of the polygon table, the polygon geometry and,
+                   for states, the metadata as JSON and its bounds and index of the clipped row the polygon
+                   came from as separate columns.
     """
-    # Get the bounds of the GeoDataFrame
-    min_x, min_y, max_x, max_y = geo_df.total_bounds
-    polygons = []
-
-    # Determine which create_polygon function to use
+    exploded = geo_df.explode(index_parts=False)
+    exploded = exploded[exploded.geom_type == 'Polygon']
+    geometries = np.asarray(exploded.geometry.array, dtype=object)
+
+    def prop(key):
+        # Properties missing from the GeoJSON are stored as empty strings
+        if key in exploded.columns:
+            return exploded[key].to_numpy()
+        return np.full(len(exploded), '', dtype=object)
+
+    grid_cols = exploded['grid_col'].to_numpy().astype('int64')
+    grid_rows = exploded['grid_row'].to_numpy().astype('int64')
+    parent_cell_ids = pd.array(Grid.parent_cell_id(resolution, grid_cols, grid_rows), dtype='Int64')
+    if resolution >= resolutions - 1:
+        parent_cell_ids[:] = pd.NA
+    columns = {
+        'shape_area': prop('shape_area'),
+        'shape_length': prop('shape_len'),
+        'geometry': geometries,
+        'grid_col': grid_cols,
+        'grid_row': grid_rows,
+        'resolution': np.full(len(exploded), resolution, dtype='int64'),
+        'cell_id': Grid.cell_id(resolution, grid_cols, grid_rows),
+        'parent_cell_id': parent_cell_ids,
+        'cell_key': Grid.cell_key(grid_cols, grid_rows),
+        'grid_id': pd.array(np.full(len(exploded), grid_id), dtype='Int64'),
+    }
     if referenced_by_country:
-        create_polygon = create_country_polygon
-    else:
-        create_polygon = create_state_polygon
-
-    # Iterate over each row in the GeoDataFrame
-    for i, row in geo_df.iterrows():
-        geom = row.geometry
-        props = row.drop('geometry')
+        return pd.DataFrame(columns)
 
-        # Handle single Polygon geometries
-        if geom.geom_type == 'Polygon':
-            polygon = create_polygon(geom, grid_height, grid_width, i, max_x, max_y, min_x, min_y, props)
-            polygons.append(polygon)
-
-        # Handle MultiPolygon geometries by iterating over each polygon
-        elif geom.geom_type == 'MultiPolygon':
-            for polygon in geom.geoms:
-                polygon = create_polygon(polygon, grid_height, grid_width, i, max_x, max_y, min_x, min_y, props)
-                polygons.append(polygon)
+    # Join the state codes to their states, this only applies for geojson with statecode as a prop parameter
+    codes = pd.Series(prop('statecode'))
+    states = State.get_states_by_code()
+    state_ids = codes.map({code: state.sid for code, state in states.items()})
+    for code in codes[state_ids.isna()].unique():
+        print(f"Cannot find state with code: {code}")
 
-    return polygons
+    bounds = shapely.bounds(geometries)
+    columns.update({
+        'object_id': prop('objectid'),
+        'state_id': state_ids.astype('Int64').to_numpy(),
+        'cap_city': prop('capcity'),
+        'source': prop('source'),
+        'geo_zone': prop('geozone'),
+        'index': exploded.index.to_numpy(),
+        'left': bounds[:, 0],
+        'bottom': bounds[:, 1],
+        'right': bounds[:, 2],
+        'top': bounds[:, 3],
+    })
+    columns['metadata'] = [
+        json.dumps({'left': left, 'top': top, 'right': right, 'bottom': bottom, 'index': index,
+                    'row_index': row, 'col_index': col})
+        for left, top, right, bottom, index, col, row in zip(
+            bounds[:, 0].tolist(), bounds[:, 3].tolist(), bounds[:, 2].tolist(), bounds[:, 1].tolist(),
+            columns['index'].tolist(), columns['grid_col'].tolist(), columns['grid_row'].tolist())
+    ]
+    return pd.DataFrame(columns)
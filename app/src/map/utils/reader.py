@@ -16,11 +16,23 @@ def read_geojson(path, reference_by_country=False):
     # For generating clipped grid with dissolved internal boundaries
     map_geo_df = gpd.read_file(path)
     if reference_by_country:
-        map_geo_df = validate_and_clean_geometries(map_geo_df)
-        map_geo_df = map_geo_df.dissolve()
+        map_geo_df = dissolve_map(map_geo_df)
     return map_geo_df
 
 
+def dissolve_map(map_geo_df):
+    """
+    Dissolve the regions of a map into one, as the map is clipped when referenced by country.
+
+    Args:
+        map_geo_df (GeoDataFrame): The map as read, it is left unchanged.
+
+    Returns:
+        GeoDataFrame: The dissolved map.
+    """
+    return validate_and_clean_geometries(map_geo_df.copy()).dissolve()
+
+
 def validate_and_clean_geometries(map_df):
     cleaned_geometries = []
     for geom in map_df['geometry']:
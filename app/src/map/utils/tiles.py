@@ -0,0 +1,298 @@
+import math
+import struct
+
+import numpy as np
+import shapely
+
+from app.src.map.data.geo_polygon import GeoPolygon
+from app.src.map.utils.grid import extract_polygonal
+
+# Size of a tile in tile coordinates, and the margin kept around it so outlines are not cut at the tile edges
+EXTENT = 4096
+BUFFER = 64
+
+# Web mercator (EPSG:3857) spans +-pi * EARTH_RADIUS on both axes, which it reaches at MAX_LATITUDE
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798066
+
+# Narrowest cell drawn on a 256 pixel tile in pixels, so a tile holds at most (256 / 4) ** 2 cells of a resolution
+TILE_SIZE = 256
+MIN_CELL_PIXELS = 4
+
+# Geometry commands and feature type of the vector tile encoding
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+POLYGON = 3
+
+
+def tile_mercator_bounds(z, x, y):
+    """
+    Get the web mercator bounds of a tile.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Column of the tile, counted from the west.
+        y (int): Row of the tile, counted from the north.
+
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y) in metres.
+    """
+    tiles = 2 ** z
+    if z < 0 or not 0 <= x < tiles or not 0 <= y < tiles:
+        raise ValueError(f"Tile {z}/{x}/{y} does not exist")
+    size = 2 * math.pi * EARTH_RADIUS / tiles
+    min_x = -math.pi * EARTH_RADIUS + x * size
+    max_y = math.pi * EARTH_RADIUS - y * size
+    return min_x, max_y - size, min_x + size, max_y
+
+
+def resolution_for_zoom(grid, z):
+    """
+    Get the finest resolution of a grid pyramid whose cells are at least MIN_CELL_PIXELS wide at a zoom level.
+
+    A low zoom tile covering the whole grid then reads the few cells of a coarse resolution instead of every base
+    cell. The pixel is measured along the longitude, web mercator only stretches the latitude.
+
+    Args:
+        grid (Grid): The grid of the stored polygons.
+        z (int): Zoom level, a 256 pixel tile covers 360 / 2^z degrees of longitude.
+
+    Returns:
+        int: The resolution, the coarsest of the grid when even its cells are narrower, 0 without a grid.
+    """
+    if grid is None:
+        return 0
+    pixel = 360 / (TILE_SIZE * 2 ** z)
+    resolution = math.ceil(math.log2(MIN_CELL_PIXELS * pixel / min(grid.cell_size(0))))
+    return min(max(resolution, 0), grid.resolutions - 1)
+
+
+def tile_query_bounds(z, x, y):
+    """
+    Get the longitude and latitude bounds of a tile and its buffer, the area whose cells are drawn on the tile.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Column of the tile.
+        y (int): Row of the tile.
+
+    Returns:
+        tuple: (min_lon, min_lat, max_lon, max_lat).
+    """
+    min_x, min_y, max_x, max_y = tile_mercator_bounds(z, x, y)
+    margin = (max_x - min_x) * BUFFER / EXTENT
+    min_lon, min_lat = mercator_to_lon_lat(min_x - margin, min_y - margin)
+    max_lon, max_lat = mercator_to_lon_lat(max_x + margin, max_y + margin)
+    return max(min_lon, -180.0), min_lat, min(max_lon, 180.0), max_lat
+
+
+def mercator_to_lon_lat(x, y):
+    """
+    Convert web mercator coordinates to longitude and latitude.
+    """
+    return (math.degrees(x / EARTH_RADIUS),
+            math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS)) - math.pi / 2))
+
+
+def to_tile_coordinates(geometries, z, x, y):
+    """
+    Project geometries onto a tile, clipped to the tile and its buffer and snapped to whole tile coordinates.
+
+    Args:
+        geometries (ndarray): Geometries in longitude and latitude.
+        z (int): Zoom level.
+        x (int): Column of the tile.
+        y (int): Row of the tile.
+
+    Returns:
+        ndarray: The geometries in tile coordinates, y pointing down. Geometries that fall outside the tile or
+                 collapse below one tile unit are empty.
+    """
+    min_x, min_y, max_x, max_y = tile_mercator_bounds(z, x, y)
+    scale = EXTENT / (max_x - min_x)
+
+    def project(coordinates):
+        longitudes = np.radians(coordinates[:, 0])
+        latitudes = np.radians(np.clip(coordinates[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+        mercator_x = EARTH_RADIUS * longitudes
+        mercator_y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + latitudes / 2))
+        return np.column_stack(((mercator_x - min_x) * scale, (max_y - mercator_y) * scale))
+
+    projected = shapely.transform(geometries, project)
+    clipped = shapely.clip_by_rect(projected, -BUFFER, -BUFFER, EXTENT + BUFFER, EXTENT + BUFFER)
+    return extract_polygonal(shapely.set_precision(clipped, 1.0))
+
+
+def render_tile(polygons, z, x, y, layer_name):
+    """
+    Render the polygons intersecting a tile as a Mapbox Vector Tile.
+
+    Args:
+        polygons (list): The polygons intersecting the tile and its buffer.
+        z (int): Zoom level.
+        x (int): Column of the tile.
+        y (int): Row of the tile.
+        layer_name (str): Name of the single layer of the tile.
+
+    Returns:
+        bytes: The encoded tile, empty when no polygon is visible on it.
+    """
+    if not polygons:
+        return b''
+    geometries = to_tile_coordinates(np.array(GeoPolygon.decode_geometries(polygons), dtype=object), z, x, y)
+
+    layer = TileLayer(layer_name)
+    for polygon, geometry in zip(polygons, geometries):
+        if not shapely.is_empty(geometry):
+            layer.add_feature(feature_id(polygon), geometry, feature_properties(polygon))
+    if not layer.features:
+        return b''
+    return _bytes_field(3, layer.encode())
+
+
+def feature_id(polygon):
+    return polygon.pid if hasattr(polygon, 'pid') else polygon.id
+
+
+def feature_properties(polygon):
+    """
+    Get the properties a polygon carries on a tile.
+    """
+    properties = {'grid_col': polygon.grid_col, 'grid_row': polygon.grid_row, 'resolution': polygon.resolution,
+                  'cell_id': polygon.cell_id, 'parent_cell_id': polygon.parent_cell_id}
+    state = getattr(polygon, 'state', None)
+    if state is not None:
+        properties['state_code'] = state.code
+    return properties
+
+
+class TileLayer:
+
+    def __init__(self, name):
+        """
+        Initialize a vector tile layer, features are added to it already in tile coordinates.
+
+        Args:
+            name (str): Name of the layer.
+        """
+        self.name = name
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def add_feature(self, fid, geometry, properties):
+        """
+        Add a polygon feature to the layer.
+
+        Args:
+            fid (int): Feature ID, left out when it is None.
+            geometry (Polygon or MultiPolygon): Geometry in tile coordinates.
+            properties (dict): Feature properties, None values are left out.
+        """
+        commands = polygon_commands(geometry)
+        if not commands:
+            return
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault((type(value), value), len(self.values)))
+
+        feature = b''
+        if fid is not None and fid >= 0:
+            feature += _varint_field(1, fid)
+        feature += _packed_field(2, tags) + _varint_field(3, POLYGON) + _packed_field(4, commands)
+        self.features.append(feature)
+
+    def encode(self):
+        layer = _varint_field(15, 2) + _bytes_field(1, self.name.encode('utf-8'))
+        layer += b''.join(_bytes_field(2, feature) for feature in self.features)
+        layer += b''.join(_bytes_field(3, key.encode('utf-8')) for key in self.keys)
+        layer += b''.join(_bytes_field(4, _encode_value(value)) for _, value in self.values)
+        return layer + _varint_field(5, EXTENT)
+
+
+def polygon_commands(geometry):
+    """
+    Encode a polygon or multipolygon in tile coordinates as vector tile geometry commands.
+
+    Exterior rings are written with a positive and interior rings with a negative area, as the encoding
+    requires, and rings that collapsed to a line are skipped.
+
+    Args:
+        geometry (Polygon or MultiPolygon): The geometry.
+
+    Returns:
+        list: The command integers.
+    """
+    commands = []
+    cursor = np.zeros(2, dtype='int64')
+    for polygon in shapely.get_parts(geometry):
+        for position, ring in enumerate([polygon.exterior, *polygon.interiors]):
+            coordinates = shapely.get_coordinates(ring).astype('int64')[:-1]
+            area = _ring_area(coordinates) if len(coordinates) >= 3 else 0
+            if area == 0:
+                if position == 0:
+                    break
+                continue
+            if (area > 0) != (position == 0):
+                coordinates = coordinates[::-1]
+
+            deltas = np.diff(coordinates, axis=0, prepend=cursor[np.newaxis])
+            cursor = coordinates[-1]
+            zigzag = ((deltas << 1) ^ (deltas >> 63)).tolist()
+            commands.append(_command(MOVE_TO, 1))
+            commands.extend(zigzag[0])
+            commands.append(_command(LINE_TO, len(zigzag) - 1))
+            for delta in zigzag[1:]:
+                commands.extend(delta)
+            commands.append(_command(CLOSE_PATH, 1))
+    return commands
+
+
+def _ring_area(coordinates):
+    x, y = coordinates[:, 0], coordinates[:, 1]
+    return int(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def _command(command, count):
+    return (command & 0x7) | (count << 3)
+
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode('utf-8'))
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _varint_field(5, value)
+        return _varint_field(6, (value << 1) ^ (value >> 63))
+    return _key(3, 1) + struct.pack('<d', float(value))
+
+
+def _varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _key(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _varint_field(number, value):
+    return _key(number, 0) + _varint(value)
+
+
+def _bytes_field(number, data):
+    return _key(number, 2) + _varint(len(data)) + data
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b''.join(_varint(value) for value in values))
@@ -0,0 +1,4 @@
+# Approximate length of a degree around Nigeria, the grid cell sizes and the distances to the cells are converted
+# between kilometres and degrees with it
+KM_PER_DEGREE_LONGITUDE = 109.85612
+KM_PER_DEGREE_LATITUDE = 110.574
@@ -1,19 +1,480 @@
+import os
+import threading
+import time
+
+import numpy as np
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_from_directory, url_for, abort
 
-from app.src.map.data.db import init_conn
+from app.src.map.data.db import init_pool
+from app.src.map.data.grid import Grid
 from app.src.map.data.polygon_referenced_by_country import PolygonReferencedByCountry
 from app.src.map.data.polygon_referenced_by_state import PolygonReferencedByState
+from app.src.map.data.simplification import level_for_tolerance, level_for_zoom
 from app.src.map.data.state import State
-from app.src.map.utils.export import export_geo_dataframe, ExportType
-from app.src.map.utils.extract import extract_and_save_geojson_file_as_polygons
+from app.src.map.utils.artifacts import ALL, artifact_name, read_manifest
+from app.src.map.utils.cache import ExportCache
+from app.src.map.utils.export import cell_properties, export_geo_dataframe, ExportType, mimetypes
+from app.src.map.utils.extract import extract_and_save_geojson_file_as_polygons, validate_extraction
+from app.src.map.utils.index import build_index, find_nearest_polygons, polygon_id
+from app.src.map.utils.jobs import JobManager
+from app.src.map.utils.points import read_points
+from app.src.map.utils.tiles import render_tile, resolution_for_zoom, tile_query_bounds
 
 app = Flask(__name__)
 
 load_dotenv()
 
-conn = init_conn()
-State.get_all_states(conn)
+# Each request borrows its own connection so concurrent requests run in parallel against the database
+pool = init_pool()
+with pool.connection() as conn:
+    State.get_all_states(conn)
+
+# In-memory point lookup indexes keyed by reference, the database is queried when an index is missing
+indexes = {}
+
+
+def load_index(reference):
+    """
+    Build (or rebuild) the in-memory point lookup index for a reference.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+    """
+    if os.getenv("IN_MEMORY_INDEX", "true").lower() == "false":
+        return
+    try:
+        with pool.connection() as conn:
+            index = build_index(conn, referenced_by_country=(reference == "COUNTRY"))
+        if len(index) == 0:
+            indexes.pop(reference, None)
+            return
+        indexes[reference] = index
+        print(f"Indexed {len(index)} polygons referenced by {reference.lower()}")
+    except Exception as e:
+        indexes.pop(reference, None)
+        print(f"Error building polygon index: {e}")
+
+
+load_index("STATE")
+load_index("COUNTRY")
+
+# Batch lookup indexes of the other resolutions, or of every resolution without IN_MEMORY_INDEX, keyed by the
+# reference, resolution and grid version they were built from
+lookup_indexes = {}
+lookup_indexes_lock = threading.Lock()
+
+# Rendered exports keyed by the grid version they were rendered from
+export_cache = ExportCache(max_bytes=int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                           directory=os.getenv("EXPORT_CACHE_DIR") or None)
+
+# Encoded vector tiles keyed by the grid version they were rendered from
+tile_cache = ExportCache(max_bytes=int(os.getenv("TILE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                         directory=os.getenv("TILE_CACHE_DIR") or None)
+
+# Latest grid version and when it was read per reference, re-read every GRID_VERSION_CHECK_INTERVAL seconds so
+# an extraction run by another server process is noticed
+grid_versions = {}
+grids = {}
+grid_version_check_interval = float(os.getenv("GRID_VERSION_CHECK_INTERVAL", "10"))
+
+
+def grid_version(reference, refresh=False):
+    """
+    Get the version of the latest grid extracted for a reference.
+
+    When the version changed since it was last read the exports and tiles cached for the old version are dropped
+    and the point lookup index is rebuilt.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        refresh (bool): Read the version from the database even if it was read recently.
+
+    Returns:
+        int: The grid version, 0 when nothing has been extracted.
+    """
+    version, checked_at = grid_versions.get(reference, (None, 0.0))
+    if not refresh and time.monotonic() - checked_at < grid_version_check_interval:
+        return version
+
+    with pool.connection() as conn:
+        grid = Grid.find_latest_grid(conn, reference)
+    latest_version = grid.gid if grid is not None else 0
+    grid_versions[reference] = (latest_version, time.monotonic())
+    grids[reference] = grid
+
+    if version is not None and latest_version != version:
+        export_cache.invalidate(reference, latest_version)
+        tile_cache.invalidate(reference, latest_version)
+        load_index(reference)
+        with lookup_indexes_lock:
+            for key in [key for key in lookup_indexes if key[0] == reference and key[2] != latest_version]:
+                del lookup_indexes[key]
+        for key in [key for key in manifests if key[0] == reference and key[1] != latest_version]:
+            manifests.pop(key, None)
+    return latest_version
+
+
+def lookup_index(reference, resolution=0):
+    """
+    Get the index a batch of points is resolved with.
+
+    The point lookup index is used at resolution 0, any other index is built once per grid version and kept
+    until the version changes.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        resolution (int): Resolution of the grid pyramid.
+
+    Returns:
+        PolygonIndex: The index of the polygons of the resolution.
+
+    Raises:
+        ValueError: When the grid has no such resolution.
+    """
+    index = indexes.get(reference) if resolution == 0 else None
+    if index is not None:
+        return index
+
+    grid = current_grid(reference)
+    if resolution > 0 and (grid is None or resolution >= grid.resolutions):
+        raise ValueError(f"Invalid resolution: {resolution}, the grid has "
+                         f"{grid.resolutions if grid is not None else 1} resolutions")
+
+    key = (reference, resolution, grid_version(reference))
+    with lookup_indexes_lock:
+        # Held while building so concurrent batches wait for one build instead of each running their own
+        index = lookup_indexes.get(key)
+        if index is None:
+            with pool.connection() as conn:
+                index = build_index(conn, referenced_by_country=(reference == "COUNTRY"), resolution=resolution)
+            lookup_indexes[key] = index
+    return index
+
+
+def current_grid(reference):
+    """
+    Get the grid of the latest extraction for a reference, the database lookups find cells through its keys.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+
+    Returns:
+        Grid: The grid, or None when nothing has been extracted.
+    """
+    grid_version(reference)
+    return grids.get(reference)
+
+
+# Exports of every state and of the whole country rendered once per extraction, see utils.artifacts
+artifacts_dir = os.getenv("ARTIFACTS_DIR") or None
+
+# Polygons per page of /polygons by default and at most
+polygons_page_size = int(os.getenv("POLYGONS_PAGE_SIZE", "500"))
+polygons_max_page_size = int(os.getenv("POLYGONS_MAX_PAGE_SIZE", "5000"))
+
+# Most cells one /nearest request can ask for
+nearest_max_k = int(os.getenv("NEAREST_MAX_K", "100"))
+
+# Artifact manifests keyed by reference and grid version, only the ones found are kept
+manifests = {}
+
+
+def find_artifact(reference, name, export_type):
+    """
+    Find the precomputed artifact of the current grid version.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        name (str): A state code, or ALL for every polygon of the reference.
+        export_type (ExportType): The export format.
+
+    Returns:
+        tuple: The grid version and the manifest entry of the artifact, or None if there is no such artifact.
+    """
+    if artifacts_dir is None:
+        return None
+    version = grid_version(reference)
+    manifest = manifests.get((reference, version))
+    if manifest is None:
+        # Not cached while missing, a new grid version is committed before its artifacts are written
+        manifest = read_manifest(artifacts_dir, reference, version)
+        if manifest is None:
+            return None
+        manifests[(reference, version)] = manifest
+    entry = manifest['artifacts'].get(name, {}).get(export_type.value)
+    if entry is None:
+        return None
+    return version, entry
+
+
+def artifact_response(reference, version, entry, export_type, immutable=False):
+    """
+    Serve an artifact with its content digest as a strong ETag, answering 304 when the client already has it.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        version (int): Grid version of the artifact.
+        entry (dict): Manifest entry of the artifact.
+        export_type (ExportType): The export format.
+        immutable (bool): Served from its versioned URL, so it can be cached forever without revalidation.
+
+    Returns:
+        Response: The artifact.
+    """
+    response = send_from_directory(os.path.join(artifacts_dir, reference, str(version)), entry['file'],
+                                   mimetype=mimetypes[export_type], etag=entry['etag'], conditional=True)
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Content-Location'] = url_for('get_artifact', reference=reference, version=version,
+                                                       file_name=entry['file'])
+    return response
+
+
+def cached_export(reference, selection, export_type, render, level=0, resolution=0):
+    """
+    Serve an export from the cache, rendering and caching it on a miss.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        selection (str or list): The cell id or state codes the export was rendered for.
+        export_type (ExportType): The export format.
+        render (callable): Renders the export when it is not cached.
+        level (int): Simplification level of the geometries.
+        resolution (int): Resolution of the grid pyramid.
+
+    Returns:
+        Response: The export.
+    """
+    key = ExportCache.key(reference, selection, export_type, grid_version(reference), level, resolution)
+    content = export_cache.get(key)
+    if content is None:
+        content = render()
+        if not isinstance(content, (str, bytes)):
+            # A streamed export goes out as it is generated and is cached once it is complete
+            return Response(stream_into_cache(key, content), mimetype=mimetypes[export_type])
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        export_cache.put(key, content)
+    response = Response(content, mimetype=mimetypes[export_type])
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def stream_into_cache(key, chunks):
+    """
+    Pass a streamed export through, caching it when it is complete unless it outgrew the cache.
+
+    Args:
+        key (tuple): The cache key.
+        chunks (iterable of str or bytes): The pieces of the export.
+
+    Yields:
+        bytes: The pieces of the export.
+    """
+    parts, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > export_cache.max_bytes:
+                parts = None
+        yield chunk
+    if parts is not None:
+        export_cache.put(key, b''.join(parts))
+
+
+def simplification_level():
+    """
+    Get the simplification level asked for with the tolerance (in degrees) or zoom query parameter.
+
+    Returns:
+        int: The simplification level, 0 for the full resolution when neither parameter is given.
+    """
+    if 'tolerance' in request.args:
+        return level_for_tolerance(float(request.args['tolerance']))
+    if 'zoom' in request.args:
+        return level_for_zoom(int(request.args['zoom']))
+    return 0
+
+
+def polygon_reference(reference):
+    """
+    Check the reference a request asked for.
+
+    Args:
+        reference (str): STATE or COUNTRY, in any case.
+
+    Returns:
+        str: The reference in upper case.
+
+    Raises:
+        ValueError: When the reference is neither STATE nor COUNTRY.
+    """
+    reference = reference.upper()
+    if reference not in ("STATE", "COUNTRY"):
+        raise ValueError(f"Invalid reference: {reference}, expected STATE or COUNTRY")
+    return reference
+
+
+def grid_resolution():
+    """
+    Get the resolution of the grid pyramid asked for with the resolution query parameter.
+
+    Returns:
+        int: The resolution, 0 for the base cells when the parameter is not given.
+    """
+    resolution = int(request.args.get('resolution', 0))
+    if resolution < 0:
+        raise ValueError(f"Invalid resolution: {resolution}")
+    return resolution
+
+
+def bounding_box():
+    """
+    Get the bounding box asked for with the bbox query parameter, min_x,min_y,max_x,max_y in degrees.
+
+    Returns:
+        tuple: The west, south, east and north edges of the box.
+    """
+    if 'bbox' not in request.args:
+        raise ValueError("bbox is required")
+    try:
+        min_x, min_y, max_x, max_y = (float(value) for value in request.args['bbox'].split(','))
+    except ValueError:
+        raise ValueError(f"Invalid bbox: {request.args['bbox']}, expected min_x,min_y,max_x,max_y")
+    if min_x > max_x or min_y > max_y:
+        raise ValueError(f"Invalid bbox: {request.args['bbox']}, the minimum is above the maximum")
+    return min_x, min_y, max_x, max_y
+
+
+def page_size():
+    """
+    Get the page size asked for with the limit query parameter.
+
+    Returns:
+        int: The page size, POLYGONS_PAGE_SIZE when the parameter is not given.
+    """
+    limit = int(request.args.get('limit', polygons_page_size))
+    if not 0 < limit <= polygons_max_page_size:
+        raise ValueError(f"Invalid limit: {limit}, expected 1 to {polygons_max_page_size}")
+    return limit
+
+
+def find_polygon_by_point(reference, longitude, latitude, level=0, resolution=0):
+    """
+    Find the polygon containing a point, a database connection is only borrowed when there is no index or a
+    simplified geometry or a coarser resolution is asked for.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        longitude (float): Longitude of the point.
+        latitude (float): Latitude of the point.
+        level (int): Simplification level of the geometry.
+        resolution (int): Resolution of the grid pyramid.
+
+    Returns:
+        The polygon object containing the point, or None if not found.
+    """
+    if reference == "STATE":
+        model = PolygonReferencedByState
+    else:
+        model = PolygonReferencedByCountry
+
+    index = indexes.get(reference)
+    if index is not None and level == 0 and resolution == 0:
+        return model.find_polygon_by_point(None, longitude, latitude, index=index)
+    with pool.connection() as conn:
+        return model.find_polygon_by_point(conn, longitude, latitude, level=level, resolution=resolution,
+                                           grid=current_grid(reference))
+
+
+def find_polygons_in_bbox(reference, min_x, min_y, max_x, max_y, level=0, resolution=0, after_id=None, limit=None):
+    """
+    Find the polygons intersecting a bounding box, from the in-memory index when the full resolution is asked for.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        min_x (float): West edge of the box.
+        min_y (float): South edge of the box.
+        max_x (float): East edge of the box.
+        max_y (float): North edge of the box.
+        level (int): Simplification level of the geometries.
+        resolution (int): Resolution of the grid pyramid.
+        after_id (int): Only find the polygons with a greater ID, the last ID of the previous page.
+        limit (int): Most polygons returned, in ID order, every polygon when not given.
+
+    Returns:
+        list: The polygons intersecting the box.
+    """
+    index = indexes.get(reference)
+    if index is not None and level == 0 and resolution == 0:
+        positions = index.find_in_bbox(min_x, min_y, max_x, max_y)
+        if after_id is not None or limit is not None:
+            # Paged in ID order like the database, so a client gets the same pages from either
+            positions = positions[np.argsort(index.ids[positions], kind='stable')]
+            if after_id is not None:
+                positions = positions[index.ids[positions] > after_id]
+            positions = positions[:limit]
+        return [index.polygons[position] for position in positions]
+
+    model = PolygonReferencedByCountry if reference == "COUNTRY" else PolygonReferencedByState
+    with pool.connection() as conn:
+        return model.find_polygons_in_bbox(conn, min_x, min_y, max_x, max_y, level, resolution,
+                                           grid=current_grid(reference), after_id=after_id, limit=limit)
+
+
+def find_nearest_cells(reference, longitude, latitude, k=1, max_distance=None, resolution=0):
+    """
+    Find the k polygons nearest to a point, from the in-memory index when the base cells are asked for.
+
+    Args:
+        reference (str): STATE or COUNTRY.
+        longitude (float): Longitude of the point.
+        latitude (float): Latitude of the point.
+        k (int): Number of polygons to find.
+        max_distance (float): Only find the polygons within this many kilometres, any distance when not given.
+        resolution (int): Resolution of the grid pyramid.
+
+    Returns:
+        list: (polygon, distance in kilometres) pairs, nearest first.
+    """
+    index = indexes.get(reference)
+    if index is not None and resolution == 0:
+        positions, distances = index.find_nearest(longitude, latitude, k, max_distance)
+        return [(index.polygons[position], float(distance)) for position, distance in zip(positions, distances)]
+    with pool.connection() as conn:
+        return find_nearest_polygons(conn, longitude, latitude, referenced_by_country=(reference == "COUNTRY"), k=k,
+                                     max_distance=max_distance, resolution=resolution)
+
+
+def run_extraction(job):
+    """
+    Run an extraction job, see extract_and_save_geojson_file_as_polygons.
+
+    Args:
+        job (Job): The job, its params hold the width, height, resolutions, workers, load_data and incremental of
+                   the request.
+    """
+    params = job.params
+    with pool.connection() as conn:
+        extract_and_save_geojson_file_as_polygons(conn, grid_width=params['width'], grid_height=params['height'],
+                                                  referenced_by_country=(job.reference == "COUNTRY"),
+                                                  workers=params['workers'], load_data=params['load_data'],
+                                                  artifacts_dir=artifacts_dir, job=job,
+                                                  incremental=params['incremental'],
+                                                  resolutions=params['resolutions'])
+    # A new grid version drops the cached exports and rebuilds the index
+    grid_version(job.reference, refresh=True)
+
+
+# Extractions run in the background, one at a time per reference
+jobs = JobManager(run_extraction)
 
 
 @app.route('/')
@@ -26,26 +487,189 @@ def extract_polygons():
     try:
         body = request.get_json()
         reference = body.get('reference')
-        width = body.get('width')
-        height = body.get('height')
-        extract_and_save_geojson_file_as_polygons(conn, grid_width=width, grid_height=height, referenced_by_country=(reference == "COUNTRY"))
-        return success_response(201, 'Data extracted successfully')
+        params = {
+            'width': body.get('width'),
+            'height': body.get('height'),
+            'resolutions': body.get('resolutions', 1),
+            'workers': body.get('workers', 1),
+            'load_data': body.get('load_data', False),
+            'incremental': body.get('incremental', False),
+        }
+        # Rejected now rather than failing in the background job
+        validate_extraction(params['width'], params['height'], params['resolutions'], params['workers'])
+
+        # Queued behind any extraction of the same reference that is still running
+        job = jobs.submit("COUNTRY" if reference == "COUNTRY" else "STATE", params)
+        return success_response(202, job.to_dict())
+    except ValueError as e:
+        return error_response(400, str(e))
     except Exception as e:
         return error_response(500, str(e))
 
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return success_response(200, [job.to_dict() for job in jobs.jobs()])
+
+
+@app.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return error_response(404, f"Job {job_id} not found")
+    return success_response(200, job.to_dict())
+
+
+@app.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return error_response(404, f"Job {job_id} not found")
+    if not job.cancel():
+        return error_response(409, f"Job {job_id} already {job.status}")
+    return success_response(202, job.to_dict())
+
+
 @app.route('/plot/<string:reference>/<float:latitude>/<float:longitude>/<string:export_type>', methods=['GET'])
 def plot_polygons_by_point(reference, latitude, longitude, export_type):
     try:
+        reference = polygon_reference(reference)
+        export_type = ExportType.value_of(export_type)
+        level = simplification_level()
+        resolution = grid_resolution()
+        polygon = find_polygon_by_point(reference, longitude, latitude, level, resolution)
+        render = lambda: export_geo_dataframe([polygon], export_type=export_type,
+                                              referenced_by_country=(reference == "COUNTRY"))
+        if polygon is None:
+            return render()
+
+        return cached_export(reference, f"cell:{polygon_id(polygon)}", export_type, render, level, resolution)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, str(e))
+
+
+@app.route('/lookup/<string:reference>', methods=['POST'])
+def lookup_points(reference):
+    """
+    Resolve a batch of points to the IDs of the polygons containing them, -1 where no polygon does.
+
+    The body is a JSON array, CSV or NumPy binary of (latitude, longitude) pairs, see read_points.
+    The IDs are returned as JSON, or as little-endian int64 values when application/octet-stream is accepted.
+    """
+    try:
+        reference = polygon_reference(reference)
+        latitudes, longitudes = read_points(request.get_data(), request.content_type)
+        resolution = grid_resolution()
+
+        index = lookup_index(reference, resolution)
+        positions = index.find_many(longitudes, latitudes)
+
+        matched = positions >= 0
+        ids = np.full(len(positions), -1, dtype='int64')
+        ids[matched] = index.ids[positions[matched]]
+
+        if request.accept_mimetypes.best == 'application/octet-stream':
+            return Response(ids.astype('<i8').tobytes(), mimetype='application/octet-stream')
+
+        data = {'ids': ids.tolist()}
         if reference == "STATE":
-            polygon = PolygonReferencedByState.find_polygon_by_point(conn, longitude, latitude)
-        else:
-            polygon = PolygonReferencedByCountry.find_polygon_by_point(conn, longitude, latitude)
+            state_codes = np.full(len(positions), None, dtype=object)
+            state_codes[matched] = index.state_codes[positions[matched]]
+            data['state_codes'] = state_codes.tolist()
+        return success_response(200, data)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, str(e))
+
+
+@app.route('/polygons', methods=['GET'])
+def get_polygons_in_viewport():
+    """
+    Export one page of the polygons intersecting a viewport, in ID order.
+
+    When there may be more polygons, the ID of the last one is returned in the X-Next-Cursor header and is passed
+    back as the cursor query parameter to get the next page.
+    """
+    try:
+        reference = polygon_reference(request.args.get('reference', "STATE"))
+        export_type = ExportType.value_of(request.args.get('export_type', ExportType.GEO_JSON.value))
+        min_x, min_y, max_x, max_y = bounding_box()
+        limit = page_size()
+        after_id = int(request.args['cursor']) if request.args.get('cursor') else None
+        level = simplification_level()
+        resolution = grid_resolution()
 
-        result = export_geo_dataframe([polygon], export_type=ExportType.value_of(export_type),
-                                      referenced_by_country=(reference == "COUNTRY"))
+        # One polygon more than the page tells whether there is a next page
+        polygons = find_polygons_in_bbox(reference, min_x, min_y, max_x, max_y, level, resolution, after_id,
+                                         limit + 1)
+        page = polygons[:limit]
+        response = Response(export_geo_dataframe(page, export_type=export_type,
+                                                 referenced_by_country=(reference == "COUNTRY"), stream=True),
+                            mimetype=mimetypes[export_type])
+        if len(polygons) > limit:
+            response.headers['X-Next-Cursor'] = str(polygon_id(page[-1]))
+        return response
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, str(e))
+
+
+@app.route('/nearest/<string:reference>', methods=['GET'])
+def nearest_cells(reference):
+    """
+    Find the k cells nearest to a point, to snap a point just outside the grid (on the coast, at a border or
+    from GPS jitter) to the closest cells instead of retrying around it.
+    """
+    try:
+        reference = polygon_reference(reference)
+        if 'latitude' not in request.args or 'longitude' not in request.args:
+            raise ValueError("latitude and longitude are required")
+        latitude = float(request.args['latitude'])
+        longitude = float(request.args['longitude'])
+        k = int(request.args.get('k', 1))
+        if not 0 < k <= nearest_max_k:
+            raise ValueError(f"Invalid k: {k}, expected 1 to {nearest_max_k}")
+        max_distance = float(request.args['max_distance']) if 'max_distance' in request.args else None
+        if max_distance is not None and not max_distance > 0:
+            raise ValueError(f"Invalid max_distance: {max_distance}, expected a positive number of kilometres")
+        resolution = grid_resolution()
+
+        cells = []
+        for polygon, distance in find_nearest_cells(reference, longitude, latitude, k, max_distance, resolution):
+            cell = {'id': polygon_id(polygon), 'distance_km': distance, 'grid_col': polygon.grid_col,
+                    'grid_row': polygon.grid_row, **cell_properties(polygon)}
+            if reference == "STATE":
+                cell['state_code'] = polygon.state.code if polygon.state is not None else None
+            cells.append(cell)
+        return success_response(200, {'cells': cells})
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, str(e))
+
+
+@app.route('/plot/<string:reference>/cells/<int:cell_id>/children/<string:export_type>', methods=['GET'])
+def plot_child_polygons(reference, cell_id, export_type):
+    """
+    Export the cells a cell was split into at the next finer resolution, to drill down into the pyramid.
+    """
+    try:
+        reference = polygon_reference(reference)
+        export_type = ExportType.value_of(export_type)
+        level = simplification_level()
+        model = PolygonReferencedByCountry if reference == "COUNTRY" else PolygonReferencedByState
 
-        return result
+        def render():
+            with pool.connection() as conn:
+                polygons = model.find_child_polygons(conn, cell_id, level)
+            return export_geo_dataframe(polygons, export_type=export_type,
+                                        referenced_by_country=(reference == "COUNTRY"), stream=True)
+
+        return cached_export(reference, f"children:{cell_id}", export_type, render, level)
     except ValueError as e:
         return error_response(400, str(e))
     except Exception as e:
@@ -55,17 +679,107 @@ def plot_polygons_by_point(reference, latitude, longitude, export_type):
 @app.route('/plot/<string:export_type>', methods=['GET'])
 def plot_state_polygons(export_type):
     try:
-        state_codes = request.args.get('state_codes').split(",")
+        export_type = ExportType.value_of(export_type)
+        # Every state when no state codes are given
+        state_codes = sorted({code.strip().upper() for code in request.args.get('state_codes', ALL).split(",")})
         print(state_codes)
-        polygons = PolygonReferencedByState.find_polygons_by_state(conn, state_codes)
-        result = export_geo_dataframe(polygons, export_type=ExportType.value_of(export_type),
-                                      referenced_by_country=False)
+        level = simplification_level()
+        resolution = grid_resolution()
+
+        # The artifacts are rendered from the base cells
+        if len(state_codes) == 1 and resolution == 0:
+            artifact = find_artifact("STATE", artifact_name(state_codes[0], level), export_type)
+            if artifact is not None:
+                return artifact_response("STATE", *artifact, export_type)
+        if state_codes == [ALL]:
+            raise ValueError("state_codes is required when no artifacts have been written")
+
+        def polygons():
+            # The connection stays borrowed while the rows are streamed from its cursor
+            with pool.connection() as conn:
+                yield from PolygonReferencedByState.iter_polygons_by_state(conn, state_codes, level, resolution)
+
+        def render():
+            # GeoJSON, KML and KMZ are streamed feature by feature instead of being built in memory first
+            return export_geo_dataframe(polygons(), export_type=export_type, referenced_by_country=False,
+                                        stream=True)
+
+        return cached_export("STATE", state_codes, export_type, render, level, resolution)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, str(e))
+
+
+@app.route('/artifacts/<string:reference>', methods=['GET'])
+def list_artifacts(reference):
+    """
+    List the versioned URLs of the precomputed artifacts of the current grid version.
+    """
+    try:
+        urls = {}
+        version = grid_version(reference)
+        manifest = read_manifest(artifacts_dir, reference, version) if artifacts_dir is not None else None
+        for name, files in (manifest or {}).get('artifacts', {}).items():
+            urls[name] = {export_type: url_for('get_artifact', reference=reference, version=version,
+                                               file_name=entry['file'])
+                          for export_type, entry in files.items()}
+        return success_response(200, {'version': version, 'artifacts': urls})
+    except Exception as e:
+        return error_response(500, str(e))
+
 
-        return result
+@app.route('/artifacts/<string:reference>/<int:version>/<string:file_name>', methods=['GET'])
+def get_artifact(reference, version, file_name):
+    """
+    Serve a precomputed artifact from its versioned, content-addressed URL.
+    """
+    if artifacts_dir is None or reference not in ("STATE", "COUNTRY"):
+        abort(404)
+    try:
+        name, etag, extension = file_name.split('.')
+        export_type = ExportType.value_of(extension)
+    except ValueError:
+        abort(404)
+    return artifact_response(reference, version, {'file': file_name, 'etag': etag}, export_type, immutable=True)
+
+
+@app.route('/tiles/<string:reference>/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+def get_tile(reference, z, x, y):
+    """
+    Serve the cells intersecting a web mercator tile as a Mapbox Vector Tile, simplified for the zoom level.
+    """
+    try:
+        reference = polygon_reference(reference)
+        level = level_for_zoom(z)
+        # Cells narrower than a few pixels are drawn from the coarser resolution they were cut from
+        if 'resolution' in request.args:
+            resolution = grid_resolution()
+        else:
+            resolution = resolution_for_zoom(current_grid(reference), z)
+        key = ExportCache.tile_key(reference, z, x, y, grid_version(reference), level, resolution)
+        content = tile_cache.get(key)
+        if content is None:
+            polygons = find_polygons_in_bbox(reference, *tile_query_bounds(z, x, y), level, resolution)
+            content = render_tile(polygons, z, x, y, layer_name=reference.lower())
+            tile_cache.put(key, content)
+
+        response = Response(content, mimetype='application/vnd.mapbox-vector-tile')
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except ValueError as e:
+        return error_response(400, str(e))
     except Exception as e:
         return error_response(500, str(e))
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    return success_response(200, {'pool': pool.stats(), 'export_cache': export_cache.stats(),
+                                  'tile_cache': tile_cache.stats()})
+
+
 def success_response(code, data):
     return jsonify({
         'code': code,